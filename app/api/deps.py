@@ -5,12 +5,12 @@
 # @Description:
 from __future__ import annotations
 
-from typing import Generator
+from typing import Generator, Optional
 
 from sqlalchemy.orm import Session
 
 from app.infra.db import SessionLocal
-from app.services import ProfileService
+from app.services import ProfileService, VoiceChatService
 
 
 def get_db() -> Generator[Session, None, None]:
@@ -26,3 +26,14 @@ _profile_service = ProfileService()
 
 def get_profile_service() -> ProfileService:
     return _profile_service
+
+
+_voice_service: Optional[VoiceChatService] = None
+
+
+def get_voice_service() -> VoiceChatService:
+    # 延迟创建：构造时会初始化语音 / 大模型客户端，只用家长接口时不需要（配置了讯飞时 app.main 启动时就创建并预热连接池）
+    global _voice_service
+    if _voice_service is None:
+        _voice_service = VoiceChatService()
+    return _voice_service
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+# @File: voice_ws.py
+# @Author: yaccii
+# @Time: 2025-11-17 20:51
+# @Description:
+"""
+WebSocket 语音对话入口（网页模拟器 / 直连后端的新固件，不经过 MQTT broker）：
+
+    /ws/voice/{device_sn}
+
+客户端 → 服务端：
+    - 二进制帧：16k 单声道 16bit PCM，一轮的第一帧到达就开始流式 ASR
+    - 文本帧 {"type": "end"} 或空二进制帧：孩子说完了，本轮音频结束
+
+服务端 → 客户端：
+    - 文本帧 {"type": "asr_partial", "text"}：识别中间结果（可能被后续结果修正），用于实时字幕
+    - 二进制帧：回复语音 PCM，TTS 边合成边下发
+    - 文本帧 {"type": "reply_end", "session_id", "turn_id", "user_text", "reply_text"}：本轮结束
+    - 文本帧 {"type": "error", "message"}：本轮失败，连接保持，可以继续下一轮
+
+同一连接内的多轮复用同一个会话，断开时结束会话（生成标题）。
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+from typing import Any, Optional, Union
+
+from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect
+
+from app.api.deps import get_voice_service
+from app.infra.db import SessionLocal
+from app.infra.ylogger import ylogger
+from app.services import VoiceChatService
+from app.speech.asr_xfyun import AudioFormatError, SpeechError
+from app.speech.pcm_stream import PcmStream
+
+router = APIRouter(tags=["voice"])
+
+# 出站消息：bytes 为回复 PCM，dict 为控制消息，None 表示发送结束
+_Outgoing = Optional[Union[bytes, dict]]
+
+
+class _VoiceConnection:
+    """一条 WebSocket 连接上的轮次处理：收音频、跑一轮、按顺序回发。"""
+
+    def __init__(self, websocket: WebSocket, device_sn: str, service: VoiceChatService) -> None:
+        self._ws = websocket
+        self._device_sn = device_sn
+        self._service = service
+
+        self._outgoing: "asyncio.Queue[_Outgoing]" = asyncio.Queue()
+        self._pcm_stream: Optional[PcmStream] = None
+        self._turn_task: Optional[asyncio.Task] = None
+        self._session_id: Optional[int] = None
+
+    async def serve(self) -> None:
+        sender = asyncio.create_task(self._send_loop())
+        try:
+            while True:
+                message = await self._ws.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+
+                data = message.get("bytes")
+                if data is not None:
+                    if data:
+                        await self._on_audio(data)
+                    else:
+                        self._end_utterance()
+                    continue
+
+                self._on_text(message.get("text") or "")
+        except WebSocketDisconnect:
+            pass
+        finally:
+            self._end_utterance()
+            if self._turn_task is not None:
+                await asyncio.gather(self._turn_task, return_exceptions=True)
+            self._outgoing.put_nowait(None)
+            await asyncio.gather(sender, return_exceptions=True)
+            await self._end_session()
+
+    async def _on_audio(self, pcm: bytes) -> None:
+        if self._pcm_stream is None:
+            # 上一轮还在回复时先等它结束，保证同一连接内轮次串行、会话 seq 连续
+            if self._turn_task is not None:
+                await asyncio.gather(self._turn_task, return_exceptions=True)
+            self._pcm_stream = PcmStream()
+            self._turn_task = asyncio.create_task(self._run_turn(self._pcm_stream))
+
+        if not self._pcm_stream.push(pcm):
+            # 超出单轮上限，按说完处理
+            self._end_utterance()
+
+    def _on_text(self, text: str) -> None:
+        try:
+            payload: Any = json.loads(text)
+        except ValueError:
+            payload = None
+        if not isinstance(payload, dict) or payload.get("type") != "end":
+            ylogger.warning("Ignore unexpected websocket text frame: device_sn=%s, text=%.100s", self._device_sn, text)
+            return
+        self._end_utterance()
+
+    def _end_utterance(self) -> None:
+        if self._pcm_stream is not None:
+            self._pcm_stream.close()
+            self._pcm_stream = None
+
+    async def _run_turn(self, pcm_stream: PcmStream) -> None:
+        db = SessionLocal()
+        try:
+            result = await self._service.handle_stream_turn(
+                db=db,
+                device_sn=self._device_sn,
+                pcm_stream=pcm_stream,
+                on_reply_audio=self._on_reply_audio,
+                resume_session_id=self._session_id,
+                on_asr_partial=self._on_asr_partial,
+            )
+            self._session_id = result.session_id
+            self._outgoing.put_nowait(
+                {
+                    "type": "reply_end",
+                    "session_id": result.session_id,
+                    "turn_id": result.turn_id,
+                    "user_text": result.user_text,
+                    "reply_text": result.reply_text,
+                }
+            )
+        except (AudioFormatError, SpeechError, ValueError) as e:
+            ylogger.error("WebSocket voice turn failed: device_sn=%s, error=%s", self._device_sn, e)
+            self._outgoing.put_nowait({"type": "error", "message": str(e)})
+        except Exception as e:  # noqa: BLE001
+            ylogger.exception("WebSocket voice turn failed: device_sn=%s, error=%s", self._device_sn, e)
+            self._outgoing.put_nowait({"type": "error", "message": "internal error"})
+        finally:
+            pcm_stream.close()
+            db.close()
+
+    def _on_asr_partial(self, text: str) -> None:
+        self._outgoing.put_nowait({"type": "asr_partial", "text": text})
+
+    def _on_reply_audio(self, pcm: bytes, is_last: bool) -> None:
+        # TTS 回调在事件循环线程里，不能阻塞：放进发送队列，由发送任务按顺序写出
+        if pcm:
+            self._outgoing.put_nowait(pcm)
+
+    async def _send_loop(self) -> None:
+        while True:
+            item = await self._outgoing.get()
+            if item is None:
+                return
+            try:
+                if isinstance(item, bytes):
+                    await self._ws.send_bytes(item)
+                else:
+                    await self._ws.send_text(json.dumps(item, ensure_ascii=False))
+            except (WebSocketDisconnect, RuntimeError):
+                # 客户端已断开：丢弃剩余的回复，本轮仍然正常落库
+                continue
+
+    async def _end_session(self) -> None:
+        if self._session_id is None:
+            return
+
+        def _end() -> None:
+            db = SessionLocal()
+            try:
+                self._service.end_session(db, self._session_id)  # type: ignore[arg-type]
+            finally:
+                db.close()
+
+        try:
+            await asyncio.to_thread(_end)
+        except Exception as e:  # noqa: BLE001
+            ylogger.warning("End websocket session failed: session_id=%s, error=%s", self._session_id, e)
+
+
+@router.websocket("/ws/voice/{device_sn}")
+async def voice_websocket(
+    websocket: WebSocket,
+    device_sn: str,
+    service: VoiceChatService = Depends(get_voice_service),
+) -> None:
+    await websocket.accept()
+    ylogger.info("WebSocket voice connected: device_sn=%s", device_sn)
+    await _VoiceConnection(websocket, device_sn, service).serve()
+    ylogger.info("WebSocket voice disconnected: device_sn=%s", device_sn)
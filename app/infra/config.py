@@ -60,6 +60,85 @@ class Settings(BaseSettings):
         description="MQTT 密码（可选）",
         validation_alias=AliasChoices("MQTT_PASSWORD", "mqtt_password"),
     )
+    MQTT_TRANSPORT: str = Field(
+        "asyncio",
+        description="MQTT 收发方式: asyncio（socket 挂在网关事件循环上）/ paho（paho 网络线程，兜底；MQTT_SHARED_ORDERING=redis 时固定使用）",
+        validation_alias=AliasChoices("MQTT_TRANSPORT", "mqtt_transport"),
+    )
+    MQTT_MAX_CONCURRENT_TURNS: int = Field(
+        8,
+        description="网关同时处理的对话轮数（worker 数），同一设备的轮次始终串行",
+        validation_alias=AliasChoices("MQTT_MAX_CONCURRENT_TURNS", "mqtt_max_concurrent_turns"),
+    )
+    MQTT_INTAKE_QUEUE_SIZE: int = Field(
+        200,
+        description="网关待处理语音请求队列上限，超出后丢弃新请求",
+        validation_alias=AliasChoices("MQTT_INTAKE_QUEUE_SIZE", "mqtt_intake_queue_size"),
+    )
+    MQTT_MAX_PENDING_TURNS: int = Field(
+        64,
+        description="准入控制：已接收未完成（排队 + 处理中）的轮次上限，超出直接回复忙碌提示",
+        validation_alias=AliasChoices("MQTT_MAX_PENDING_TURNS", "mqtt_max_pending_turns"),
+    )
+    MQTT_MAX_PENDING_AUDIO_BYTES: int = Field(
+        32 * 1024 * 1024,
+        description="准入控制：已接收未完成的请求音频总字节上限",
+        validation_alias=AliasChoices("MQTT_MAX_PENDING_AUDIO_BYTES", "mqtt_max_pending_audio_bytes"),
+    )
+    MQTT_BUSY_REPLY_TEXT: str = Field(
+        "小悠现在有点忙，过一会儿再和我说话好不好？",
+        description="网关过载时回复的忙碌提示文案（启动时预合成并缓存）",
+        validation_alias=AliasChoices("MQTT_BUSY_REPLY_TEXT", "mqtt_busy_reply_text"),
+    )
+    MQTT_BUSY_REPLY_WAV: Optional[str] = Field(
+        None,
+        description="忙碌提示 WAV 文件路径（可选，配置后不再启动时合成）",
+        validation_alias=AliasChoices("MQTT_BUSY_REPLY_WAV", "mqtt_busy_reply_wav"),
+    )
+    MQTT_REPLY_MODE: str = Field(
+        "both",
+        description="回复下发方式: wav（整段 WAV，老固件）/ stream（分片流式）/ both（两者都发）",
+        validation_alias=AliasChoices("MQTT_REPLY_MODE", "mqtt_reply_mode"),
+    )
+    MQTT_DEDUP_TTL_SECONDS: int = Field(
+        60,
+        description="重复请求去重窗口（秒），窗口内同设备同内容 / 同 request id 的请求直接重放回复；0 表示关闭",
+        validation_alias=AliasChoices("MQTT_DEDUP_TTL_SECONDS", "mqtt_dedup_ttl_seconds"),
+    )
+    MQTT_DEDUP_MAX_BYTES: int = Field(
+        32 * 1024 * 1024,
+        description="去重缓存中回复音频的总字节上限",
+        validation_alias=AliasChoices("MQTT_DEDUP_MAX_BYTES", "mqtt_dedup_max_bytes"),
+    )
+    MQTT_SESSION_IDLE_SECONDS: int = Field(
+        300,
+        description="同一设备连续轮次复用会话的空闲窗口（秒），超时后后台结束会话；0 表示每轮新建会话",
+        validation_alias=AliasChoices("MQTT_SESSION_IDLE_SECONDS", "mqtt_session_idle_seconds"),
+    )
+
+    # MQTT 多实例部署
+    MQTT_SHARED_GROUP: Optional[str] = Field(
+        None,
+        description="共享订阅分组名；配置后启用多实例模式（MQTT 5，订阅 $share/<group>/toy/+/voice/request）",
+        validation_alias=AliasChoices("MQTT_SHARED_GROUP", "mqtt_shared_group"),
+    )
+    MQTT_INSTANCE_ID: Optional[str] = Field(
+        None,
+        description="网关实例 id，用于生成唯一 client id；默认 hostname-pid",
+        validation_alias=AliasChoices("MQTT_INSTANCE_ID", "mqtt_instance_id"),
+    )
+    MQTT_SHARED_ORDERING: str = Field(
+        "redis",
+        description="多实例下同设备轮次的顺序保证: redis（跨实例 ticket lock）/ broker（依赖 broker 按 clientid 粘性分发）",
+        validation_alias=AliasChoices("MQTT_SHARED_ORDERING", "mqtt_shared_ordering"),
+    )
+
+    # Redis（多实例协调 / 会话共享，可选）
+    REDIS_URL: Optional[str] = Field(
+        None,
+        description="Redis 连接串，例如 redis://127.0.0.1:6379/0",
+        validation_alias=AliasChoices("REDIS_URL", "redis_url"),
+    )
 
     # 讯飞语音（ASR/TTS）
     XFYUN_APPID: str = Field(
@@ -77,6 +156,101 @@ class Settings(BaseSettings):
         description="讯飞 APISecret",
         validation_alias=AliasChoices("XFYUN_APISECRET", "xfyun_apisecret"),
     )
+    XFYUN_WS_BASE_URL: str = Field(
+        "wss://ws-api.xfyun.cn",
+        description="讯飞 ASR / TTS WebSocket 服务地址；压测时指向本地模拟服务（benchmarks/xfyun_emulator.py）",
+        validation_alias=AliasChoices("XFYUN_WS_BASE_URL", "xfyun_ws_base_url"),
+    )
+    ASR_PACING: str = Field(
+        "burst",
+        description="整段音频上传 ASR 的节奏: burst（不限速）/ realtime（按音频时长匀速发送）",
+        validation_alias=AliasChoices("ASR_PACING", "asr_pacing"),
+    )
+    ASR_FRAME_BYTES: int = Field(
+        8000,
+        description="整段音频上传 ASR 时每帧的 PCM 字节数（8000 = 250ms）",
+        validation_alias=AliasChoices("ASR_FRAME_BYTES", "asr_frame_bytes"),
+    )
+    ASR_WPGS: bool = Field(
+        True,
+        description="流式 ASR 是否开启讯飞动态修正（wpgs），中间结果会改写前文，仅中文普通话支持",
+        validation_alias=AliasChoices("ASR_WPGS", "asr_wpgs"),
+    )
+    VAD_ENABLED: bool = Field(
+        True,
+        description="ASR 前做 VAD：裁掉前后静音，整段没有人声时直接回复提示，不调用 ASR / LLM / TTS",
+        validation_alias=AliasChoices("VAD_ENABLED", "vad_enabled"),
+    )
+    VAD_NO_SPEECH_REPLY_TEXT: str = Field(
+        "我没有听清楚哦，可以再说一遍吗？",
+        description="没有检测到有效语音时的回复文案（第一次用到时合成并缓存）",
+        validation_alias=AliasChoices("VAD_NO_SPEECH_REPLY_TEXT", "vad_no_speech_reply_text"),
+    )
+    XFYUN_WS_POOL_SIZE: int = Field(
+        2,
+        description="ASR / TTS 各自预热的讯飞 WebSocket 连接数，0 表示不预热、每次现连",
+        validation_alias=AliasChoices("XFYUN_WS_POOL_SIZE", "xfyun_ws_pool_size"),
+    )
+    XFYUN_WS_POOL_MAX_IDLE_SECONDS: float = Field(
+        8.0,
+        description="预热连接的最长空闲时间（秒），到期前会换上新连接，需小于讯飞服务端的空闲断开时间，上限为签名有效期 300 秒",
+        validation_alias=AliasChoices("XFYUN_WS_POOL_MAX_IDLE_SECONDS", "xfyun_ws_pool_max_idle_seconds"),
+    )
+    TTS_VCN: str = Field(
+        "xiaoyan",
+        description="讯飞 TTS 发音人",
+        validation_alias=AliasChoices("TTS_VCN", "tts_vcn"),
+    )
+    TTS_SPEED: int = Field(
+        50,
+        description="讯飞 TTS 语速（0~100）",
+        validation_alias=AliasChoices("TTS_SPEED", "tts_speed"),
+    )
+    TTS_VOLUME: int = Field(
+        50,
+        description="讯飞 TTS 音量（0~100）",
+        validation_alias=AliasChoices("TTS_VOLUME", "tts_volume"),
+    )
+    TTS_PIPELINE_ENABLED: bool = Field(
+        True,
+        description="TTS 分句流水线：多句回复按句并发合成、按顺序下发，首句音频不用等整段合成完",
+        validation_alias=AliasChoices("TTS_PIPELINE_ENABLED", "tts_pipeline_enabled"),
+    )
+    TTS_PIPELINE_CONCURRENCY: int = Field(
+        3,
+        description="分句流水线同时请求讯飞的最大句数",
+        validation_alias=AliasChoices("TTS_PIPELINE_CONCURRENCY", "tts_pipeline_concurrency"),
+    )
+    TTS_PIPELINE_MAX_SEGMENT_CHARS: int = Field(
+        60,
+        description="单句最大字数，超过时在逗号处再切（决定首句音频的最长合成耗时）",
+        validation_alias=AliasChoices("TTS_PIPELINE_MAX_SEGMENT_CHARS", "tts_pipeline_max_segment_chars"),
+    )
+    TTS_CACHE_ENABLED: bool = Field(
+        True,
+        description="缓存 TTS 合成结果（按文本 + 发音参数寻址），重复的回复文案不再请求讯飞",
+        validation_alias=AliasChoices("TTS_CACHE_ENABLED", "tts_cache_enabled"),
+    )
+    TTS_CACHE_MEMORY_MAX_BYTES: int = Field(
+        32 * 1024 * 1024,
+        description="TTS 缓存内存层的 PCM 总字节上限（LRU 淘汰）",
+        validation_alias=AliasChoices("TTS_CACHE_MEMORY_MAX_BYTES", "tts_cache_memory_max_bytes"),
+    )
+    TTS_CACHE_DIR: Optional[str] = Field(
+        None,
+        description="TTS 缓存磁盘层目录，不填为 {FILE_BASE_PATH}/tts_cache",
+        validation_alias=AliasChoices("TTS_CACHE_DIR", "tts_cache_dir"),
+    )
+    TTS_CACHE_DISK_MAX_BYTES: int = Field(
+        256 * 1024 * 1024,
+        description="TTS 缓存磁盘层的总字节上限（淘汰最久未访问的文件）；0 表示只用内存层",
+        validation_alias=AliasChoices("TTS_CACHE_DISK_MAX_BYTES", "tts_cache_disk_max_bytes"),
+    )
+    TTS_CACHE_PREWARM_TEXTS: str = Field(
+        "",
+        description="启动时预合成进缓存的固定话术（问候语等），多条用 | 分隔；兜底回复和没听清提示总会预合成",
+        validation_alias=AliasChoices("TTS_CACHE_PREWARM_TEXTS", "tts_cache_prewarm_texts"),
+    )
 
     # 大模型默认 provider
     LLM_DEFAULT_PROVIDER: str = Field(
@@ -84,6 +258,91 @@ class Settings(BaseSettings):
         description="默认大模型 provider: deepseek / openai / dummy 等",
         validation_alias=AliasChoices("LLM_DEFAULT_PROVIDER", "llm_default_provider"),
     )
+    LLM_STREAM_ENABLED: bool = Field(
+        True,
+        description="流式调用大模型：每生成完整一句就做安全检查并交给 TTS，不用等整段回复生成完",
+        validation_alias=AliasChoices("LLM_STREAM_ENABLED", "llm_stream_enabled"),
+    )
+    LLM_ROUTES: str = Field(
+        "deepseek:deepseek-chat:2,deepseek:deepseek-reasoner:3",
+        description="大模型候选 provider:model:质量档位，逗号分隔；按延迟和失败率在满足档位的候选间路由",
+        validation_alias=AliasChoices("LLM_ROUTES", "llm_routes"),
+    )
+    LLM_TASK_MIN_TIERS: str = Field(
+        "chat:2",
+        description="各场景要求的最低质量档位 task:tier，逗号分隔；未配置的场景要求 1",
+        validation_alias=AliasChoices("LLM_TASK_MIN_TIERS", "llm_task_min_tiers"),
+    )
+    LLM_ROUTING_TIMEOUT_SECONDS: float = Field(
+        10.0,
+        description="单个候选超过这么久没有结果（流式为首包）就换下一个候选",
+        validation_alias=AliasChoices("LLM_ROUTING_TIMEOUT_SECONDS", "llm_routing_timeout_seconds"),
+    )
+    LLM_ROUTING_WINDOW_SECONDS: float = Field(
+        300.0,
+        description="路由统计的滑动窗口（秒），排序用窗口内成功调用的 p50 耗时",
+        validation_alias=AliasChoices("LLM_ROUTING_WINDOW_SECONDS", "llm_routing_window_seconds"),
+    )
+    LLM_ROUTING_MAX_ERROR_RATE: float = Field(
+        0.5,
+        description="最近几次调用的失败率达到该值的候选降级（排到 dummy 之后）",
+        validation_alias=AliasChoices("LLM_ROUTING_MAX_ERROR_RATE", "llm_routing_max_error_rate"),
+    )
+    LLM_ROUTING_SLOW_MS: float = Field(
+        6000.0,
+        description="最近几次调用的 p50 耗时超过该值（毫秒）的候选降级（排到 dummy 之后）",
+        validation_alias=AliasChoices("LLM_ROUTING_SLOW_MS", "llm_routing_slow_ms"),
+    )
+    LLM_ROUTING_PROBE_SECONDS: float = Field(
+        30.0,
+        description="降级 / 没有样本的候选每隔多少秒在后台发一个影子请求探测（只更新统计，不影响回复）",
+        validation_alias=AliasChoices("LLM_ROUTING_PROBE_SECONDS", "llm_routing_probe_seconds"),
+    )
+    LLM_HEDGE_ENABLED: bool = Field(
+        False,
+        description="对冲请求：首选模型超过自身耗时分位还没结果时，同时请求下一个候选，先返回的胜出、另一个取消",
+        validation_alias=AliasChoices("LLM_HEDGE_ENABLED", "llm_hedge_enabled"),
+    )
+    LLM_HEDGE_PERCENTILE: float = Field(
+        0.9,
+        description="对冲延迟取首选模型最近成功调用耗时的这个分位（流式为首包耗时）",
+        validation_alias=AliasChoices("LLM_HEDGE_PERCENTILE", "llm_hedge_percentile"),
+    )
+    LLM_HEDGE_MIN_DELAY_MS: float = Field(
+        800.0,
+        description="对冲延迟下限（毫秒）",
+        validation_alias=AliasChoices("LLM_HEDGE_MIN_DELAY_MS", "llm_hedge_min_delay_ms"),
+    )
+    LLM_HEDGE_BUDGET_RATIO: float = Field(
+        0.1,
+        description="全局对冲预算：统计窗口内对冲次数不超过调用次数的这个比例",
+        validation_alias=AliasChoices("LLM_HEDGE_BUDGET_RATIO", "llm_hedge_budget_ratio"),
+    )
+    LLM_HEDGE_CHILD_MAX: int = Field(
+        3,
+        description="每个孩子在统计窗口内最多对冲几次",
+        validation_alias=AliasChoices("LLM_HEDGE_CHILD_MAX", "llm_hedge_child_max"),
+    )
+    LLM_REPLY_CACHE_ENABLED: bool = Field(
+        False,
+        description="回复缓存：没有对话历史的通用问题按 (归一化原话, system prompt) 缓存大模型回复，命中跳过大模型",
+        validation_alias=AliasChoices("LLM_REPLY_CACHE_ENABLED", "llm_reply_cache_enabled"),
+    )
+    LLM_REPLY_CACHE_MAX_ENTRIES: int = Field(
+        2000,
+        description="回复缓存最多保留多少个问题（LRU 淘汰）",
+        validation_alias=AliasChoices("LLM_REPLY_CACHE_MAX_ENTRIES", "llm_reply_cache_max_entries"),
+    )
+    LLM_REPLY_CACHE_TTL_SECONDS: float = Field(
+        6 * 3600,
+        description="每条缓存回复的有效期（秒），过期后重新向大模型要新说法",
+        validation_alias=AliasChoices("LLM_REPLY_CACHE_TTL_SECONDS", "llm_reply_cache_ttl_seconds"),
+    )
+    LLM_REPLY_CACHE_VARIANTS: int = Field(
+        3,
+        description="每个问题攒够几种不同回复才开始命中；命中时随机挑一种且不连续重复",
+        validation_alias=AliasChoices("LLM_REPLY_CACHE_VARIANTS", "llm_reply_cache_variants"),
+    )
 
     # DeepSeek
     DEEPSEEK_API_KEY: Optional[str] = Field(
@@ -96,6 +355,21 @@ class Settings(BaseSettings):
         description="DeepSeek API base url，例如 https://api.deepseek.com",
         validation_alias=AliasChoices("DEEPSEEK_BASE_URL", "deepseek_base_url"),
     )
+    DEEPSEEK_MAX_CONNECTIONS: int = Field(
+        32,
+        description="DeepSeek HTTP 连接池大小（keep-alive 复用），也是同时在途的大模型请求上限",
+        validation_alias=AliasChoices("DEEPSEEK_MAX_CONNECTIONS", "deepseek_max_connections"),
+    )
+    DEEPSEEK_TIMEOUT_SECONDS: float = Field(
+        30.0,
+        description="单次大模型调用的超时（秒；流式时是两段增量之间的最长等待）",
+        validation_alias=AliasChoices("DEEPSEEK_TIMEOUT_SECONDS", "deepseek_timeout_seconds"),
+    )
+    DEEPSEEK_CONNECT_TIMEOUT_SECONDS: float = Field(
+        5.0,
+        description="建立到 DeepSeek 的连接的超时（秒）",
+        validation_alias=AliasChoices("DEEPSEEK_CONNECT_TIMEOUT_SECONDS", "deepseek_connect_timeout_seconds"),
+    )
 
     # OpenAI（预留）
     OPENAI_API_KEY: Optional[str] = Field(
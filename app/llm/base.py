@@ -6,7 +6,7 @@
 from __future__ import annotations
 
 from abc import ABC, abstractmethod
-from typing import Any, Dict, List, Mapping, Optional
+from typing import Any, AsyncIterator, Dict, List, Mapping, Optional
 
 ChatMessage = Mapping[str, str]
 
@@ -27,3 +27,32 @@ class LlmProvider(ABC):
         extra_params: Optional[Dict[str, Any]] = None,
     ) -> str:
         raise NotImplementedError
+
+    async def chat_stream(
+        self,
+        messages: List[ChatMessage],
+        model: str,
+        *,
+        max_tokens: int = 256,
+        temperature: float = 0.8,
+        extra_params: Optional[Dict[str, Any]] = None,
+    ) -> AsyncIterator[str]:
+        """
+        流式生成：逐段产出回复文本（增量，不是累计）。
+
+        默认实现退化为一次产出 chat() 的完整结果，不支持流式的 provider 不用覆盖。
+        调用方提前结束迭代时应 aclose()，以便 provider 取消请求。
+        """
+        text = await self.chat(
+            messages,
+            model,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            extra_params=extra_params,
+        )
+        if text:
+            yield text
+
+    async def aclose(self) -> None:
+        """释放 provider 持有的连接池等资源（服务退出时调用），默认什么都不做。"""
+        return None
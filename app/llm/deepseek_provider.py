@@ -5,17 +5,27 @@
 # @Description:
 from __future__ import annotations
 
-import asyncio
-from typing import Any, Dict, List, Optional
+import importlib.util
+from typing import Any, AsyncIterator, Dict, List, Optional
 
-from openai import OpenAI
+import httpx
+from openai import AsyncOpenAI
 
 from app.infra.config import settings
+from app.infra.ylogger import ylogger
 from app.llm.base import ChatMessage, LlmProvider
 
+# 空闲 keep-alive 连接保留多久（秒）；DeepSeek 网关大约 90 秒断开空闲连接，这里提前释放
+_KEEPALIVE_EXPIRY = 60.0
+
 
 class DeepSeekProvider(LlmProvider):
-    """基于 DeepSeek OpenAI-兼容接口的实现。"""
+    """
+    基于 DeepSeek OpenAI-兼容接口的实现。
+
+    使用 AsyncOpenAI + 显式设置大小的 httpx 连接池（keep-alive 复用 TLS 连接，装了 h2 时走 HTTP/2），
+    在途请求不占线程，并发上限由 DEEPSEEK_MAX_CONNECTIONS 决定。
+    """
 
     name = "deepseek"
 
@@ -24,33 +34,71 @@ class DeepSeekProvider(LlmProvider):
             raise ValueError("DEEPSEEK_API_KEY 未配置，无法使用 DeepSeekProvider")
 
         base_url = settings.DEEPSEEK_BASE_URL or "https://api.deepseek.com"
-        self._client = OpenAI(
+        max_connections = max(1, int(settings.DEEPSEEK_MAX_CONNECTIONS))
+        # HTTP/2 需要可选依赖 h2（pip install "httpx[http2]"），没装就用 HTTP/1.1 keep-alive
+        http2 = importlib.util.find_spec("h2") is not None
+
+        self._timeout = httpx.Timeout(
+            float(settings.DEEPSEEK_TIMEOUT_SECONDS),
+            connect=float(settings.DEEPSEEK_CONNECT_TIMEOUT_SECONDS),
+        )
+        self._http = httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=_KEEPALIVE_EXPIRY,
+            ),
+            timeout=self._timeout,
+        )
+        self._client = AsyncOpenAI(
             api_key=settings.DEEPSEEK_API_KEY,
             base_url=base_url,
+            http_client=self._http,
+        )
+        ylogger.info(
+            "DeepSeek provider ready: base_url=%s, max_connections=%s, http2=%s, timeout=%ss",
+            base_url,
+            max_connections,
+            http2,
+            settings.DEEPSEEK_TIMEOUT_SECONDS,
         )
 
-    def _chat_sync(
+    def _build_params(
         self,
         messages: List[ChatMessage],
         model: str,
         max_tokens: int,
         temperature: float,
         extra_params: Optional[Dict[str, Any]],
-    ) -> str:
+    ) -> Dict[str, Any]:
         params: Dict[str, Any] = {
             "model": model,
             "messages": list(messages),
             "max_tokens": max_tokens,
             "temperature": temperature,
+            # 每次调用单独的超时，extra_params 里传 timeout 可以覆盖
+            "timeout": self._timeout,
         }
         if extra_params:
             params.update(extra_params)
+        return params
 
-        resp = self._client.chat.completions.create(**params)
+    async def chat(
+        self,
+        messages: List[ChatMessage],
+        model: str,
+        *,
+        max_tokens: int = 256,
+        temperature: float = 0.8,
+        extra_params: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        params = self._build_params(messages, model, max_tokens, temperature, extra_params)
+        resp = await self._client.chat.completions.create(**params)
         content = resp.choices[0].message.content
         return (content or "").strip()
 
-    async def chat(
+    async def chat_stream(
         self,
         messages: List[ChatMessage],
         model: str,
@@ -58,12 +106,25 @@ class DeepSeekProvider(LlmProvider):
         max_tokens: int = 256,
         temperature: float = 0.8,
         extra_params: Optional[Dict[str, Any]] = None,
-    ) -> str:
-        return await asyncio.to_thread(
-            self._chat_sync,
-            messages,
-            model,
-            max_tokens,
-            temperature,
-            extra_params,
-        )
+    ) -> AsyncIterator[str]:
+        """
+        stream=True 流式生成，逐段产出 content 增量（deepseek-reasoner 的 reasoning_content 不产出）。
+
+        调用方提前结束（aclose / 取消）时关闭 HTTP 流，连接不再复用。
+        """
+        params = self._build_params(messages, model, max_tokens, temperature, extra_params)
+        params["stream"] = True
+
+        stream = await self._client.chat.completions.create(**params)
+        try:
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+        finally:
+            await stream.close()
+
+    async def aclose(self) -> None:
+        await self._client.close()
@@ -5,7 +5,8 @@
 # @Description:
 from __future__ import annotations
 
-from typing import Any, Dict, List, Optional
+import asyncio
+from typing import Any, AsyncIterator, Dict, List, Optional
 
 from app.llm.base import ChatMessage, LlmProvider
 
@@ -34,3 +35,18 @@ class DummyProvider(LlmProvider):
             return "小悠在这里，随时可以听你说话。"
 
         return f"小悠听到了，你刚才说的是「{last_user}」。小悠觉得你很认真，也很愿意继续听你分享。"
+
+    async def chat_stream(
+        self,
+        messages: List[ChatMessage],
+        model: str,
+        *,
+        max_tokens: int = 256,
+        temperature: float = 0.8,
+        extra_params: Optional[Dict[str, Any]] = None,
+    ) -> AsyncIterator[str]:
+        """模拟流式输出：每次吐两个字，中间让出事件循环。"""
+        text = await self.chat(messages, model, max_tokens=max_tokens, temperature=temperature)
+        for i in range(0, len(text), 2):
+            yield text[i:i + 2]
+            await asyncio.sleep(0)
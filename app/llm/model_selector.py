@@ -5,43 +5,111 @@
 # @Description:
 from __future__ import annotations
 
-from typing import Any, Dict, Tuple
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 from app.domain.models import Child
 from app.infra.config import settings
+from app.infra.ylogger import ylogger
 from app.llm.base import LlmProvider
 from app.llm.registry import LlmProviderRegistry
+from app.llm.routing import (
+    FailoverProvider,
+    HedgeBudget,
+    HedgePolicy,
+    ModelRoute,
+    RouteStats,
+    parse_routes,
+    parse_task_tiers,
+)
+
+# 兜底候选：本地固定话术，任何档位要求下都排在最后
+_DUMMY_ROUTE = ModelRoute("dummy", "dummy", 0)
 
 
 class LlmModelSelector:
     """
     根据 child + 场景，从注册表里选出要用的 provider + model + 生成参数。
+
+    路由规则：
+    - 候选来自 LLM_ROUTES，只保留质量档位 >= 该 task 要求（LLM_TASK_MIN_TIERS）且 provider 已注册的
+    - 有样本的候选按最近的 p50 耗时从快到慢，没有样本的排在它们后面（按配置顺序）；
+      冷启动时所有候选都没有样本，按配置顺序尝试
+    - 最近几次失败率或耗时超过阈值的候选降级到 dummy 之后
+    - 降级 / 没有样本的候选每 LLM_ROUTING_PROBE_SECONDS 秒最多探测一次：在后台发影子请求，
+      只更新统计，不挡在孩子的回复前面；探测超时是 LLM_ROUTING_TIMEOUT_SECONDS 的 3 倍，慢候选也能测出真实耗时
+    - dummy 固定话术是健康候选都失败后的兜底；LLM_DEFAULT_PROVIDER=dummy 时只用 dummy（本地调试）
+    - LLM_HEDGE_ENABLED 时首选候选慢于自身耗时分位就对冲请求下一个候选，全局和每个孩子各有预算
     """
 
     def __init__(self, registry: LlmProviderRegistry) -> None:
         self._registry = registry
+        self._routes = parse_routes(settings.LLM_ROUTES)
+        self._task_tiers = parse_task_tiers(settings.LLM_TASK_MIN_TIERS)
+        self._timeout = float(settings.LLM_ROUTING_TIMEOUT_SECONDS)
+        # 失败率阈值超过 1 时永远不会因失败降级，按 1 处理（全部失败才降级）
+        self._max_error_rate = min(1.0, max(0.0, float(settings.LLM_ROUTING_MAX_ERROR_RATE)))
+        self._slow_ms = float(settings.LLM_ROUTING_SLOW_MS)
+        self._probe_seconds = float(settings.LLM_ROUTING_PROBE_SECONDS)
+        self._stats = RouteStats(window_seconds=float(settings.LLM_ROUTING_WINDOW_SECONDS))
+        self._hedge: Optional[HedgePolicy] = None
+        if settings.LLM_HEDGE_ENABLED:
+            self._hedge = HedgePolicy(
+                percentile=float(settings.LLM_HEDGE_PERCENTILE),
+                min_delay_ms=float(settings.LLM_HEDGE_MIN_DELAY_MS),
+                budget=HedgeBudget(
+                    ratio=float(settings.LLM_HEDGE_BUDGET_RATIO),
+                    per_child=int(settings.LLM_HEDGE_CHILD_MAX),
+                    window_seconds=float(settings.LLM_ROUTING_WINDOW_SECONDS),
+                ),
+            )
+        # 降级候选上次被放出去探测的时间
+        self._last_probe: Dict[str, float] = {}
 
-    def _choose_provider_name(self) -> str:
-        default_name = (settings.LLM_DEFAULT_PROVIDER or "").strip().lower() or "dummy"
-        available = set(self._registry.available_providers())
-
-        if default_name in available:
-            return default_name
+    def _probe_due(self, key: str, now: float) -> bool:
+        last = self._last_probe.get(key)
+        if last is not None and now - last < self._probe_seconds:
+            return False
+        self._last_probe[key] = now
+        return True
 
-        if "dummy" in available:
-            return "dummy"
+    def _candidates(self, task: str) -> Tuple[List[ModelRoute], Set[str], List[ModelRoute]]:
+        """返回 (按尝试顺序排列的候选, 兜底 / 降级候选的 key, 这次要在后台探测的候选)。"""
+        available = set(self._registry.available_providers())
+        default_name = (settings.LLM_DEFAULT_PROVIDER or "").strip().lower()
+        if default_name == "dummy":
+            routes: List[ModelRoute] = []
+        else:
+            min_tier = self._task_tiers.get(task, 1)
+            routes = [r for r in self._routes if r.tier >= min_tier and r.provider in available]
 
-        if available:
-            return sorted(available)[0]
+        now = time.monotonic()
+        probes: List[ModelRoute] = []
+        degraded: List[ModelRoute] = []
+        ranked: List[Tuple[Tuple[bool, float, int], ModelRoute]] = []
+        for idx, route in enumerate(routes):
+            if self._stats.is_degraded(route.key, max_error_rate=self._max_error_rate, slow_ms=self._slow_ms):
+                degraded.append(route)
+                continue
+            total, p50, _ = self._stats.snapshot(route.key)
+            ranked.append(((total == 0, p50, idx), route))
+        ranked.sort(key=lambda item: item[0])
 
-        raise RuntimeError("没有可用的大模型 provider")
+        # 已经有测过的健康候选当首选时，没有样本的候选只在后台探测，不再排到它前面
+        has_measured = bool(ranked) and not ranked[0][0][0]
+        unmeasured = [route for key, route in ranked if key[0]] if has_measured else []
+        for route in degraded + unmeasured:
+            if self._probe_due(route.key, now):
+                probes.append(route)
 
-    def _default_model_for_provider(self, provider_name: str, task: str) -> str:
-        if provider_name == "deepseek":
-            return "deepseek-reasoner"
-        if provider_name == "dummy":
-            return "dummy"
-        return "default"
+        candidates = [route for _, route in ranked]
+        if "dummy" in available:
+            candidates.append(_DUMMY_ROUTE)
+        candidates.extend(degraded)
+        if not candidates:
+            raise RuntimeError("没有可用的大模型 provider")
+        fallback_keys = {_DUMMY_ROUTE.key} | {route.key for route in degraded}
+        return candidates, fallback_keys, probes
 
     def _default_gen_config(self, provider_name: str, task: str) -> Dict[str, Any]:
         return {
@@ -56,11 +124,32 @@ class LlmModelSelector:
     ) -> Tuple[LlmProvider, str, Dict[str, Any]]:
         """
         返回: (provider 实例, model 名称, 生成参数 dict)
+
+        provider 是按路由顺序自动切换候选的 FailoverProvider，model 是首选候选的模型名；
+        调用后可以看 provider.served_by_fallback 判断回复是否来自 dummy / 降级候选。
         """
-        provider_name = self._choose_provider_name()
-        provider = self._registry.get(provider_name)
+        candidates, fallback_keys, probes = self._candidates(task)
+        plan = [(self._registry.get(route.provider), route) for route in candidates]
+        primary = candidates[0]
 
-        model_name = self._default_model_for_provider(provider_name, task)
-        gen_cfg = self._default_gen_config(provider_name, task)
+        ylogger.info(
+            "LLM route: task=%s, child_id=%s, plan=%s",
+            task,
+            getattr(child, "id", None),
+            " > ".join(self._stats.describe(route.key) for route in candidates),
+        )
+        if probes:
+            ylogger.info("LLM probe in background: %s", ", ".join(route.key for route in probes))
 
-        return provider, model_name, gen_cfg
+        provider = FailoverProvider(
+            plan,
+            self._stats,
+            timeout=self._timeout,
+            hedge=self._hedge,
+            child_id=getattr(child, "id", None),
+            fallback_keys=fallback_keys,
+            probes=[(self._registry.get(route.provider), route) for route in probes],
+            probe_timeout=self._timeout * 3,
+        )
+        gen_cfg = self._default_gen_config(primary.provider, task)
+        return provider, primary.model, gen_cfg
@@ -8,6 +8,7 @@ from __future__ import annotations
 from typing import Dict, Tuple
 
 from app.infra.config import settings
+from app.infra.ylogger import ylogger
 from app.llm.base import LlmProvider
 from app.llm.deepseek_provider import DeepSeekProvider
 from app.llm.dummy_provider import DummyProvider
@@ -28,6 +29,13 @@ class LlmProviderRegistry:
     def available_providers(self) -> Tuple[str, ...]:
         return tuple(self._providers.keys())
 
+    async def aclose(self) -> None:
+        for name, provider in self._providers.items():
+            try:
+                await provider.aclose()
+            except Exception as e:  # noqa: BLE001
+                ylogger.warning("Close LLM provider failed: provider=%s, error=%s", name, e)
+
 
 def build_default_registry() -> LlmProviderRegistry:
     """构建一份默认注册表"""
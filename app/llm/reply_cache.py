@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# @File: reply_cache.py
+# @Author: yaccii
+# @Time: 2025-11-17 17:41
+# @Description:
+"""
+大模型回复缓存：孩子反复问的通用问题（"你叫什么名字"、"讲个故事"、"我们玩游戏吧"）不再每次调用大模型。
+
+- key：归一化后的孩子原话 + system prompt（人设 / 孩子画像）的哈希；只缓存没有对话历史的轮次，
+  带历史的回复依赖上下文，不能复用
+- 每个 key 攒够 variants 种不同的回复才开始命中，命中时随机挑一种、不连续两次用同一种，避免玩具像复读机
+- 每种回复单独过期（TTL），过期后重新向大模型要新说法；key 总数超过上限时按 LRU 淘汰
+"""
+from __future__ import annotations
+
+import hashlib
+import random
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+# 太长的话基本不会重复，不缓存
+_MAX_UTTERANCE_CHARS = 32
+_NON_WORD = re.compile(r"[\W_]+")
+# 句首的语气填充词 / 句末的语气词不影响意思："嗯，讲个故事吧" 和 "讲个故事" 是同一个问题
+_LEADING_FILLERS = "嗯呃额"
+_TRAILING_PARTICLES = "吧呀啊呢嘛哦喔啦"
+
+
+def normalize_utterance(text: str) -> str:
+    """全半角 / 大小写统一，去掉空白、标点和语气词。"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    text = _NON_WORD.sub("", text)
+    return text.lstrip(_LEADING_FILLERS).rstrip(_TRAILING_PARTICLES)
+
+
+@dataclass
+class _Entry:
+    # (写入时间, 回复文本)
+    variants: List[Tuple[float, str]] = field(default_factory=list)
+    last_served: int = -1
+
+
+class ReplyCache:
+    """内存 LRU 回复缓存，内部加锁。"""
+
+    def __init__(self, *, max_entries: int = 2000, ttl_seconds: float = 6 * 3600, variants: int = 3) -> None:
+        self._max_entries = max(1, max_entries)
+        self._ttl_seconds = ttl_seconds
+        self._variants = max(1, variants)
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+
+        self._hits = 0
+        self._fills = 0
+        self._misses = 0
+
+    @staticmethod
+    def make_key(system_prompt: str, utterance: str) -> Optional[str]:
+        """不适合缓存（归一化后为空或太长）时返回 None。"""
+        normalized = normalize_utterance(utterance)
+        if not normalized or len(normalized) > _MAX_UTTERANCE_CHARS:
+            return None
+        raw = f"{system_prompt}\x00{normalized}"
+        return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """命中时返回一种缓存的回复；还没攒够不同说法时返回 None（调用方去问大模型，再 put 进来）。"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+
+            entry.variants = [(t, reply) for t, reply in entry.variants if now - t < self._ttl_seconds]
+            if not entry.variants:
+                del self._entries[key]
+                self._misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            if len(entry.variants) < self._variants:
+                self._fills += 1
+                return None
+
+            choices = [i for i in range(len(entry.variants)) if i != entry.last_served] or [0]
+            idx = random.choice(choices)
+            entry.last_served = idx
+            self._hits += 1
+            return entry.variants[idx][1]
+
+    def put(self, key: str, reply: str) -> None:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = _Entry()
+                self._entries[key] = entry
+            self._entries.move_to_end(key)
+
+            # 和已有说法完全一样的不算新说法，只刷新时间
+            entry.variants = [(t, r) for t, r in entry.variants if r != reply]
+            entry.variants.append((now, reply))
+            if len(entry.variants) > self._variants:
+                entry.variants = entry.variants[-self._variants:]
+            entry.last_served = -1
+
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self._hits + self._fills + self._misses
+            return {
+                "llm_reply_cache_hits": self._hits,
+                "llm_reply_cache_fills": self._fills,
+                "llm_reply_cache_misses": self._misses,
+                "llm_reply_cache_hit_rate": self._hits / lookups if lookups else 0.0,
+                "llm_reply_cache_entries": len(self._entries),
+            }
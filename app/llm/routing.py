@@ -0,0 +1,469 @@
+# -*- coding: utf-8 -*-
+# @File: routing.py
+# @Author: yaccii
+# @Time: 2025-11-17 17:41
+# @Description:
+"""
+按延迟路由大模型：记录每个 (provider, model) 最近的耗时和失败率，按顺序尝试候选，失败或超时换下一个。
+
+- ModelRoute：一条候选（provider 名、模型名、质量档位），从 LLM_ROUTES 解析
+- RouteStats：滑动窗口统计（最近 N 秒内的调用），给出 p50 耗时和失败率，按最近几次调用判断是否降级
+- HedgeBudget：对冲请求的预算（全局占调用数的比例 + 每个孩子的次数上限）
+- FailoverProvider：把一组候选包装成一个 LlmProvider，对调用方透明；
+  流式调用只在第一个增量到达前切换候选，开始输出之后出错直接抛出；
+  开启对冲时首选候选超过分位延迟还没结果，就同时请求下一个候选，先返回的胜出，另一个取消；
+  降级 / 没有样本的候选用影子请求在后台探测，结果只记入 RouteStats，不参与回复
+"""
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from app.infra.ylogger import ylogger
+from app.llm.base import ChatMessage, LlmProvider
+
+# 判断是否降级只看最近这么多次调用；样本数少于 _MIN_SAMPLES 时不判定为降级
+_HEALTH_SAMPLES = 5
+_MIN_SAMPLES = 3
+# 每条候选最多保留的样本数
+_MAX_SAMPLES = 200
+# 首选候选至少有这么多成功样本才估计对冲延迟，否则不对冲
+_HEDGE_MIN_SAMPLES = 10
+
+
+@dataclass(frozen=True)
+class ModelRoute:
+    provider: str
+    model: str
+    tier: int
+
+    @property
+    def key(self) -> str:
+        return f"{self.provider}/{self.model}"
+
+
+def parse_routes(spec: str) -> List[ModelRoute]:
+    """解析 "provider:model:tier,provider:model:tier"，格式不对的条目跳过。"""
+    routes: List[ModelRoute] = []
+    for item in (spec or "").split(","):
+        parts = [p.strip() for p in item.split(":")]
+        if len(parts) != 3 or not parts[0] or not parts[1]:
+            continue
+        try:
+            tier = int(parts[2])
+        except ValueError:
+            continue
+        routes.append(ModelRoute(parts[0].lower(), parts[1], tier))
+    return routes
+
+
+def parse_task_tiers(spec: str) -> Dict[str, int]:
+    """解析 "task:tier,task:tier"。"""
+    tiers: Dict[str, int] = {}
+    for item in (spec or "").split(","):
+        task, _, tier = item.partition(":")
+        task = task.strip()
+        if not task:
+            continue
+        try:
+            tiers[task] = int(tier)
+        except ValueError:
+            continue
+    return tiers
+
+
+class RouteStats:
+    """按候选记录最近 window_seconds 秒内的调用结果（耗时 ms, 是否成功），线程安全。"""
+
+    def __init__(self, window_seconds: float = 300.0) -> None:
+        self._window_seconds = window_seconds
+        self._samples: Dict[str, Deque[Tuple[float, float, bool]]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, key: str, latency_ms: float, ok: bool) -> None:
+        with self._lock:
+            samples = self._samples.setdefault(key, deque(maxlen=_MAX_SAMPLES))
+            samples.append((time.monotonic(), latency_ms, ok))
+
+    def snapshot(self, key: str) -> Tuple[int, float, float]:
+        """返回 (样本数, 成功调用的 p50 耗时 ms, 失败率)；没有成功样本时耗时为 inf。"""
+        with self._lock:
+            samples = self._samples.get(key)
+            if not samples:
+                return 0, float("inf"), 0.0
+            expire = time.monotonic() - self._window_seconds
+            while samples and samples[0][0] < expire:
+                samples.popleft()
+            ok_latencies = sorted(ms for _, ms, ok in samples if ok)
+            total = len(samples)
+
+        if not total:
+            return 0, float("inf"), 0.0
+        p50 = ok_latencies[len(ok_latencies) // 2] if ok_latencies else float("inf")
+        return total, p50, 1 - len(ok_latencies) / total
+
+    def is_degraded(self, key: str, *, max_error_rate: float, slow_ms: float) -> bool:
+        """最近几次调用的失败率或 p50 耗时超过阈值。只看最近几次，探测成功几次后就能恢复。"""
+        if not self.snapshot(key)[0]:
+            return False
+        with self._lock:
+            recent = list(self._samples[key])[-_HEALTH_SAMPLES:]
+        if len(recent) < _MIN_SAMPLES:
+            return False
+        ok_latencies = sorted(ms for _, ms, ok in recent if ok)
+        if not ok_latencies:
+            return True
+        if 1 - len(ok_latencies) / len(recent) >= max_error_rate:
+            return True
+        return ok_latencies[len(ok_latencies) // 2] > slow_ms
+
+    def percentile(self, key: str, q: float, *, min_samples: int) -> Optional[float]:
+        """窗口内成功调用耗时的 q 分位（ms）；成功样本不足 min_samples 时返回 None。"""
+        self.snapshot(key)
+        with self._lock:
+            ok_latencies = sorted(ms for _, ms, ok in self._samples.get(key, ()) if ok)
+        if len(ok_latencies) < max(1, min_samples):
+            return None
+        return ok_latencies[min(len(ok_latencies) - 1, int(len(ok_latencies) * q))]
+
+    def describe(self, key: str) -> str:
+        total, p50, error_rate = self.snapshot(key)
+        if not total:
+            return f"{key}(n=0)"
+        return f"{key}(n={total},p50={p50:.0f}ms,err={error_rate:.0%})"
+
+
+class HedgeBudget:
+    """
+    对冲预算，按最近 window_seconds 秒统计：
+    全局对冲次数不超过调用次数的 ratio，单个孩子的对冲次数不超过 per_child。
+    """
+
+    def __init__(self, *, ratio: float, per_child: int, window_seconds: float) -> None:
+        self._ratio = ratio
+        self._per_child = per_child
+        self._window_seconds = window_seconds
+        self._calls: Deque[float] = deque()
+        self._hedges: Deque[float] = deque()
+        self._child_hedges: Dict[Any, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def note_call(self) -> None:
+        with self._lock:
+            self._calls.append(time.monotonic())
+
+    def try_acquire(self, child_id: Any) -> bool:
+        """预算够就占用一次并返回 True。"""
+        now = time.monotonic()
+        expire = now - self._window_seconds
+        with self._lock:
+            for q in (self._calls, self._hedges):
+                while q and q[0] < expire:
+                    q.popleft()
+            child_q = self._child_hedges.get(child_id)
+            if child_q is not None:
+                while child_q and child_q[0] < expire:
+                    child_q.popleft()
+                if not child_q:
+                    del self._child_hedges[child_id]
+                    child_q = None
+
+            if len(self._hedges) + 1 > self._ratio * len(self._calls):
+                return False
+            if child_q is not None and len(child_q) >= self._per_child:
+                return False
+
+            self._hedges.append(now)
+            self._child_hedges.setdefault(child_id, deque()).append(now)
+            return True
+
+
+class HedgePolicy:
+    """对冲参数：首选候选耗时的 percentile 分位作为延迟（不低于 min_delay_ms），预算见 HedgeBudget。"""
+
+    def __init__(self, *, percentile: float, min_delay_ms: float, budget: HedgeBudget) -> None:
+        self.percentile = percentile
+        self.min_delay_ms = min_delay_ms
+        self.budget = budget
+
+
+class FailoverProvider(LlmProvider):
+    """
+    按 plan 顺序尝试候选，每次调用结果记入 RouteStats。
+
+    调用方传入的 model 忽略（每个候选用自己的模型）；单个候选超过 timeout 秒没有结果就换下一个，
+    流式调用的 timeout 指首个增量的等待时间，记录的耗时也是首包耗时。
+
+    hedge 不为空时：首选候选过了对冲延迟还没结果，且预算允许，就同时请求下一个候选（dummy 不参与对冲），
+    先成功的胜出，另一个取消；落败的请求按取消时已等待的时间计入统计。
+
+    probes 是要探测的候选（降级或没有样本的）：每次调用时在后台用同样的请求各发一个影子请求，
+    超时 probe_timeout 秒，结果只记入 RouteStats、直接丢弃，不会拖慢孩子的回复。
+
+    fallback_keys 是兜底 / 降级候选，胜出的是它们（或 dummy）时 served_by_fallback 为 True。
+    """
+
+    name = "router"
+
+    def __init__(
+        self,
+        plan: List[Tuple[LlmProvider, ModelRoute]],
+        stats: RouteStats,
+        *,
+        timeout: float,
+        hedge: Optional[HedgePolicy] = None,
+        child_id: Any = None,
+        fallback_keys: Iterable[str] = (),
+        probes: Iterable[Tuple[LlmProvider, ModelRoute]] = (),
+        probe_timeout: Optional[float] = None,
+    ) -> None:
+        if not plan:
+            raise RuntimeError("没有可用的大模型路由")
+        self._plan = plan
+        self._probes = list(probes)
+        self._probe_timeout = probe_timeout if probe_timeout is not None else timeout
+        self._stats = stats
+        self._timeout = timeout
+        self._hedge = hedge
+        self._child_id = child_id
+        self._fallback_keys = frozenset(fallback_keys)
+        # 本次调用实际胜出的候选（chat 返回 / 流开始输出时设置）
+        self.winner: Optional[ModelRoute] = None
+
+    @property
+    def served_by_fallback(self) -> bool:
+        """回复来自 dummy / 降级候选（或还没有胜出者），不是正常的大模型回答，调用方不应缓存。"""
+        winner = self.winner
+        return winner is None or winner.provider == "dummy" or winner.key in self._fallback_keys
+
+    async def chat(
+        self,
+        messages: List[ChatMessage],
+        model: str,
+        *,
+        max_tokens: int = 256,
+        temperature: float = 0.8,
+        extra_params: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        async def _call(provider: LlmProvider, route: ModelRoute) -> str:
+            return await provider.chat(
+                messages,
+                route.model,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                extra_params=extra_params,
+            )
+
+        self._start_probes(_call, _noop_cleanup)
+        _, text = await self._first_result(_call, _noop_cleanup)
+        return text
+
+    async def chat_stream(
+        self,
+        messages: List[ChatMessage],
+        model: str,
+        *,
+        max_tokens: int = 256,
+        temperature: float = 0.8,
+        extra_params: Optional[Dict[str, Any]] = None,
+    ) -> AsyncIterator[str]:
+        async def _open(provider: LlmProvider, route: ModelRoute) -> Tuple[AsyncIterator[str], Optional[str]]:
+            stream = provider.chat_stream(
+                messages,
+                route.model,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                extra_params=extra_params,
+            )
+            try:
+                first = await stream.__anext__()
+            except StopAsyncIteration:
+                # 空回复也算调用成功，由调用方兜底
+                return stream, None
+            except BaseException:
+                await stream.aclose()
+                raise
+            return stream, first
+
+        async def _close(opened: Tuple[AsyncIterator[str], Optional[str]]) -> None:
+            await opened[0].aclose()  # type: ignore[attr-defined]
+
+        self._start_probes(_open, _close)
+        idx, (stream, first) = await self._first_result(_open, _close)
+        if first is None:
+            return
+
+        route = self._plan[idx][1]
+        started = time.monotonic()
+        try:
+            yield first
+            async for delta in stream:
+                yield delta
+        except Exception:
+            # 已经开始输出，不能再换候选；记一次失败后抛给调用方
+            self._stats.record(route.key, (time.monotonic() - started) * 1000, False)
+            raise
+        finally:
+            await stream.aclose()  # type: ignore[attr-defined]
+
+    # ---------- 内部 ----------
+
+    def _start_probes(
+        self,
+        call: Callable[[LlmProvider, ModelRoute], Awaitable[Any]],
+        cleanup: Callable[[Any], Awaitable[None]],
+    ) -> None:
+        for provider, route in self._probes:
+            task = asyncio.ensure_future(self._probe(provider, route, call, cleanup))
+            _PROBE_TASKS.add(task)
+            task.add_done_callback(_PROBE_TASKS.discard)
+        # 每个 FailoverProvider 只探测一次
+        self._probes = []
+
+    async def _probe(
+        self,
+        provider: LlmProvider,
+        route: ModelRoute,
+        call: Callable[[LlmProvider, ModelRoute], Awaitable[Any]],
+        cleanup: Callable[[Any], Awaitable[None]],
+    ) -> None:
+        started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(call(provider, route), self._probe_timeout)
+        except Exception as e:  # noqa: BLE001
+            elapsed_ms = (time.monotonic() - started) * 1000
+            self._stats.record(route.key, elapsed_ms, False)
+            reason = "timeout" if isinstance(e, asyncio.TimeoutError) else repr(e)
+            ylogger.info("LLM probe failed: route=%s, elapsed_ms=%.0f, reason=%s", route.key, elapsed_ms, reason)
+            return
+        elapsed_ms = (time.monotonic() - started) * 1000
+        self._stats.record(route.key, elapsed_ms, True)
+        ylogger.info("LLM probe ok: route=%s, elapsed_ms=%.0f", route.key, elapsed_ms)
+        await cleanup(result)
+
+    async def _attempt(self, idx: int, call: Callable[[LlmProvider, ModelRoute], Awaitable[Any]]) -> Any:
+        provider, route = self._plan[idx]
+        started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(call(provider, route), self._timeout)
+        except Exception as e:  # noqa: BLE001
+            self._on_failure(route, started, e)
+            raise
+        self._stats.record(route.key, (time.monotonic() - started) * 1000, True)
+        return result
+
+    async def _first_result(
+        self,
+        call: Callable[[LlmProvider, ModelRoute], Awaitable[Any]],
+        cleanup: Callable[[Any], Awaitable[None]],
+    ) -> Tuple[int, Any]:
+        """
+        按 plan 顺序调用，返回 (胜出候选的下标, 结果)。
+        对冲时同时在途的请求里先成功的胜出；已经成功但落败的结果交给 cleanup 释放（例如关闭流）。
+        """
+        if self._hedge is not None:
+            self._hedge.budget.note_call()
+
+        last_error: Optional[BaseException] = None
+        idx = 0
+        while idx < len(self._plan):
+            tasks: Dict["asyncio.Future[Any]", int] = {asyncio.ensure_future(self._attempt(idx, call)): idx}
+            started = {idx: time.monotonic()}
+            next_idx = idx + 1
+            try:
+                if idx == 0:
+                    hedge_delay = self._hedge_delay()
+                    if hedge_delay is not None:
+                        done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+                        if not done and self._hedge is not None and self._hedge.budget.try_acquire(self._child_id):
+                            ylogger.info(
+                                "LLM hedge: primary=%s slower than %.0fms, also request %s (child_id=%s)",
+                                self._plan[0][1].key,
+                                hedge_delay * 1000,
+                                self._plan[1][1].key,
+                                self._child_id,
+                            )
+                            tasks[asyncio.ensure_future(self._attempt(1, call))] = 1
+                            started[1] = time.monotonic()
+                            next_idx = 2
+
+                while tasks:
+                    done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                    winner: Optional[Tuple[int, Any]] = None
+                    for task in done:
+                        task_idx = tasks.pop(task)
+                        error = task.exception()
+                        if error is not None:
+                            last_error = error
+                        elif winner is None:
+                            winner = (task_idx, task.result())
+                        else:
+                            await cleanup(task.result())
+                    if winner is not None:
+                        if tasks:
+                            ylogger.info(
+                                "LLM hedge won by %s, cancel %s",
+                                self._plan[winner[0]][1].key,
+                                ", ".join(self._plan[i][1].key for i in tasks.values()),
+                            )
+                        # 落败的请求按已经等待的时间记一个样本（实际只会更慢），路由才能感知首选变慢
+                        now = time.monotonic()
+                        for task_idx in tasks.values():
+                            self._stats.record(self._plan[task_idx][1].key, (now - started[task_idx]) * 1000, True)
+                        self.winner = self._plan[winner[0]][1]
+                        return winner
+            finally:
+                await _cancel_all(list(tasks), cleanup)
+            idx = next_idx
+        raise RuntimeError("所有大模型路由都调用失败") from last_error
+
+    def _hedge_delay(self) -> Optional[float]:
+        """对冲延迟（秒）；没开对冲、没有可对冲的候选或样本不足时返回 None。"""
+        if self._hedge is None or len(self._plan) < 2 or self._plan[1][1].provider == "dummy":
+            return None
+        delay_ms = self._stats.percentile(
+            self._plan[0][1].key,
+            self._hedge.percentile,
+            min_samples=_HEDGE_MIN_SAMPLES,
+        )
+        if delay_ms is None:
+            return None
+        delay_ms = max(delay_ms, self._hedge.min_delay_ms)
+        if delay_ms >= self._timeout * 1000:
+            return None
+        return delay_ms / 1000
+
+    def _on_failure(self, route: ModelRoute, started: float, error: BaseException) -> None:
+        elapsed_ms = (time.monotonic() - started) * 1000
+        self._stats.record(route.key, elapsed_ms, False)
+        reason = "timeout" if isinstance(error, asyncio.TimeoutError) else repr(error)
+        ylogger.warning(
+            "LLM route failed, fail over: route=%s, elapsed_ms=%.0f, reason=%s",
+            route.key,
+            elapsed_ms,
+            reason,
+        )
+
+
+# 在途的影子探测请求（持有引用，避免任务被回收）
+_PROBE_TASKS: Set["asyncio.Future[Any]"] = set()
+
+
+async def _noop_cleanup(_: Any) -> None:
+    return None
+
+
+async def _cancel_all(tasks: List["asyncio.Future[Any]"], cleanup: Callable[[Any], Awaitable[None]]) -> None:
+    """取消落败 / 不再需要的请求；取消前恰好已经成功的结果交给 cleanup。"""
+    if not tasks:
+        return
+    for task in tasks:
+        task.cancel()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    for result in results:
+        if not isinstance(result, BaseException):
+            await cleanup(result)
@@ -5,13 +5,29 @@
 # @Description:
 from __future__ import annotations
 
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
 from fastapi import FastAPI
 
-from app.api import parents as parents_api, history as history_api
+from app.api import parents as parents_api, history as history_api, voice_ws as voice_ws_api
+from app.api.deps import get_voice_service
+from app.infra.config import settings
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    # 语音 WebSocket 用的讯飞连接池在服务启动时就开始预热；没配置讯飞（只用家长接口）时不创建语音服务
+    xfyun_configured = bool(settings.XFYUN_APPID and settings.XFYUN_APIKEY and settings.XFYUN_APISECRET)
+    if xfyun_configured and settings.XFYUN_WS_POOL_SIZE > 0:
+        get_voice_service().start_ws_pools()
+    yield
+
 
 app = FastAPI(
     title="yoo-growth-buddy",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 
@@ -23,3 +39,6 @@ def health_check() -> dict:
 # 家长相关接口
 app.include_router(parents_api.router)
 app.include_router(history_api.router)
+
+# 语音对话 WebSocket（直连，不经过 MQTT）
+app.include_router(voice_ws_api.router)
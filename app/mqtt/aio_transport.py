@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# @File: aio_transport.py
+# @Author: yaccii
+# @Time: 2025-11-17 19:24
+# @Description:
+from __future__ import annotations
+
+import asyncio
+import threading
+from typing import Any, Optional
+
+import paho.mqtt.client as mqtt
+
+from app.infra.ylogger import ylogger
+
+
+class AsyncioMqttDriver:
+    """
+    把 paho 客户端的 socket 挂到 asyncio 事件循环上驱动（不再起 loop_forever 网络线程）：
+
+    - 可读时 loop_read，收包回调直接在事件循环线程里执行
+    - publish 只把包放进 paho 的发送队列并注册可写事件，由事件循环 loop_write，
+      不跨线程、不经过 socketpair 唤醒
+    - 每秒一次 loop_misc 处理心跳 / 超时
+    - 建连（DNS + TCP connect）是阻塞调用，放到线程池里执行；断线后按指数退避自动重连
+    """
+
+    def __init__(
+        self,
+        client: mqtt.Client,
+        loop: asyncio.AbstractEventLoop,
+        *,
+        reconnect_min_delay: float = 1.0,
+        reconnect_max_delay: float = 30.0,
+    ) -> None:
+        self._client = client
+        self._loop = loop
+        self._reconnect_min_delay = reconnect_min_delay
+        self._reconnect_max_delay = reconnect_max_delay
+
+        self._misc_task: Optional[asyncio.Task] = None
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._closed: Optional[asyncio.Event] = None
+        self._loop_thread_id: Optional[int] = None
+        self._stopping = False
+
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+        client.on_disconnect = self._on_disconnect
+
+    async def run(self, host: str, port: int, keepalive: int = 60, **connect_kwargs: Any) -> None:
+        """连接 broker 并一直运行，直到 close()。必须在 self._loop 上执行。"""
+        self._loop_thread_id = threading.get_ident()
+        self._closed = asyncio.Event()
+        self._client.connect_async(host, port, keepalive, **connect_kwargs)
+        await self._connect()
+        self._misc_task = asyncio.create_task(self._misc_loop(), name="yoo-gw-mqtt-misc")
+        await self._closed.wait()
+
+    async def close(self) -> None:
+        self._stopping = True
+        for task in (self._reconnect_task, self._misc_task):
+            if task is not None:
+                task.cancel()
+        self._client.disconnect()
+        if self._closed is not None:
+            self._closed.set()
+
+    # ---------- 建连 / 重连 ----------
+
+    async def _connect(self) -> None:
+        await self._loop.run_in_executor(None, self._client.reconnect)
+
+    async def _reconnect_loop(self) -> None:
+        delay = self._reconnect_min_delay
+        while not self._stopping:
+            await asyncio.sleep(delay)
+            try:
+                await self._connect()
+                ylogger.info("MQTT reconnected")
+                return
+            except (OSError, mqtt.WebsocketConnectionError) as e:
+                ylogger.warning("MQTT reconnect failed, retry in %.0fs: %s", delay, e)
+                delay = min(delay * 2, self._reconnect_max_delay)
+
+    def _on_disconnect(
+        self, client: mqtt.Client, userdata: Any, flags: Any, reason_code: Any, properties: Any = None
+    ) -> None:
+        if self._stopping:
+            return
+        ylogger.warning("MQTT disconnected, reason_code=%s, reconnecting...", reason_code)
+        self._call_in_loop(self._schedule_reconnect)
+
+    def _schedule_reconnect(self) -> None:
+        if self._reconnect_task is None or self._reconnect_task.done():
+            self._reconnect_task = asyncio.create_task(self._reconnect_loop(), name="yoo-gw-mqtt-reconnect")
+
+    async def _misc_loop(self) -> None:
+        while True:
+            await asyncio.sleep(1.0)
+            self._client.loop_misc()
+
+    # ---------- socket 事件 ----------
+    # 建连在线程池里执行，open / 注册可写回调可能来自那个线程，统一切回事件循环；
+    # fd 在回调里同步取出，切回事件循环时 socket 可能已经被 paho 关闭
+
+    def _call_in_loop(self, fn: Any, *args: Any) -> None:
+        if threading.get_ident() == self._loop_thread_id:
+            fn(*args)
+        else:
+            self._loop.call_soon_threadsafe(fn, *args)
+
+    def _on_socket_open(self, client: mqtt.Client, userdata: Any, sock: Any) -> None:
+        self._call_in_loop(self._loop.add_reader, sock.fileno(), self._client.loop_read)
+
+    def _on_socket_close(self, client: mqtt.Client, userdata: Any, sock: Any) -> None:
+        self._call_in_loop(self._loop.remove_reader, sock.fileno())
+
+    def _on_socket_register_write(self, client: mqtt.Client, userdata: Any, sock: Any) -> None:
+        self._call_in_loop(self._loop.add_writer, sock.fileno(), self._client.loop_write)
+
+    def _on_socket_unregister_write(self, client: mqtt.Client, userdata: Any, sock: Any) -> None:
+        self._call_in_loop(self._loop.remove_writer, sock.fileno())
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# @File: dedup.py
+# @Author: yaccii
+# @Time: 2025-11-17 19:24
+# @Description:
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+# reserve() 的返回状态
+DEDUP_NEW = "new"  # 第一次见到，调用方负责处理并 complete / discard
+DEDUP_PENDING = "pending"  # 同样的请求正在处理中，回复会发到同一个 topic，直接忽略
+DEDUP_DONE = "done"  # 已处理完，直接重放缓存的回复
+
+# 处理中的占位最长保留时间，防止处理方异常退出后一直占着
+_PENDING_MAX_SECONDS = 300.0
+
+
+@dataclass
+class _DedupEntry:
+    expires_at: float
+    reply_wav: Optional[bytes] = None  # None 表示处理中
+
+
+class ReplyDedupCache:
+    """
+    短 TTL 的请求去重缓存：
+    - key = device_sn + 终端提供的 request id，没有时用音频内容哈希
+    - 终端断线重连后重发同一段语音时，直接重放已算好的回复，不再重复 ASR / LLM / TTS / 落库
+    - 按回复字节总量淘汰最旧的条目
+
+    paho 网络线程 reserve，事件循环线程 complete / discard，内部加锁。
+    """
+
+    def __init__(self, ttl_seconds: float = 60.0, max_bytes: int = 32 * 1024 * 1024) -> None:
+        self._ttl = ttl_seconds
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, _DedupEntry]" = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._ttl > 0
+
+    @staticmethod
+    def make_key(device_sn: str, payload: bytes, request_id: Optional[str] = None) -> str:
+        if request_id:
+            return f"{device_sn}:id:{request_id}"
+        digest = hashlib.blake2b(payload, digest_size=16).hexdigest()
+        return f"{device_sn}:h:{digest}"
+
+    def reserve(self, key: str) -> Tuple[str, Optional[bytes]]:
+        now = time.monotonic()
+        with self._lock:
+            self._evict_expired(now)
+
+            entry = self._entries.get(key)
+            if entry is None:
+                self._entries[key] = _DedupEntry(expires_at=now + max(self._ttl, _PENDING_MAX_SECONDS))
+                return DEDUP_NEW, None
+
+            self._hits += 1
+            if entry.reply_wav is None:
+                return DEDUP_PENDING, None
+            return DEDUP_DONE, entry.reply_wav
+
+    def complete(self, key: str, reply_wav: bytes) -> None:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry.reply_wav is not None:
+                self._bytes -= len(entry.reply_wav)
+
+            self._entries[key] = _DedupEntry(expires_at=now + self._ttl, reply_wav=reply_wav)
+            self._bytes += len(reply_wav)
+
+            while self._bytes > self._max_bytes and len(self._entries) > 1:
+                old_key = next(iter(self._entries))
+                self._drop(old_key)
+
+    def discard(self, key: str) -> None:
+        """处理失败 / 被丢弃：去掉占位，让终端重试时重新处理。"""
+        with self._lock:
+            self._drop(key)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "dedup_entries": len(self._entries),
+                "dedup_bytes": self._bytes,
+                "dedup_hits": self._hits,
+            }
+
+    def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry.reply_wav is not None:
+            self._bytes -= len(entry.reply_wav)
+
+    def _evict_expired(self, now: float) -> None:
+        expired = [k for k, e in self._entries.items() if e.expires_at <= now]
+        for k in expired:
+            self._drop(k)
@@ -6,98 +6,823 @@
 from __future__ import annotations
 
 import asyncio
-from typing import Optional
+import os
+import secrets
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Tuple
 
 import paho.mqtt.client as mqtt
 
 from app.infra.config import settings
 from app.infra.db import SessionLocal
 from app.infra.ylogger import ylogger
+from app.mqtt.aio_transport import AsyncioMqttDriver
+from app.mqtt.dedup import DEDUP_DONE, DEDUP_NEW, ReplyDedupCache
+from app.mqtt.protocol import (
+    AUDIO_MAGIC,
+    FLAG_END,
+    FLAG_ERROR,
+    REQUEST_CHUNK_MAGIC,
+    decode_chunk,
+    encode_chunk,
+    pack_audio,
+    reply_chunk_topic,
+    reply_topic,
+    unpack_audio,
+)
+from app.mqtt.sequencer import RedisDeviceSequencer
+from app.mqtt.session_affinity import DeviceSessionAffinity, RedisDeviceSessionAffinity
 from app.services import VoiceChatService
 from app.speech.asr_xfyun import AudioFormatError, SpeechError
+from app.speech.audio_buffer import BytesLike, parse_wav, pcm_to_wav
+from app.speech.codec import CODEC_NAMES, CODEC_PCM, ChunkEncoder, codec_name, decode_to_pcm, encode_pcm
+from app.speech.pcm_stream import PcmStream
+
+
+@dataclass
+class _VoiceJob:
+    """一条待处理的语音请求（整段 WAV，或边录边传的 PCM 流）。"""
+
+    device_sn: str
+    topic: str
+    payload: bytes
+    received_at: float = field(default_factory=time.monotonic)
+    stream: Optional[PcmStream] = None
+    # 边录边传：已经计入准入预算的 PCM 字节数（分片到达时累加，在 _upload_lock 下修改）
+    stream_bytes: int = 0
+    # 多实例模式下的跨实例顺序号（单实例为 None）
+    ticket: Optional[int] = None
+    # 去重缓存 key（整段 WAV 请求才有）
+    dedup_key: Optional[str] = None
+    # 终端使用的音频编码；None 表示老固件（整段 WAV / 分片裸 PCM），回复按同样方式下发
+    codec: Optional[int] = None
+
+
+class _AdmissionController:
+    """
+    准入控制：限制已接收但未完成（排队 + 处理中）的轮次数和音频字节数。
+
+    - 收包回调（paho 网络线程或事件循环线程）调用 try_admit，事件循环线程调用 release，内部加锁
+    - 边录边传的请求开始时不知道大小：按轮次准入，之后每个分片到达时用 reserve 追加字节
+    - 空闲时允许单个超大请求进入，避免永远无法处理
+    """
+
+    def __init__(self, max_pending_turns: int, max_pending_bytes: int) -> None:
+        self._max_pending_turns = max(1, max_pending_turns)
+        self._max_pending_bytes = max(1, max_pending_bytes)
+        self._lock = threading.Lock()
+
+        self._pending_turns = 0
+        self._pending_bytes = 0
+        self._admitted_total = 0
+        self._shed_total = 0
+        self._shed_bytes_total = 0
+
+    def try_admit(self, nbytes: int) -> bool:
+        with self._lock:
+            over_turns = self._pending_turns >= self._max_pending_turns
+            over_bytes = (
+                self._pending_turns > 0
+                and self._pending_bytes + nbytes > self._max_pending_bytes
+            )
+            if over_turns or over_bytes:
+                self._shed_total += 1
+                self._shed_bytes_total += nbytes
+                return False
+
+            self._pending_turns += 1
+            self._pending_bytes += nbytes
+            self._admitted_total += 1
+            return True
+
+    def reserve(self, nbytes: int) -> None:
+        """已准入的流式请求又收到 nbytes 音频：只记账不拒绝（流已经在处理），超出预算时后续请求会被拒。"""
+        with self._lock:
+            self._pending_bytes += nbytes
+
+    def release(self, nbytes: int) -> None:
+        with self._lock:
+            self._pending_turns = max(0, self._pending_turns - 1)
+            self._pending_bytes = max(0, self._pending_bytes - nbytes)
+
+    def reject(self, nbytes: int) -> None:
+        """已准入的请求在后续环节被丢弃：归还额度并计入 shed。"""
+        with self._lock:
+            self._pending_turns = max(0, self._pending_turns - 1)
+            self._pending_bytes = max(0, self._pending_bytes - nbytes)
+            self._shed_total += 1
+            self._shed_bytes_total += nbytes
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "pending_turns": self._pending_turns,
+                "pending_bytes": self._pending_bytes,
+                "max_pending_turns": self._max_pending_turns,
+                "max_pending_bytes": self._max_pending_bytes,
+                "admitted_total": self._admitted_total,
+                "shed_total": self._shed_total,
+                "shed_bytes_total": self._shed_bytes_total,
+            }
+
+
+class _ReplyChunkPublisher:
+    """
+    把一轮回复的 PCM 片段按分片协议发布到 toy/{sn}/voice/reply/chunk。
+    只在事件循环线程中使用。
+    """
+
+    def __init__(
+        self,
+        client: mqtt.Client,
+        device_sn: str,
+        received_at: float,
+        *,
+        sample_rate: int = 16000,
+        codec: int = CODEC_PCM,
+    ) -> None:
+        self._client = client
+        self._device_sn = device_sn
+        self._topic = reply_chunk_topic(device_sn)
+        self._received_at = received_at
+        self._sample_rate = sample_rate
+        self._codec = codec
+        self._encoder = ChunkEncoder(codec)
+        self._stream_id = secrets.randbits(32)
+        self._seq = 0
+        self._finished = False
+
+    @property
+    def started(self) -> bool:
+        return self._seq > 0
+
+    def send(self, pcm: bytes, is_last: bool) -> None:
+        if self._finished:
+            return
+        if not pcm and not is_last:
+            return
+
+        data = self._encoder.encode(pcm, final=is_last)
+        if not data and not is_last:
+            # ADPCM 不足一个字节的样本留到下一片
+            return
+
+        if self._seq == 0:
+            ylogger.info(
+                "First reply chunk: device_sn=%s, stream_id=%s, since_received_ms=%.0f",
+                self._device_sn,
+                self._stream_id,
+                (time.monotonic() - self._received_at) * 1000,
+            )
+
+        flags = FLAG_END if is_last else 0
+        self._publish(data, flags)
+        if is_last:
+            self._finished = True
+            ylogger.info(
+                "Reply stream finished: device_sn=%s, stream_id=%s, chunks=%s",
+                self._device_sn,
+                self._stream_id,
+                self._seq,
+            )
+
+    def abort(self) -> None:
+        """处理失败时结束流，避免终端一直等结束分片。"""
+        if self._finished or not self.started:
+            return
+        self._publish(b"", FLAG_END | FLAG_ERROR)
+        self._finished = True
+
+    def _publish(self, data: bytes, flags: int) -> None:
+        payload = encode_chunk(
+            self._stream_id,
+            self._seq,
+            data,
+            sample_rate=self._sample_rate,
+            flags=flags,
+            codec=self._codec,
+        )
+        self._client.publish(self._topic, payload)
+        self._seq += 1
+
+
+def _request_id_from_properties(msg: mqtt.MQTTMessage) -> Optional[str]:
+    """MQTT 5 下终端可通过 CorrelationData 或 UserProperty(request_id) 带上请求 id。"""
+    props = getattr(msg, "properties", None)
+    if props is None:
+        return None
+
+    for name, value in getattr(props, "UserProperty", None) or []:
+        if name == "request_id" and value:
+            return str(value)
+
+    corr = getattr(props, "CorrelationData", None)
+    if corr:
+        return bytes(corr).hex()
+    return None
+
+
+def _wav_to_pcm(wav_bytes: BytesLike) -> memoryview:
+    _, pcm = parse_wav(wav_bytes)
+    return pcm
+
+
+def _silence_wav_bytes(seconds: float = 0.3, *, sample_rate: int = 16000) -> bytes:
+    """忙碌提示合成失败时的兜底：一小段静音 WAV，至少让终端结束等待。"""
+    return pcm_to_wav(bytes(2 * int(sample_rate * seconds)), sample_rate=sample_rate)
+
+
+def _payload_codec(payload: bytes) -> Optional[int]:
+    """整段请求的编码：压缩容器返回编码 id（只看头部，不解码），WAV 返回 None。"""
+    if payload[:2] != AUDIO_MAGIC:
+        return None
+    codec, _, _ = unpack_audio(payload[:8])
+    return codec
+
+
+def _decode_request_audio(payload: bytes) -> bytes:
+    """整段请求统一还原成 WAV（老固件直接就是 WAV）。"""
+    if payload[:2] != AUDIO_MAGIC:
+        return payload
+    codec, sample_rate, data = unpack_audio(payload)
+    return pcm_to_wav(decode_to_pcm(data, codec), sample_rate=sample_rate)
+
+
+def _encode_reply_audio(wav_bytes: BytesLike, codec: Optional[int]) -> BytesLike:
+    """整段回复按请求的编码下发；老固件仍然是 WAV（原样发布，不复制）。"""
+    if codec is None:
+        return wav_bytes
+    fmt, pcm = parse_wav(wav_bytes)
+    return pack_audio(codec, encode_pcm(pcm, codec), sample_rate=fmt.sample_rate)
 
 
 class MqttVoiceGateway:
     """
     MQTT 网关：
     - 订阅: toy/{device_sn}/voice/request
-    - 收到 payload: 视为 16k 单声道 16bit 的 WAV 字节
+    - 收到 payload: 16k 单声道 16bit 的 WAV 字节，或 b"YA" 开头的压缩音频（µ-law / IMA-ADPCM）
+    - 订阅: toy/{device_sn}/voice/request/chunk（边录边传，start / PCM 帧 / end）
+    - 收到开始分片就开始处理，PCM 帧直接喂给 ASR
     - 调用 VoiceChatService 处理一轮对话
     - 把回复 WAV 发布到: toy/{device_sn}/voice/reply
+
+    并发模型：
+    - 常驻事件循环（独立线程）跑所有轮次，收包回调只把请求投递到它的有界队列
+    - MQTT_TRANSPORT=asyncio（默认）：paho 的 socket 挂在同一个事件循环上，
+      收包、投递、发布回复都在事件循环线程里完成，不跨线程
+    - MQTT_TRANSPORT=paho：paho loop_forever 网络线程收包，再 call_soon_threadsafe 投递（兼容兜底）；
+      多实例 MQTT_SHARED_ORDERING=redis 时收包回调要同步访问 Redis，固定使用这种方式
+    - 事件循环里跑固定数量的 worker，不同设备并行处理
+    - 同一 device_sn 的轮次严格按到达顺序串行处理
+
+    回复下发（MQTT_REPLY_MODE）：
+    - wav: 整段 WAV 发到 toy/{device_sn}/voice/reply（老固件）
+    - stream: TTS 边合成边按分片协议发到 toy/{device_sn}/voice/reply/chunk
+    - both: 两者都发，各固件只订阅自己支持的 topic
+
+    多实例（配置 MQTT_SHARED_GROUP）：
+    - MQTT 5 共享订阅 $share/<group>/toy/+/voice/request，请求在多个进程 / 主机间分摊
+    - 每个实例使用唯一 client id（前缀 + MQTT_INSTANCE_ID 或 hostname-pid）
+    - 同设备顺序：redis 模式下接收时取号、处理前等前一号完成（跨实例 ticket lock），
+      上行分片流普通订阅、由开始分片抢到的实例独占处理；
+      broker 模式依赖 broker 粘性分发（如 EMQX hash_clientid），请求和分片都走共享订阅
+
+    音频编码：
+    - 终端在整段请求的容器头 / 分片 flags 里声明编码，回复用同样的编码下发，
+      µ-law 省一半、ADPCM 省四分之三的上下行流量；ASR / TTS / 存档仍然是 PCM
+    - 老固件（WAV / 裸 PCM 分片）不受影响
+
+    重复请求：
+    - 终端断线重连后重发同一段语音时，按 device_sn + request id（没有则用内容哈希）去重
+    - 已处理完的直接重放缓存的回复；仍在处理中的忽略（回复会发到同一个 topic）
+
+    会话：
+    - 同一设备 MQTT_SESSION_IDLE_SECONDS 内的连续轮次复用同一个 ChatSession（LLM 带历史）
+    - 空闲超时的会话由后台任务调用 end_session 收尾（生成标题）；多实例时映射放在 Redis
+
+    过载保护：
+    - 已接收未完成的轮次数 / 音频字节超出预算时不再排队
+    - 直接回复一段预合成的“忙碌，请稍后再试”语音
     """
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        max_concurrent_turns: Optional[int] = None,
+        queue_size: Optional[int] = None,
+        max_pending_turns: Optional[int] = None,
+        max_pending_bytes: Optional[int] = None,
+    ) -> None:
         self._broker_host: str = getattr(settings, "MQTT_BROKER_HOST", "127.0.0.1")
         self._broker_port: int = int(getattr(settings, "MQTT_BROKER_PORT", 1883))
         self._username: Optional[str] = getattr(settings, "MQTT_USERNAME", None) or None
         self._password: Optional[str] = getattr(settings, "MQTT_PASSWORD", None) or None
         self._client_id_prefix: str = getattr(settings, "MQTT_CLIENT_ID_PREFIX", "yoo-gw-")
 
-        self._client = mqtt.Client(
-            client_id=f"{self._client_id_prefix}voice",
-            clean_session=True,
+        self._max_concurrent_turns: int = max(
+            1, int(max_concurrent_turns or getattr(settings, "MQTT_MAX_CONCURRENT_TURNS", 8))
+        )
+        self._queue_size: int = max(
+            1, int(queue_size or getattr(settings, "MQTT_INTAKE_QUEUE_SIZE", 200))
+        )
+        self._admission = _AdmissionController(
+            max_pending_turns=int(
+                max_pending_turns or getattr(settings, "MQTT_MAX_PENDING_TURNS", 64)
+            ),
+            max_pending_bytes=int(
+                max_pending_bytes
+                or getattr(settings, "MQTT_MAX_PENDING_AUDIO_BYTES", 32 * 1024 * 1024)
+            ),
+        )
+        reply_mode = (getattr(settings, "MQTT_REPLY_MODE", "both") or "both").strip().lower()
+        if reply_mode not in ("wav", "stream", "both"):
+            ylogger.warning("Unknown MQTT_REPLY_MODE=%s, fallback to both", reply_mode)
+            reply_mode = "both"
+        self._reply_wav_enabled: bool = reply_mode in ("wav", "both")
+        self._reply_stream_enabled: bool = reply_mode in ("stream", "both")
+
+        self._dedup = ReplyDedupCache(
+            ttl_seconds=float(getattr(settings, "MQTT_DEDUP_TTL_SECONDS", 60)),
+            max_bytes=int(getattr(settings, "MQTT_DEDUP_MAX_BYTES", 32 * 1024 * 1024)),
         )
+
+        self._sessions: Optional[DeviceSessionAffinity] = None
+        self._session_sweeper: Optional[asyncio.Task] = None
+
+        # 忙碌提示语音（启动时准备好，过载时直接发布）
+        self._busy_reply_wav: bytes = b""
+
+        self._shared_group: Optional[str] = (getattr(settings, "MQTT_SHARED_GROUP", None) or "").strip() or None
+        self._instance_id: str = (
+            getattr(settings, "MQTT_INSTANCE_ID", None) or f"{socket.gethostname()}-{os.getpid()}"
+        )
+        self._sequencer: Optional[RedisDeviceSequencer] = None
+        self._shared_ordering: str = "local"
+
+        if self._shared_group:
+            self._shared_ordering = (getattr(settings, "MQTT_SHARED_ORDERING", "redis") or "redis").strip().lower()
+            if self._shared_ordering == "redis":
+                redis_url = getattr(settings, "REDIS_URL", None)
+                if not redis_url:
+                    raise ValueError("多实例模式（MQTT_SHARED_GROUP）下按设备保序需要配置 REDIS_URL")
+                self._sequencer = RedisDeviceSequencer(redis_url, self._instance_id)
+            elif self._shared_ordering != "broker":
+                raise ValueError(f"未知的 MQTT_SHARED_ORDERING: {self._shared_ordering}")
+
+            # 多实例：MQTT 5 + 每个实例唯一 client id，避免互踢
+            self._client = mqtt.Client(
+                mqtt.CallbackAPIVersion.VERSION2,
+                client_id=f"{self._client_id_prefix}voice-{self._instance_id}",
+                protocol=mqtt.MQTTv5,
+            )
+        else:
+            self._client = mqtt.Client(
+                mqtt.CallbackAPIVersion.VERSION2,
+                client_id=f"{self._client_id_prefix}voice",
+                clean_session=True,
+            )
         if self._username:
             self._client.username_pw_set(self._username, self._password or "")
 
+        session_idle = float(getattr(settings, "MQTT_SESSION_IDLE_SECONDS", 300))
+        if session_idle > 0:
+            redis_url = getattr(settings, "REDIS_URL", None)
+            if self._shared_group and redis_url:
+                # 多实例：同一设备的轮次可能落到不同实例，会话映射放到 Redis
+                self._sessions = RedisDeviceSessionAffinity(redis_url, session_idle)
+            else:
+                self._sessions = DeviceSessionAffinity(session_idle)
+
         self._client.on_connect = self._on_connect
         self._client.on_message = self._on_message
 
+        transport = (getattr(settings, "MQTT_TRANSPORT", "asyncio") or "asyncio").strip().lower()
+        if transport not in ("asyncio", "paho"):
+            raise ValueError(f"未知的 MQTT_TRANSPORT: {transport}")
+        if transport == "asyncio" and self._sequencer is not None:
+            # Redis 取号 / 抢流是同步调用（必须在收包回调里按接收顺序完成），放在事件循环线程会阻塞所有轮次
+            ylogger.warning(
+                "MQTT_SHARED_ORDERING=redis takes tickets synchronously, fall back to MQTT_TRANSPORT=paho"
+            )
+            transport = "paho"
+        self._transport: str = transport
+        self._driver: Optional[AsyncioMqttDriver] = None
+
         # 语音对话核心服务
         self._voice_service = VoiceChatService()
 
+        # 常驻事件循环（独立线程）
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[threading.Thread] = None
+        self._queue: Optional[asyncio.Queue[_VoiceJob]] = None
+        self._workers: List[asyncio.Task] = []
+
+        # device_sn -> 该设备后续排队的请求；key 存在表示该设备正在被某个 worker 处理
+        self._active_devices: Dict[str, Deque[_VoiceJob]] = {}
+
+        # device_sn -> (stream_id, 正在上传的流式请求)；收包回调写入，事件循环线程清理
+        self._upload_streams: Dict[str, Tuple[int, _VoiceJob]] = {}
+        self._upload_lock = threading.Lock()
+
     # ---------- 公开启动方法 ----------
 
     def start(self) -> None:
-        ylogger.info("Connecting to MQTT broker %s:%s ...", self._broker_host, self._broker_port)
-        self._client.connect(self._broker_host, self._broker_port, keepalive=60)
-        ylogger.info("Connected. Start loop_forever...")
-        self._client.loop_forever()
+        self._start_loop()
+        self._busy_reply_wav = self._prepare_busy_reply()
+        # 固定话术的 TTS 缓存在后台预热，不阻塞连接 broker
+        assert self._loop is not None
+        asyncio.run_coroutine_threadsafe(self._voice_service.prewarm_tts_cache(), self._loop)
 
-    # ---------- 回调 ----------
+        ylogger.info(
+            "Connecting to MQTT broker %s:%s ... (transport=%s, shared_group=%s, instance_id=%s, ordering=%s)",
+            self._broker_host,
+            self._broker_port,
+            self._transport,
+            self._shared_group,
+            self._instance_id,
+            self._shared_ordering,
+        )
+        if self._transport == "asyncio":
+            assert self._loop is not None
+            fut = asyncio.run_coroutine_threadsafe(self._serve_asyncio(), self._loop)
+            try:
+                fut.result()
+            finally:
+                self.stop()
+            return
 
-    def _on_connect(self, client: mqtt.Client, userdata, flags, rc) -> None:  # type: ignore[override]
-        if rc == 0:
-            ylogger.info("MQTT connected, subscribing to request topics...")
-            topic = "toy/+/voice/request"
-            client.subscribe(topic)
-            ylogger.info("Subscribed: %s", topic)
+        if self._shared_group:
+            self._client.connect(self._broker_host, self._broker_port, keepalive=60, clean_start=True)
         else:
-            ylogger.error("MQTT connect failed, rc=%s", rc)
+            self._client.connect(self._broker_host, self._broker_port, keepalive=60)
+        ylogger.info("Connected. Start loop_forever...")
+        try:
+            self._client.loop_forever()
+        finally:
+            self.stop()
 
-    def _on_message(self, client: mqtt.Client, userdata, msg: mqtt.MQTTMessage) -> None:  # type: ignore[override]
-        topic = msg.topic
-        payload = msg.payload
-        ylogger.info("Received MQTT message: topic=%s, bytes=%s", topic, len(payload))
+    def stop(self) -> None:
+        """停止 worker 和事件循环（start 退出时自动调用）。"""
+        loop = self._loop
+        if loop is None:
+            return
+        self._loop = None
 
-        # 期望 topic: toy/{device_sn}/voice/request
-        parts = topic.split("/")
-        if len(parts) != 4 or parts[0] != "toy" or parts[2] != "voice" or parts[3] != "request":
-            ylogger.warning("Ignore message with unexpected topic: %s", topic)
+        if loop.is_running():
+            fut = asyncio.run_coroutine_threadsafe(self._stop_workers(), loop)
+            try:
+                fut.result(timeout=10)
+            except Exception as e:  # noqa: BLE001
+                ylogger.warning("Stop workers failed: %s", e)
+            loop.call_soon_threadsafe(loop.stop)
+
+        if self._loop_thread is not None:
+            self._loop_thread.join(timeout=10)
+            self._loop_thread = None
+        ylogger.info("MQTT voice gateway stopped.")
+
+    async def _serve_asyncio(self) -> None:
+        """asyncio 传输：在事件循环上连接 broker 并一直运行到 stop()。"""
+        self._driver = AsyncioMqttDriver(self._client, asyncio.get_running_loop())
+        kwargs: Dict[str, Any] = {"clean_start": True} if self._shared_group else {}
+        await self._driver.run(self._broker_host, self._broker_port, keepalive=60, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        """当前排队深度 / 在途轮次 / 丢弃计数，供日志和监控使用。"""
+        data: Dict[str, Any] = dict(self._admission.snapshot())
+        data.update(self._dedup.snapshot())
+        data.update(self._voice_service.tts_cache_stats())
+        data.update(self._voice_service.reply_cache_stats())
+        data["queue_depth"] = self._queue.qsize() if self._queue is not None else 0
+        data["active_devices"] = len(self._active_devices)
+        data["device_backlog"] = sum(len(q) for q in list(self._active_devices.values()))
+        return data
+
+    # ---------- 过载保护 ----------
+
+    def _prepare_busy_reply(self) -> bytes:
+        path = getattr(settings, "MQTT_BUSY_REPLY_WAV", None)
+        if path:
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+                ylogger.info("Loaded busy reply clip: path=%s, bytes=%s", path, len(data))
+                return data
+            except OSError as e:
+                ylogger.warning("Failed to load busy reply clip: path=%s, error=%s", path, e)
+
+        text = getattr(settings, "MQTT_BUSY_REPLY_TEXT", "") or "小悠现在有点忙，过一会儿再和我说话好不好？"
+        assert self._loop is not None
+        try:
+            fut = asyncio.run_coroutine_threadsafe(self._voice_service.synthesize_wav(text), self._loop)
+            data = fut.result(timeout=30)
+            ylogger.info("Pre-synthesized busy reply clip: bytes=%s", len(data))
+            return data
+        except Exception as e:  # noqa: BLE001
+            ylogger.warning("Failed to synthesize busy reply clip, fallback to silence: %s", e)
+            return _silence_wav_bytes()
+
+    def _shed(self, device_sn: str, nbytes: int, reason: str, codec: Optional[int] = None) -> None:
+        """拒绝一条请求：立刻回复忙碌提示，不进入处理流程。"""
+        busy_wav = self._busy_reply_wav or _silence_wav_bytes()
+        self._publish_reply_wav(device_sn, busy_wav, codec)
+        ylogger.warning(
+            "Shed voice request (%s): device_sn=%s, bytes=%s, stats=%s",
+            reason,
+            device_sn,
+            nbytes,
+            self.stats(),
+        )
+
+    def _replay_reply(self, device_sn: str, reply_wav: BytesLike, codec: Optional[int] = None) -> None:
+        """重放已缓存的回复（按当前下发方式和请求的编码）。"""
+        self._publish_reply_wav(device_sn, reply_wav, codec)
+        ylogger.info(
+            "Replayed cached reply for duplicate request: device_sn=%s, bytes=%s",
+            device_sn,
+            len(reply_wav),
+        )
+
+    def _publish_reply_wav(self, device_sn: str, reply_wav: BytesLike, codec: Optional[int] = None) -> None:
+        """把一段现成的回复音频按 MQTT_REPLY_MODE 下发（整段 / 分块流式），编码按请求指定。"""
+        if self._reply_wav_enabled:
+            self._client.publish(reply_topic(device_sn), _encode_reply_audio(reply_wav, codec))
+        if self._reply_stream_enabled:
+            stream = _ReplyChunkPublisher(
+                self._client,
+                device_sn,
+                time.monotonic(),
+                codec=CODEC_PCM if codec is None else codec,
+            )
+            pcm = _wav_to_pcm(reply_wav)
+            chunk_size = 8192
+            for offset in range(0, len(pcm), chunk_size):
+                stream.send(pcm[offset:offset + chunk_size], False)
+            stream.send(b"", True)
+
+    # ---------- 事件循环 / worker ----------
+
+    def _start_loop(self) -> None:
+        if self._loop is not None:
             return
 
-        device_sn = parts[1]
+        loop = asyncio.new_event_loop()
+        # ASR / TTS / LLM / S3 都通过 to_thread 执行，线程池按并发轮数放大，避免默认线程池成为瓶颈
+        loop.set_default_executor(
+            ThreadPoolExecutor(
+                max_workers=self._max_concurrent_turns * 2,
+                thread_name_prefix="yoo-gw-io",
+            )
+        )
+
+        def run() -> None:
+            asyncio.set_event_loop(loop)
+            loop.run_forever()
+            loop.run_until_complete(loop.shutdown_default_executor())
+            loop.close()
+
+        self._loop_thread = threading.Thread(target=run, name="yoo-gw-loop", daemon=True)
+        self._loop_thread.start()
+        self._loop = loop
+
+        asyncio.run_coroutine_threadsafe(self._start_workers(), loop).result()
+        ylogger.info(
+            "Voice gateway loop started: workers=%s, queue_size=%s",
+            self._max_concurrent_turns,
+            self._queue_size,
+        )
+
+    async def _start_workers(self) -> None:
+        self._voice_service.start_ws_pools()
+        self._queue = asyncio.Queue(maxsize=self._queue_size)
+        self._workers = [
+            asyncio.create_task(self._worker(i), name=f"yoo-gw-worker-{i}")
+            for i in range(self._max_concurrent_turns)
+        ]
+        if self._sessions is not None:
+            self._session_sweeper = asyncio.create_task(self._sweep_idle_sessions(), name="yoo-gw-session-sweeper")
+
+    async def _stop_workers(self) -> None:
+        if self._driver is not None:
+            await self._driver.close()
+            self._driver = None
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._sequencer is not None:
+            await self._sequencer.close()
+        if self._session_sweeper is not None:
+            self._session_sweeper.cancel()
+            await asyncio.gather(self._session_sweeper, return_exceptions=True)
+            self._session_sweeper = None
+        if self._sessions is not None:
+            await self._end_sessions(await self._sessions.pop_all())
+            await self._sessions.close()
+        await self._voice_service.aclose()
+
+    def _dispatch(self, job: _VoiceJob) -> None:
+        """把收到的请求交给事件循环：asyncio 传输下回调本来就在事件循环线程，直接入队。"""
+        if self._driver is not None:
+            self._submit(job)
+            return
+        loop = self._loop
+        if loop is None:
+            ylogger.error("Voice gateway loop stopped, drop message: device_sn=%s", job.device_sn)
+            return
+        loop.call_soon_threadsafe(self._submit, job)
+
+    def _submit(self, job: _VoiceJob) -> None:
+        """在事件循环线程中执行：把请求放进有界队列。"""
+        assert self._queue is not None
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            if job.stream is not None:
+                # 先摘掉上传流，之后不会再有分片计入 stream_bytes
+                self._drop_upload_stream(job.device_sn, job.stream)
+            self._admission.reject(len(job.payload) + job.stream_bytes)
+            if job.dedup_key is not None:
+                self._dedup.discard(job.dedup_key)
+            if job.ticket is not None:
+                # 已经取过号：仍需按顺序报告完成，否则同设备后续请求要等到超时
+                asyncio.create_task(self._skip_ticket(job.device_sn, job.ticket))
+            self._shed(job.device_sn, len(job.payload), reason="intake queue full", codec=job.codec)
+
+    async def _worker(self, idx: int) -> None:
+        assert self._queue is not None
+        while True:
+            job = await self._queue.get()
+            try:
+                backlog = self._active_devices.get(job.device_sn)
+                if backlog is not None:
+                    # 同一设备已有轮次在处理，排到它后面，由那个 worker 顺序处理
+                    backlog.append(job)
+                    continue
+
+                self._active_devices[job.device_sn] = deque()
+                await self._drain_device(job)
+            finally:
+                self._queue.task_done()
+
+    async def _drain_device(self, job: _VoiceJob) -> None:
+        """处理某设备的一轮以及处理期间到达的该设备后续轮次。"""
+        device_sn = job.device_sn
+        try:
+            while True:
+                try:
+                    if self._sequencer is not None and job.ticket is not None:
+                        await self._sequencer.wait_turn(device_sn, job.ticket)
+                    await self._process_job(job)
+                finally:
+                    # 流式请求在 _process_job 里已经摘掉上传流，stream_bytes 不会再变
+                    self._admission.release(len(job.payload) + job.stream_bytes)
+                    if self._sequencer is not None and job.ticket is not None:
+                        await self._finish_ticket(device_sn, job.ticket)
+                backlog = self._active_devices[device_sn]
+                if not backlog:
+                    break
+                job = backlog.popleft()
+        finally:
+            self._active_devices.pop(device_sn, None)
+
+    async def _finish_ticket(self, device_sn: str, ticket: int) -> None:
+        assert self._sequencer is not None
+        try:
+            await self._sequencer.finish(device_sn, ticket)
+        except Exception as e:  # noqa: BLE001
+            ylogger.warning("Finish ticket failed: device_sn=%s, ticket=%s, error=%s", device_sn, ticket, e)
+
+    async def _skip_ticket(self, device_sn: str, ticket: int) -> None:
+        assert self._sequencer is not None
+        await self._sequencer.wait_turn(device_sn, ticket)
+        await self._finish_ticket(device_sn, ticket)
+
+    # ---------- 会话复用 ----------
+
+    async def _current_session(self, device_sn: str) -> Optional[int]:
+        if self._sessions is None:
+            return None
+        try:
+            return await self._sessions.get(device_sn)
+        except Exception as e:  # noqa: BLE001
+            ylogger.warning("Lookup device session failed, start new session: device_sn=%s, error=%s", device_sn, e)
+            return None
+
+    async def _remember_session(self, device_sn: str, session_id: int) -> None:
+        if self._sessions is None:
+            return
+        try:
+            replaced = await self._sessions.touch(device_sn, session_id)
+        except Exception as e:  # noqa: BLE001
+            ylogger.warning("Remember device session failed: device_sn=%s, error=%s", device_sn, e)
+            return
+        if replaced is not None:
+            # 旧会话没能续用（例如设备换绑了孩子），同样需要收尾
+            asyncio.create_task(self._end_sessions([replaced]))
+
+    async def _sweep_idle_sessions(self) -> None:
+        assert self._sessions is not None
+        interval = min(60.0, max(1.0, self._sessions.idle_seconds / 4))
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self._end_sessions(await self._sessions.pop_idle())
+            except Exception as e:  # noqa: BLE001
+                ylogger.warning("Sweep idle sessions failed: %s", e)
+
+    async def _end_sessions(self, session_ids: List[int]) -> None:
+        for session_id in session_ids:
+            try:
+                await asyncio.to_thread(self._end_session, session_id)
+            except Exception as e:  # noqa: BLE001
+                ylogger.warning("End idle session failed: session_id=%s, error=%s", session_id, e)
+
+    def _end_session(self, session_id: int) -> None:
+        db = SessionLocal()
+        try:
+            self._voice_service.end_session(db, session_id)
+        finally:
+            db.close()
+
+    def _take_ticket(self, device_sn: str) -> Optional[int]:
+        """在收包回调中按接收顺序取号；Redis 不可用时退化为不保序。"""
+        if self._sequencer is None:
+            return None
+        try:
+            return self._sequencer.take_ticket(device_sn)
+        except Exception as e:  # noqa: BLE001
+            ylogger.warning("Take ticket failed, process without ordering: device_sn=%s, error=%s", device_sn, e)
+            return None
+
+    async def _process_job(self, job: _VoiceJob) -> None:
+        topic = job.topic
+        device_sn = job.device_sn
+
+        stream: Optional[_ReplyChunkPublisher] = None
+        if self._reply_stream_enabled:
+            stream = _ReplyChunkPublisher(
+                self._client,
+                device_sn,
+                job.received_at,
+                codec=CODEC_PCM if job.codec is None else job.codec,
+            )
 
         db = SessionLocal()
         try:
-            wav_bytes = payload
-            ylogger.info("Handling voice turn: device_sn=%s, wav_bytes=%s", device_sn, len(wav_bytes))
+            ylogger.info(
+                "Handling voice turn: device_sn=%s, payload_bytes=%s, codec=%s, queued_ms=%.0f",
+                device_sn,
+                len(job.payload),
+                "wav" if job.codec is None else codec_name(job.codec),
+                (time.monotonic() - job.received_at) * 1000,
+            )
+            resume_session_id = await self._current_session(device_sn)
 
-            result = asyncio.run(
-                self._voice_service.handle_turn(
+            if job.stream is not None:
+                result = await self._voice_service.handle_stream_turn(
                     db=db,
                     device_sn=device_sn,
-                    wav_bytes=wav_bytes,
+                    pcm_stream=job.stream,
                     session_id=None,
+                    on_reply_audio=stream.send if stream is not None else None,
+                    resume_session_id=resume_session_id,
+                )
+            else:
+                result = await self._voice_service.handle_turn(
+                    db=db,
+                    device_sn=device_sn,
+                    wav_bytes=_decode_request_audio(job.payload),
+                    session_id=None,
+                    on_reply_audio=stream.send if stream is not None else None,
+                    resume_session_id=resume_session_id,
                 )
-            )
 
-            reply_topic = f"toy/{device_sn}/voice/reply"
-            client.publish(reply_topic, result.reply_wav_bytes)
+            await self._remember_session(device_sn, result.session_id)
+
+            if job.dedup_key is not None:
+                self._dedup.complete(job.dedup_key, result.reply_wav_bytes)
+                job.dedup_key = None
+
+            topic_out = reply_topic(device_sn)
+            reply_payload = b""
+            if self._reply_wav_enabled:
+                reply_payload = _encode_reply_audio(result.reply_wav_bytes, job.codec)
+                self._client.publish(topic_out, reply_payload)
             ylogger.info(
-                "Published reply: topic=%s, bytes=%s, child_id=%s, session_id=%s, turn_id=%s",
-                reply_topic,
+                "Published reply: topic=%s, bytes=%s, wire_bytes=%s, wav=%s, streamed=%s, asr_ms=%.0f, "
+                "trimmed_bytes=%s, child_id=%s, session_id=%s, turn_id=%s",
+                topic_out,
                 len(result.reply_wav_bytes),
+                len(reply_payload),
+                self._reply_wav_enabled,
+                stream is not None and stream.started,
+                result.asr_ms,
+                result.trimmed_bytes,
                 result.child_id,
                 result.session_id,
                 result.turn_id,
@@ -112,4 +837,224 @@ class MqttVoiceGateway:
         except Exception as e:  # noqa: BLE001
             ylogger.exception("Failed to handle MQTT message: topic=%s, error=%s", topic, e)
         finally:
+            if job.dedup_key is not None:
+                # 失败的请求不缓存，终端重试时重新处理
+                self._dedup.discard(job.dedup_key)
+            if stream is not None:
+                stream.abort()
+            if job.stream is not None:
+                self._drop_upload_stream(device_sn, job.stream)
             db.close()
+
+    def _drop_upload_stream(self, device_sn: str, pcm_stream: PcmStream) -> None:
+        pcm_stream.close()
+        with self._upload_lock:
+            current = self._upload_streams.get(device_sn)
+            if current is not None and current[1].stream is pcm_stream:
+                del self._upload_streams[device_sn]
+
+    # ---------- 回调 ----------
+
+    def _on_connect(  # type: ignore[override]
+        self, client: mqtt.Client, userdata, flags, reason_code, properties=None
+    ) -> None:
+        if not reason_code.is_failure:
+            ylogger.info("MQTT connected, subscribing to request topics...")
+            for topic in self._subscriptions():
+                client.subscribe(topic)
+                ylogger.info("Subscribed: %s", topic)
+        else:
+            ylogger.error("MQTT connect failed, reason_code=%s", reason_code)
+
+    def _subscriptions(self) -> Tuple[str, ...]:
+        request_topic = "toy/+/voice/request"
+        chunk_topic = "toy/+/voice/request/chunk"
+        if not self._shared_group:
+            return request_topic, chunk_topic
+
+        shared_prefix = f"$share/{self._shared_group}/"
+        if self._shared_ordering == "broker":
+            return shared_prefix + request_topic, shared_prefix + chunk_topic
+        # redis 模式：分片流必须落在同一实例，所以分片 topic 普通订阅，由 claim_stream 决定归属
+        return shared_prefix + request_topic, chunk_topic
+
+    def _on_message(self, client: mqtt.Client, userdata, msg: mqtt.MQTTMessage) -> None:  # type: ignore[override]
+        topic = msg.topic
+        payload = msg.payload
+        ylogger.info("Received MQTT message: topic=%s, bytes=%s", topic, len(payload))
+
+        # 期望 topic: toy/{device_sn}/voice/request[/chunk]
+        parts = topic.split("/")
+        if len(parts) not in (4, 5) or parts[0] != "toy" or parts[2] != "voice" or parts[3] != "request":
+            ylogger.warning("Ignore message with unexpected topic: %s", topic)
+            return
+        if len(parts) == 5 and parts[4] != "chunk":
+            ylogger.warning("Ignore message with unexpected topic: %s", topic)
+            return
+
+        device_sn = parts[1]
+
+        loop = self._loop
+        if loop is None or not loop.is_running():
+            ylogger.error("Voice gateway loop not running, drop message: topic=%s", topic)
+            return
+
+        if len(parts) == 5:
+            self._on_request_chunk(device_sn, topic, payload)
+            return
+
+        try:
+            codec = _payload_codec(payload)
+        except ValueError as e:
+            ylogger.warning("Ignore invalid compressed audio: topic=%s, error=%s", topic, e)
+            return
+        if codec is not None and codec not in CODEC_NAMES:
+            ylogger.warning("Ignore voice request with unsupported codec: device_sn=%s, codec=%s", device_sn, codec)
+            return
+
+        # 重复请求：处理完的直接重放，处理中的忽略
+        dedup_key: Optional[str] = None
+        if self._dedup.enabled:
+            dedup_key = ReplyDedupCache.make_key(device_sn, payload, _request_id_from_properties(msg))
+            state, cached_reply = self._dedup.reserve(dedup_key)
+            if state == DEDUP_DONE:
+                assert cached_reply is not None
+                self._replay_reply(device_sn, cached_reply, codec)
+                return
+            if state != DEDUP_NEW:
+                ylogger.info("Ignore duplicate voice request in progress: device_sn=%s", device_sn)
+                return
+
+        # 超出预算：不排队，直接回复忙碌提示
+        if not self._admission.try_admit(len(payload)):
+            if dedup_key is not None:
+                self._dedup.discard(dedup_key)
+            self._shed(device_sn, len(payload), reason="over budget", codec=codec)
+            return
+
+        ticket = self._take_ticket(device_sn)
+
+        # 收包回调不做任何耗时处理，直接交给事件循环
+        self._dispatch(
+            _VoiceJob(
+                device_sn=device_sn,
+                topic=topic,
+                payload=payload,
+                ticket=ticket,
+                dedup_key=dedup_key,
+                codec=codec,
+            ),
+        )
+
+    def _on_request_chunk(self, device_sn: str, topic: str, payload: bytes) -> None:
+        """处理边录边传的上行分片（在收包回调中执行，只做轻量操作）。"""
+        try:
+            chunk = decode_chunk(payload, magic=REQUEST_CHUNK_MAGIC)
+        except ValueError as e:
+            ylogger.warning("Ignore invalid request chunk: topic=%s, error=%s", topic, e)
+            return
+
+        if chunk.codec not in CODEC_NAMES:
+            ylogger.warning(
+                "Ignore request chunk with unsupported codec: device_sn=%s, codec=%s", device_sn, chunk.codec
+            )
+            return
+
+        if chunk.is_start:
+            if chunk.sample_rate != 16000:
+                ylogger.warning(
+                    "Ignore request stream with unsupported sample rate: device_sn=%s, sample_rate=%s",
+                    device_sn,
+                    chunk.sample_rate,
+                )
+                return
+
+            # 多实例 redis 模式下所有实例都会收到分片，只有抢到这条流的实例处理
+            if self._sequencer is not None and self._shared_ordering == "redis":
+                try:
+                    claimed = self._sequencer.claim_stream(device_sn, chunk.stream_id)
+                except Exception as e:  # noqa: BLE001
+                    ylogger.warning("Claim request stream failed: device_sn=%s, error=%s", device_sn, e)
+                    claimed = False
+                if not claimed:
+                    return
+
+            # 老固件不带编码标志，回复也保持裸 PCM / WAV
+            codec = chunk.codec if chunk.codec != CODEC_PCM else None
+
+            # 流式请求开始时还不知道音频大小，先按轮次准入，音频字节随分片到达再计入
+            if not self._admission.try_admit(0):
+                self._shed(device_sn, 0, reason="over budget (stream)", codec=codec)
+                return
+
+            pcm_stream = PcmStream(sample_rate=chunk.sample_rate)
+            job = _VoiceJob(
+                device_sn=device_sn,
+                topic=topic,
+                payload=b"",
+                stream=pcm_stream,
+                ticket=self._take_ticket(device_sn),
+                codec=codec,
+            )
+            with self._upload_lock:
+                previous = self._upload_streams.get(device_sn)
+                self._upload_streams[device_sn] = (chunk.stream_id, job)
+            if previous is not None:
+                # 上一次上传没有正常结束（例如终端重连），直接收尾
+                assert previous[1].stream is not None
+                previous[1].stream.close()
+
+            ylogger.info(
+                "Request stream started: device_sn=%s, stream_id=%s, codec=%s",
+                device_sn,
+                chunk.stream_id,
+                codec_name(chunk.codec),
+            )
+            self._dispatch(job)
+        else:
+            with self._upload_lock:
+                current = self._upload_streams.get(device_sn)
+            if current is None or current[0] != chunk.stream_id:
+                if self._sequencer is not None and self._shared_ordering == "redis":
+                    # 多实例 redis 模式下其他实例处理的流，直接忽略
+                    return
+                ylogger.warning(
+                    "Ignore request chunk for unknown stream: device_sn=%s, stream_id=%s, seq=%s",
+                    device_sn,
+                    chunk.stream_id,
+                    chunk.seq,
+                )
+                return
+            job = current[1]
+            assert job.stream is not None
+            pcm_stream = job.stream
+
+        if chunk.audio:
+            # 每个分片自带解码状态，解码只是一次 C 调用，可以直接在收包回调里做
+            try:
+                pcm = decode_to_pcm(chunk.audio, chunk.codec)
+            except AudioFormatError as e:
+                ylogger.warning(
+                    "Drop undecodable request chunk: device_sn=%s, stream_id=%s, seq=%s, error=%s",
+                    device_sn,
+                    chunk.stream_id,
+                    chunk.seq,
+                    e,
+                )
+            else:
+                with self._upload_lock:
+                    # 流已经处理完（或被丢弃）时额度已经归还，不再计入
+                    current = self._upload_streams.get(device_sn)
+                    if current is not None and current[1] is job:
+                        job.stream_bytes += len(pcm)
+                        self._admission.reserve(len(pcm))
+                pcm_stream.push(pcm)
+
+        if chunk.is_end:
+            pcm_stream.close()
+            ylogger.info(
+                "Request stream ended: device_sn=%s, stream_id=%s, bytes=%s",
+                device_sn,
+                chunk.stream_id,
+                pcm_stream.nbytes,
+            )
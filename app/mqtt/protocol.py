@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+# @File: protocol.py
+# @Author: yaccii
+# @Time: 2025-11-17 19:24
+# @Description:
+"""
+玩具 ⇄ 网关的 MQTT 音频分片协议（纯标准库，client.py / 固件模拟脚本可直接复用）。
+
+回复分片：toy/{device_sn}/voice/reply/chunk
+    每条消息 = 16 字节头 + 16bit 单声道 PCM 片段
+
+    头部（小端）：
+        magic        2s   b"YR"
+        version      B    协议版本，当前 1
+        flags        B    bit0=结束，bit1=异常结束，bit2=开始（仅上行），bit4-7=音频编码
+        stream_id    I    同一轮回复的流 id（随机生成，用于区分新旧回复）
+        seq          I    分片序号，从 0 开始连续递增
+        sample_rate  I    采样率，例如 16000
+
+    结束分片（flags 带 FLAG_END）可以不带音频。
+
+上行分片（边录边传）：toy/{device_sn}/voice/request/chunk
+    头部格式同上，magic 为 b"YQ"
+    - 开始分片：flags 带 FLAG_START，声明 stream_id 和采样率（目前只支持 16000）
+    - 中间分片：PCM 帧，建议 40ms（1280 字节）一片
+    - 结束分片：flags 带 FLAG_END，孩子松开按键时发送
+
+音频编码协商（见 app/speech/codec.py）：
+    - 分片：flags 高 4 位是编码 id（0=pcm，1=ulaw，2=adpcm），回复分片沿用请求的编码
+    - 整段请求：payload 以 b"RIFF" 开头视为 WAV（老固件）；
+      以 b"YA" 开头视为压缩音频：8 字节头（magic 2s, version B, codec B, sample_rate I）+ 编码数据，
+      回复同样用这个格式、同样的编码发回
+"""
+from __future__ import annotations
+
+import struct
+from dataclasses import dataclass
+
+REPLY_CHUNK_MAGIC = b"YR"
+REQUEST_CHUNK_MAGIC = b"YQ"
+AUDIO_MAGIC = b"YA"
+PROTOCOL_VERSION = 1
+
+FLAG_END = 0x01
+FLAG_ERROR = 0x02
+FLAG_START = 0x04
+_FLAG_CODEC_SHIFT = 4
+_FLAG_MASK = (1 << _FLAG_CODEC_SHIFT) - 1
+
+_CHUNK_HEADER = struct.Struct("<2sBBIII")
+CHUNK_HEADER_SIZE = _CHUNK_HEADER.size
+
+_AUDIO_HEADER = struct.Struct("<2sBBI")
+
+
+@dataclass
+class AudioChunk:
+    """解析后的音频分片。"""
+
+    stream_id: int
+    seq: int
+    sample_rate: int
+    flags: int
+    audio: bytes
+
+    @property
+    def is_end(self) -> bool:
+        return bool(self.flags & FLAG_END)
+
+    @property
+    def is_error(self) -> bool:
+        return bool(self.flags & FLAG_ERROR)
+
+    @property
+    def is_start(self) -> bool:
+        return bool(self.flags & FLAG_START)
+
+    @property
+    def codec(self) -> int:
+        return self.flags >> _FLAG_CODEC_SHIFT
+
+
+def request_chunk_topic(device_sn: str) -> str:
+    return f"toy/{device_sn}/voice/request/chunk"
+
+
+def reply_topic(device_sn: str) -> str:
+    return f"toy/{device_sn}/voice/reply"
+
+
+def reply_chunk_topic(device_sn: str) -> str:
+    return f"toy/{device_sn}/voice/reply/chunk"
+
+
+def encode_chunk(
+    stream_id: int,
+    seq: int,
+    audio: bytes,
+    *,
+    sample_rate: int = 16000,
+    flags: int = 0,
+    codec: int = 0,
+    magic: bytes = REPLY_CHUNK_MAGIC,
+) -> bytes:
+    flags = (flags & _FLAG_MASK) | (codec << _FLAG_CODEC_SHIFT)
+    header = _CHUNK_HEADER.pack(magic, PROTOCOL_VERSION, flags, stream_id, seq, sample_rate)
+    return header + audio
+
+
+def decode_chunk(payload: bytes, *, magic: bytes = REPLY_CHUNK_MAGIC) -> AudioChunk:
+    """解析分片；格式不对时抛 ValueError。"""
+    if len(payload) < CHUNK_HEADER_SIZE:
+        raise ValueError(f"音频分片过短: bytes={len(payload)}")
+
+    got_magic, version, flags, stream_id, seq, sample_rate = _CHUNK_HEADER.unpack_from(payload)
+    if got_magic != magic:
+        raise ValueError(f"音频分片 magic 不匹配: {got_magic!r}")
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"不支持的音频分片协议版本: {version}")
+
+    return AudioChunk(
+        stream_id=stream_id,
+        seq=seq,
+        sample_rate=sample_rate,
+        flags=flags,
+        audio=bytes(payload[CHUNK_HEADER_SIZE:]),
+    )
+
+
+def is_wav_payload(payload: bytes) -> bool:
+    return payload[:4] == b"RIFF"
+
+
+def pack_audio(codec: int, data: bytes, *, sample_rate: int = 16000) -> bytes:
+    """整段压缩音频：8 字节头 + 编码数据。"""
+    return _AUDIO_HEADER.pack(AUDIO_MAGIC, PROTOCOL_VERSION, codec, sample_rate) + data
+
+
+def unpack_audio(payload: bytes) -> tuple[int, int, bytes]:
+    """解析整段压缩音频，返回 (codec, sample_rate, 编码数据)；格式不对时抛 ValueError。"""
+    if len(payload) < _AUDIO_HEADER.size:
+        raise ValueError(f"压缩音频过短: bytes={len(payload)}")
+
+    magic, version, codec, sample_rate = _AUDIO_HEADER.unpack_from(payload)
+    if magic != AUDIO_MAGIC:
+        raise ValueError(f"压缩音频 magic 不匹配: {magic!r}")
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"不支持的压缩音频协议版本: {version}")
+    return codec, sample_rate, payload[_AUDIO_HEADER.size:]
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# @File: sequencer.py
+# @Author: yaccii
+# @Time: 2025-11-17 19:24
+# @Description:
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any
+
+from app.infra.ylogger import ylogger
+
+# 取号：ticket 计数 +1；新一轮计数（key 过期后重新开始）时把 done 归零
+_TAKE_TICKET_LUA = """
+local t = redis.call('INCR', KEYS[1])
+if t == 1 then
+    redis.call('SET', KEYS[2], 0)
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+return t
+"""
+
+# 完成：done 只增不减
+_FINISH_LUA = """
+local cur = tonumber(redis.call('GET', KEYS[1]) or '0')
+if tonumber(ARGV[1]) > cur then
+    redis.call('SET', KEYS[1], ARGV[1])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+
+class RedisDeviceSequencer:
+    """
+    多实例部署时，保证同一设备的轮次跨实例按接收顺序串行处理（基于 Redis 的 ticket lock）：
+
+    - 收到请求时 take_ticket 取号（在 paho 网络线程的收包回调中同步执行，保持接收顺序；
+      会阻塞调用线程，不能在事件循环线程里调用，所以网关启用它时固定使用 MQTT_TRANSPORT=paho）
+    - 处理前 wait_turn 等到前一个号完成；前一个号的实例挂掉时等待超时后继续
+    - 处理完 finish 报告完成，唤醒下一个号
+    - claim_stream：边录边传的上行流由第一个抢到的实例独占处理
+    """
+
+    def __init__(
+        self,
+        redis_url: str,
+        instance_id: str,
+        *,
+        wait_timeout: float = 30.0,
+        poll_interval: float = 0.05,
+        key_ttl: int = 3600,
+    ) -> None:
+        try:
+            import redis
+            import redis.asyncio as aioredis
+        except ImportError as e:  # pragma: no cover - 依赖缺失时直接报错
+            raise RuntimeError("多实例顺序保证需要安装 redis 依赖") from e
+
+        self._instance_id = instance_id
+        self._wait_timeout = wait_timeout
+        self._poll_interval = poll_interval
+        self._key_ttl = key_ttl
+
+        # paho 网络线程用同步客户端取号 / 抢流；事件循环里用异步客户端等待 / 完成
+        self._sync = redis.Redis.from_url(redis_url, decode_responses=True)
+        self._async: Any = aioredis.Redis.from_url(redis_url, decode_responses=True)
+        self._take_ticket_script = self._sync.register_script(_TAKE_TICKET_LUA)
+        self._finish_script = self._async.register_script(_FINISH_LUA)
+
+    @staticmethod
+    def _keys(device_sn: str) -> tuple[str, str]:
+        # {device_sn} 作为 hash tag，Redis Cluster 下两个 key 落在同一 slot
+        return f"yoo:gw:seq:{{{device_sn}}}:ticket", f"yoo:gw:seq:{{{device_sn}}}:done"
+
+    def take_ticket(self, device_sn: str) -> int:
+        ticket_key, done_key = self._keys(device_sn)
+        return int(self._take_ticket_script(keys=[ticket_key, done_key], args=[self._key_ttl]))
+
+    def claim_stream(self, device_sn: str, stream_id: int) -> bool:
+        key = f"yoo:gw:stream:{{{device_sn}}}:{stream_id}"
+        return bool(self._sync.set(key, self._instance_id, nx=True, ex=300))
+
+    async def wait_turn(self, device_sn: str, ticket: int) -> None:
+        _, done_key = self._keys(device_sn)
+        deadline = time.monotonic() + self._wait_timeout
+        while True:
+            done = int(await self._async.get(done_key) or 0)
+            if done >= ticket - 1:
+                return
+            if time.monotonic() >= deadline:
+                ylogger.warning(
+                    "Wait for previous turn timed out, continue: device_sn=%s, ticket=%s, done=%s",
+                    device_sn,
+                    ticket,
+                    done,
+                )
+                return
+            await asyncio.sleep(self._poll_interval)
+
+    async def finish(self, device_sn: str, ticket: int) -> None:
+        _, done_key = self._keys(device_sn)
+        await self._finish_script(keys=[done_key], args=[ticket, self._key_ttl])
+
+    async def close(self) -> None:
+        await self._async.aclose()
+        self._sync.close()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# @File: session_affinity.py
+# @Author: yaccii
+# @Time: 2025-11-17 19:24
+# @Description:
+from __future__ import annotations
+
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class DeviceSessionAffinity:
+    """
+    设备 → 当前会话的映射（单实例内存版）：
+    - 同一设备 idle_seconds 内的连续轮次复用同一个 ChatSession，LLM 能带上历史
+    - 超过 idle_seconds 没有新轮次的会话由 pop_idle 取出，调用方负责 end_session
+
+    只在网关事件循环线程中使用；同设备轮次串行处理，不需要加锁。
+    """
+
+    def __init__(self, idle_seconds: float = 300.0) -> None:
+        self._idle_seconds = idle_seconds
+        # device_sn -> (session_id, 最近一轮结束时间 time.time())
+        self._sessions: Dict[str, Tuple[int, float]] = {}
+
+    @property
+    def idle_seconds(self) -> float:
+        return self._idle_seconds
+
+    async def get(self, device_sn: str) -> Optional[int]:
+        entry = self._sessions.get(device_sn)
+        if entry is None:
+            return None
+        session_id, last_active = entry
+        if time.time() - last_active >= self._idle_seconds:
+            # 已空闲但还没被清理：不再复用，留给 pop_idle 结束
+            return None
+        return session_id
+
+    async def touch(self, device_sn: str, session_id: int) -> Optional[int]:
+        """记录本轮使用的会话；设备换了会话时返回被替换的旧会话 id（需要结束）。"""
+        previous = self._sessions.get(device_sn)
+        self._sessions[device_sn] = (session_id, time.time())
+        if previous is not None and previous[0] != session_id:
+            return previous[0]
+        return None
+
+    async def pop_idle(self) -> List[int]:
+        deadline = time.time() - self._idle_seconds
+        idle = [sn for sn, (_, last_active) in self._sessions.items() if last_active <= deadline]
+        return [self._sessions.pop(sn)[0] for sn in idle]
+
+    async def pop_all(self) -> List[int]:
+        """网关停止时取出全部会话；内存版停止后映射就丢了，需要全部结束。"""
+        sessions = [session_id for session_id, _ in self._sessions.values()]
+        self._sessions.clear()
+        return sessions
+
+    async def close(self) -> None:
+        return None
+
+
+class RedisDeviceSessionAffinity(DeviceSessionAffinity):
+    """
+    多实例共享版：映射放在 Redis，设备的轮次落到任何实例都能接上同一个会话。
+
+    - yoo:gw:session:{device_sn}   当前会话 id，过期时间 = idle_seconds
+    - yoo:gw:session:idle          zset，member = "device_sn|session_id"，score = 最近活跃时间
+    - 清理时用 ZREM 的返回值抢占，多个实例同时扫描也只有一个会结束该会话
+    """
+
+    _IDLE_KEY = "yoo:gw:session:idle"
+
+    def __init__(self, redis_url: str, idle_seconds: float = 300.0) -> None:
+        super().__init__(idle_seconds)
+        try:
+            import redis.asyncio as aioredis
+        except ImportError as e:  # pragma: no cover - 依赖缺失时直接报错
+            raise RuntimeError("多实例会话共享需要安装 redis 依赖") from e
+
+        self._redis: Any = aioredis.Redis.from_url(redis_url, decode_responses=True)
+
+    @staticmethod
+    def _key(device_sn: str) -> str:
+        return f"yoo:gw:session:{{{device_sn}}}"
+
+    async def get(self, device_sn: str) -> Optional[int]:
+        value = await self._redis.get(self._key(device_sn))
+        return int(value) if value else None
+
+    async def touch(self, device_sn: str, session_id: int) -> Optional[int]:
+        previous = await self._redis.set(
+            self._key(device_sn),
+            session_id,
+            ex=max(1, int(self._idle_seconds)),
+            get=True,
+        )
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.zadd(self._IDLE_KEY, {f"{device_sn}|{session_id}": time.time()})
+        if previous and int(previous) != session_id:
+            pipe.zrem(self._IDLE_KEY, f"{device_sn}|{previous}")
+        results = await pipe.execute()
+        if previous and int(previous) != session_id and results[-1]:
+            return int(previous)
+        return None
+
+    async def pop_idle(self) -> List[int]:
+        members = await self._redis.zrangebyscore(self._IDLE_KEY, 0, time.time() - self._idle_seconds)
+        sessions: List[int] = []
+        for member in members:
+            if await self._redis.zrem(self._IDLE_KEY, member):
+                sessions.append(int(member.rsplit("|", 1)[1]))
+        return sessions
+
+    async def pop_all(self) -> List[int]:
+        # 共享映射：其他实例还会继续使用 / 清理，本实例停止时不动
+        return []
+
+    async def close(self) -> None:
+        await self._redis.aclose()
@@ -5,7 +5,8 @@
 # @Description:
 from __future__ import annotations
 
-from typing import List
+import time
+from typing import List, Union
 
 from sqlalchemy.orm import Session
 
@@ -25,6 +26,14 @@ def _split_str(s: str | None) -> List[str]:
     return [x.strip() for x in s.split(",") if x.strip()]
 
 
+def _bump_profile_version(obj: Union[models.Child, models.Device]) -> None:
+    """
+    刷新档案版本戳（updated_at）。语音链路按 (child.updated_at, device.updated_at) 判断缓存的 system prompt
+    是否过期，网关进程也能从库里看到；同一秒内多次修改也保证递增。
+    """
+    obj.updated_at = max(int(time.time()), (obj.updated_at or 0) + 1)
+
+
 class ProfileService:
     """
     家长 / 儿童 / 设备配置相关：
@@ -67,6 +76,7 @@ class ProfileService:
             interests=_join_list(req.child_interests),
             forbidden_topics=_join_list(req.child_forbidden_topics),
         )
+        _bump_profile_version(child)
         db.add(child)
         db.flush()
 
@@ -99,6 +109,7 @@ class ProfileService:
                 device.toy_gender = req.toy_gender
             if req.toy_persona is not None:
                 device.toy_persona = req.toy_persona
+        _bump_profile_version(device)
 
         db.commit()
         db.refresh(parent)
@@ -197,6 +208,8 @@ class ProfileService:
                 device.toy_gender = req.toy_gender
             if req.toy_persona is not None:
                 device.toy_persona = req.toy_persona
+            _bump_profile_version(device)
+        _bump_profile_version(child)
 
         db.commit()
         db.refresh(child)
@@ -10,14 +10,15 @@
 # @Description:
 from __future__ import annotations
 
-import io
+import asyncio
 import logging
 import os
 import time
-import wave
+from collections import OrderedDict
+from contextlib import aclosing
 from dataclasses import dataclass
 from datetime import datetime
-from typing import List, Optional
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
 
 from sqlalchemy import func
 from sqlalchemy.orm import Session
@@ -25,13 +26,36 @@ from sqlalchemy.orm import Session
 from app.infra import storage_s3
 from app.infra.config import settings
 from app.domain import models
+from app.llm.base import ChatMessage, LlmProvider
 from app.llm.model_selector import LlmModelSelector
+from app.llm.reply_cache import ReplyCache
 from app.llm.registry import build_default_registry
 from app.speech.asr_xfyun import AudioFormatError, SpeechError
+from app.speech.audio_buffer import BytesLike, PcmBuffer
 from app.speech.client import SpeechClient
+from app.speech.pcm_stream import PcmStream
+from app.speech.vad import TrimResult
 
 logger = logging.getLogger("yoo-growth-buddy.voice")
 
+# 回复音频流回调：(pcm 片段, 是否结束)。在事件循环线程中调用，不能阻塞
+ReplyAudioCallback = Callable[[bytes, bool], None]
+
+# 流式 ASR 中间结果回调：(当前识别文本)。在事件循环线程中调用，不能阻塞
+AsrPartialCallback = Callable[[str], None]
+
+# 回复不安全 / 为空时的兜底回复（固定文案，启动时预合成进 TTS 缓存）
+_TOY_NAME = "小悠"
+_SAFE_FALLBACK_REPLY = (
+    f"{_TOY_NAME}觉得这个话题有点不安全，"
+    "我们先不聊这个哦。"
+    f"要不要跟{_TOY_NAME}说说你今天遇到的开心事情，"
+    "或者聊聊你喜欢的玩具、动画片、游戏？"
+)
+
+# 编译好的 system prompt 最多缓存多少个 (child, device)
+_SYSTEM_PROMPT_CACHE_SIZE = 4096
+
 
 @dataclass
 class VoiceTurnResult:
@@ -44,7 +68,9 @@ class VoiceTurnResult:
     reply_text: str
     user_audio_path: str  # 相对路径（S3 key）
     reply_audio_path: str  # 相对路径（S3 key）
-    reply_wav_bytes: bytes  # 回复语音的 WAV 字节
+    reply_wav_bytes: BytesLike  # 回复语音的 WAV（TTS 缓冲区本身，bytearray，不复制）
+    asr_ms: float = 0.0  # 本轮 ASR 耗时（流式为说完到出结果的耗时）
+    trimmed_bytes: int = 0  # VAD 裁掉的前后静音字节数
 
 
 class VoiceChatService:
@@ -62,11 +88,27 @@ class VoiceChatService:
         max_history_turns: int = 6,
     ) -> None:
         self._speech = speech_client or SpeechClient()
-        registry = build_default_registry()
-        self._llm_selector = llm_selector or LlmModelSelector(registry)
+        self._llm_registry = build_default_registry()
+        self._llm_selector = llm_selector or LlmModelSelector(self._llm_registry)
         self._base_path = file_base_path or getattr(settings, "FILE_BASE_PATH", "./data")
         self._max_history_turns = max_history_turns
 
+        self._vad_enabled = bool(getattr(settings, "VAD_ENABLED", True))
+        self._llm_stream_enabled = bool(getattr(settings, "LLM_STREAM_ENABLED", True))
+        # (child_id, device_id) -> ((child.updated_at, device.updated_at), system prompt)
+        self._system_prompts: "OrderedDict[Tuple[int, int], Tuple[Tuple[Optional[int], Optional[int]], str]]" = (
+            OrderedDict()
+        )
+        self._reply_cache: Optional[ReplyCache] = None
+        if getattr(settings, "LLM_REPLY_CACHE_ENABLED", False):
+            self._reply_cache = ReplyCache(
+                max_entries=int(settings.LLM_REPLY_CACHE_MAX_ENTRIES),
+                ttl_seconds=float(settings.LLM_REPLY_CACHE_TTL_SECONDS),
+                variants=int(settings.LLM_REPLY_CACHE_VARIANTS),
+            )
+        # 没有人声时的回复语音 (PCM, WAV)（第一次用到时合成，之后复用）
+        self._no_speech_audio: Optional[Tuple[bytes, BytesLike]] = None
+
     # ---------- 对外主入口：单轮对话 ----------
 
     async def handle_turn(
@@ -75,65 +117,236 @@ class VoiceChatService:
         device_sn: str,
         wav_bytes: bytes,
         session_id: Optional[int] = None,
+        on_reply_audio: Optional[ReplyAudioCallback] = None,
+        resume_session_id: Optional[int] = None,
     ) -> VoiceTurnResult:
         """
         处理一轮语音对话。
-        """
-        # 1. 找到设备和孩子
-        device, child = self._load_device_and_child(db, device_sn)
 
-        # 2. session：如果没传就创建一个新的
-        session = self._get_or_create_session(db, child, session_id)
+        on_reply_audio 不为空时，TTS 每产出一段 PCM 立即回调，合成结束后再回调一次
+        (b"", True)，调用方可以在 S3 上传 / 落库之前就开始下发回复语音。
 
-        # 3. 本轮 seq
-        seq = self._next_turn_seq(db, session.id)
+        resume_session_id：希望接着聊的会话（网关按设备记录的当前会话）；
+        会话已结束或不属于该孩子（设备换绑）时不报错，直接新建会话。
 
-        # 4. 保存孩子语音（S3）
-        user_rel_path, _ = self._save_user_wav(child.id, session.id, seq, wav_bytes)
+        db 只用来确定连接的数据库：查询 / 落库都放到线程里，每次用独立的 Session，不阻塞事件循环上的其他轮次。
+        """
+        # 1. 找到设备和孩子；session：如果没传就续用 / 创建一个新的；本轮 seq
+        device, child, session, seq = await self._run_db(
+            db, self._prepare_turn, device_sn, session_id, resume_session_id
+        )
+
+        # 2. VAD：裁掉按键前后的静音；整段没有人声时直接回复"没听清"，不调用 ASR / LLM / TTS
+        trim: Optional[TrimResult] = None
+        if self._vad_enabled:
+            try:
+                trim = self._speech.trim_silence(wav_bytes)
+            except AudioFormatError as e:
+                logger.error("ASR 音频格式错误: %s", e)
+                raise
+            self._log_trim(device_sn, trim)
+            if not trim.has_speech:
+                return await self._no_speech_turn(child, session, on_reply_audio, trim)
+
+        # 3. 保存孩子语音（原始录音，S3，放到线程里，避免阻塞事件循环上的其他轮次）
+        user_rel_path, _ = await asyncio.to_thread(
+            self._save_user_wav, child.id, session.id, seq, wav_bytes
+        )
 
-        # 5. ASR
+        # 4. ASR（只送裁剪后的人声段）
+        asr_started = time.monotonic()
         try:
-            user_text_raw = await self._speech.asr(wav_bytes)
+            if trim is not None:
+                user_text_raw = await self._speech.asr_pcm(trim.pcm)
+            else:
+                user_text_raw = await self._speech.asr(wav_bytes)
         except AudioFormatError as e:
             logger.error("ASR 音频格式错误: %s", e)
             raise
         except SpeechError as e:
             logger.error("ASR 识别失败: %s", e)
             raise
+        asr_ms = (time.monotonic() - asr_started) * 1000
+        logger.info("ASR 完成: device_sn=%s, audio_bytes=%s, asr_ms=%.0f", device_sn, len(wav_bytes), asr_ms)
+
+        if not (user_text_raw or "").strip():
+            return await self._no_speech_turn(child, session, on_reply_audio, trim, asr_ms)
+
+        result = await self._reply_turn(
+            db, device, child, session, seq, user_text_raw, user_rel_path, on_reply_audio
+        )
+        result.asr_ms = asr_ms
+        result.trimmed_bytes = trim.trimmed_bytes if trim is not None else 0
+        return result
 
+    async def handle_stream_turn(
+        self,
+        db: Session,
+        device_sn: str,
+        pcm_stream: PcmStream,
+        session_id: Optional[int] = None,
+        on_reply_audio: Optional[ReplyAudioCallback] = None,
+        resume_session_id: Optional[int] = None,
+        on_asr_partial: Optional[AsrPartialCallback] = None,
+    ) -> VoiceTurnResult:
+        """
+        处理一轮边录边传的语音对话：
+        - 音频帧边到达边送 ASR，孩子说完后识别结果几乎立即可用
+        - on_asr_partial 不为空时，识别文本每变化一次回调一次（可能被后续结果修正）
+        - 流结束后再把完整音频包装成 WAV 存档
+        """
+        device, child, session, seq = await self._run_db(
+            db, self._prepare_turn, device_sn, session_id, resume_session_id
+        )
+
+        user_text_raw = ""
+        try:
+            async for hyp in self._speech.asr_stream(pcm_stream):
+                if hyp.final:
+                    user_text_raw = hyp.text
+                elif on_asr_partial is not None:
+                    on_asr_partial(hyp.text)
+        except SpeechError as e:
+            logger.error("ASR 识别失败（流式）: %s", e)
+            raise
+
+        asr_ms = 0.0
+        if pcm_stream.closed_at is not None:
+            asr_ms = (time.monotonic() - pcm_stream.closed_at) * 1000
+            logger.info(
+                "流式 ASR 完成: device_sn=%s, audio_bytes=%s, after_stream_end_ms=%.0f",
+                device_sn,
+                pcm_stream.nbytes,
+                asr_ms,
+            )
+
+        # 识别结束即视为说完；之后 pcm() / wav() 直接用流的缓冲区，不再复制整段录音
+        pcm_stream.close()
+
+        # 流式识别已经边录边送，VAD 只用来判断整段是否没有人声，没有就不再调用 LLM / TTS
+        trim: Optional[TrimResult] = None
+        if self._vad_enabled:
+            trim = self._speech.trim_silence(pcm_stream.pcm(), is_wav=False)
+            self._log_trim(device_sn, trim)
+        if (trim is not None and not trim.has_speech) or not (user_text_raw or "").strip():
+            return await self._no_speech_turn(child, session, on_reply_audio, trim, asr_ms)
+
+        user_rel_path, _ = await asyncio.to_thread(
+            self._save_user_wav, child.id, session.id, seq, pcm_stream.wav()
+        )
+
+        result = await self._reply_turn(
+            db, device, child, session, seq, user_text_raw, user_rel_path, on_reply_audio
+        )
+        result.asr_ms = asr_ms
+        return result
+
+    # ---------- 没有人声 ----------
+
+    @staticmethod
+    def _log_trim(device_sn: str, trim: TrimResult) -> None:
+        logger.info(
+            "VAD: device_sn=%s, has_speech=%s, audio_ms=%.0f, speech_ms=%.0f, trimmed_bytes=%s, trimmed_ms=%.0f",
+            device_sn,
+            trim.has_speech,
+            (trim.speech_seconds + trim.trimmed_seconds) * 1000,
+            trim.speech_seconds * 1000,
+            trim.trimmed_bytes,
+            trim.trimmed_seconds * 1000,
+        )
+
+    async def _no_speech_turn(
+        self,
+        child: models.Child,
+        session: models.ChatSession,
+        on_reply_audio: Optional[ReplyAudioCallback],
+        trim: Optional[TrimResult],
+        asr_ms: float = 0.0,
+    ) -> VoiceTurnResult:
+        """
+        没有听到有效语音：回复缓存好的"没听清"提示。
+        不调用 LLM，不落 Turn、不占 seq（turn_id=0），避免历史里出现空对话。
+        """
+        text = getattr(settings, "VAD_NO_SPEECH_REPLY_TEXT", "") or "我没有听清楚哦，可以再说一遍吗？"
+        if self._no_speech_audio is None:
+            buf = await self._speech.tts(text)
+            # 缓存的 PCM 要跨轮次反复下发，存成 bytes；WAV 直接用 TTS 缓冲区
+            self._no_speech_audio = (bytes(buf.pcm()), buf.wav())
+        pcm, wav = self._no_speech_audio
+
+        if on_reply_audio is not None:
+            on_reply_audio(pcm, False)
+            on_reply_audio(b"", True)
+
+        logger.info("未检测到有效语音，回复提示: child_id=%s, session_id=%s", child.id, session.id)
+        return VoiceTurnResult(
+            child_id=child.id,
+            session_id=session.id,
+            turn_id=0,
+            user_text="",
+            reply_text=text,
+            user_audio_path="",
+            reply_audio_path="",
+            reply_wav_bytes=wav,
+            asr_ms=asr_ms,
+            trimmed_bytes=trim.trimmed_bytes if trim is not None else 0,
+        )
+
+    async def _reply_turn(
+        self,
+        db: Session,
+        device: models.Device,
+        child: models.Child,
+        session: models.ChatSession,
+        seq: int,
+        user_text_raw: str,
+        user_rel_path: str,
+        on_reply_audio: Optional[ReplyAudioCallback],
+    ) -> VoiceTurnResult:
+        """ASR 之后的公共流程：LLM → 安全收敛 → TTS → 存档 → 落库。"""
         user_text = (user_text_raw or "").strip()
         if not user_text:
             user_text = "（未识别到有效语音内容）"
 
         # 6. 构造 LLM messages
-        messages = self._build_messages_for_llm(db, child, device, session, user_text)
+        history_turns = await self._run_db(db, self._load_history, session.id)
+        messages = self._build_messages_for_llm(child, device, history_turns, user_text)
 
-        # 7. 调用 LLM
-        provider, model_name, gen_cfg = self._llm_selector.select_for_child(child, task="chat")
-        logger.info("调用 LLM: provider=%s, model=%s", getattr(provider, "name", "unknown"), model_name)
+        def _on_tts_chunk(chunk: bytes) -> None:
+            if on_reply_audio is not None:
+                on_reply_audio(chunk, False)
 
-        reply_text_raw = await provider.chat(
-            messages,
-            model=model_name,
-            max_tokens=int(gen_cfg.get("max_tokens", 256)),
-            temperature=float(gen_cfg.get("temperature", 0.8)),
-            extra_params={k: v for k, v in gen_cfg.items() if k not in ("max_tokens", "temperature")},
-        )
-        reply_text_raw = (reply_text_raw or "").strip()
+        on_chunk = _on_tts_chunk if on_reply_audio is not None else None
 
-        # 8. 安全收敛
-        reply_text_final = self._sanitize_reply(child, reply_text_raw)
+        # 7. 没有历史的通用问题先查回复缓存，命中直接跳过 LLM
+        cache_key: Optional[str] = None
+        cached_reply: Optional[str] = None
+        if self._reply_cache is not None and len(messages) == 2:
+            cache_key = self._reply_cache.make_key(messages[0]["content"], user_text)
+            if cache_key is not None:
+                cached_reply = self._reply_cache.get(cache_key)
 
-        # 9. TTS
         try:
-            reply_pcm = await self._speech.tts(reply_text_final)
+            if cached_reply is not None:
+                logger.info("LLM 回复缓存命中，跳过 LLM: child_id=%s, user_text=%s", child.id, user_text)
+                reply_text_final = self._sanitize_reply(child, cached_reply)
+                reply_pcm = await self._speech.tts(reply_text_final, on_chunk=on_chunk)
+            else:
+                reply_text_final, reply_pcm, cacheable = await self._llm_reply(child, messages, on_chunk)
+                if cache_key is not None and cacheable:
+                    self._reply_cache.put(cache_key, reply_text_final)
         except SpeechError as e:
             logger.error("TTS 合成失败: %s", e)
             raise
 
-        # 10. PCM → WAV + 落盘（S3）
-        reply_wav_bytes = _pcm_to_wav_bytes(reply_pcm)
-        reply_rel_path, _ = self._save_reply_wav(child.id, session.id, seq, reply_wav_bytes)
+        if on_reply_audio is not None:
+            on_reply_audio(b"", True)
+
+        # 10. PCM → WAV（原地写头，不复制）+ 落盘（S3）
+        reply_wav_bytes = reply_pcm.wav()
+        reply_rel_path, _ = await asyncio.to_thread(
+            self._save_reply_wav, child.id, session.id, seq, reply_wav_bytes
+        )
 
         # 11. 写入 Turn（device_id 必须传）
         turn = models.Turn(
@@ -146,9 +359,7 @@ class VoiceChatService:
             reply_audio_path=reply_rel_path,
             created_at=int(time.time()),
         )
-        db.add(turn)
-        db.commit()
-        db.refresh(turn)
+        turn = await self._run_db(db, self._save_turn, turn)
 
         logger.info(
             "完成一轮对话: child_id=%s, session_id=%s, turn_id=%s, seq=%s",
@@ -169,6 +380,133 @@ class VoiceChatService:
             reply_wav_bytes=reply_wav_bytes,
         )
 
+    async def _llm_reply(
+        self,
+        child: models.Child,
+        messages: List[ChatMessage],
+        on_chunk: Optional[Callable[[bytes], None]],
+    ) -> Tuple[str, PcmBuffer, bool]:
+        """
+        调用 LLM → 安全收敛 → TTS，返回 (最终回复文本, 回复音频, 是否可以缓存)。
+        用到了安全兜底，或者路由转到了 dummy / 降级候选时不可缓存。
+        """
+        provider, model_name, gen_cfg = self._llm_selector.select_for_child(child, task="chat")
+        logger.info("调用 LLM: provider=%s, model=%s", getattr(provider, "name", "unknown"), model_name)
+        llm_kwargs: Dict[str, Any] = {
+            "model": model_name,
+            "max_tokens": int(gen_cfg.get("max_tokens", 256)),
+            "temperature": float(gen_cfg.get("temperature", 0.8)),
+            "extra_params": {k: v for k, v in gen_cfg.items() if k not in ("max_tokens", "temperature")},
+        }
+
+        if self._llm_stream_enabled:
+            # 8 + 9. 流式：每生成完整一句先做安全检查再交给 TTS，模型还在生成后面时第一句已经在合成 / 下发
+            reply_text, reply_pcm, llm_answered = await self._stream_reply(
+                child, provider, messages, llm_kwargs, on_chunk
+            )
+            # 路由失败转到 dummy / 降级候选的固定话术不能当成模型回答缓存
+            return reply_text, reply_pcm, llm_answered and not getattr(provider, "served_by_fallback", False)
+
+        reply_text_raw = await provider.chat(messages, **llm_kwargs)
+        reply_text_raw = (reply_text_raw or "").strip()
+
+        # 8. 安全收敛
+        reply_text_final = self._sanitize_reply(child, reply_text_raw)
+
+        # 9. TTS（可选边合成边下发）
+        reply_pcm = await self._speech.tts(reply_text_final, on_chunk=on_chunk)
+        cacheable = reply_text_final == reply_text_raw and not getattr(provider, "served_by_fallback", False)
+        return reply_text_final, reply_pcm, cacheable
+
+    async def _stream_reply(
+        self,
+        child: models.Child,
+        provider: LlmProvider,
+        messages: List[ChatMessage],
+        llm_kwargs: Dict[str, Any],
+        on_chunk: Optional[Callable[[bytes], None]],
+    ) -> Tuple[str, PcmBuffer, bool]:
+        """
+        流式回复：大模型每生成完整一句，先做安全检查再交给 TTS（tts_stream 按顺序合成下发）。
+
+        某一句命中风险词时停止生成，后面换成兜底回复（已经播出的安全句子保留，不合规的句子不播、不保存）；
+        没有生成任何内容时也回复兜底。返回 (最终回复文本, 回复音频, 是否没有用到兜底)。
+        """
+        spoken: List[str] = []
+        started = time.monotonic()
+        first_sentence_ms = 0.0
+        risky = False
+        fallback = False
+
+        async def _sentences() -> AsyncIterator[str]:
+            nonlocal first_sentence_ms, risky, fallback
+            async with aclosing(provider.chat_stream(messages, **llm_kwargs)) as deltas:
+                async for sentence in self._speech.split_stream(deltas):
+                    if self._is_risky(child, sentence):
+                        risky = True
+                        break
+                    if not spoken:
+                        first_sentence_ms = (time.monotonic() - started) * 1000
+                    spoken.append(sentence)
+                    yield sentence
+
+            if risky or not spoken:
+                fallback = True
+                for sentence in self._speech.tts_segments(_SAFE_FALLBACK_REPLY):
+                    spoken.append(sentence)
+                    yield sentence
+
+        reply_pcm = await self._speech.tts_stream(_sentences(), on_chunk=on_chunk)
+        logger.info(
+            "LLM 流式回复完成: sentences=%s, first_sentence_ms=%.0f, total_ms=%.0f, risky=%s",
+            len(spoken),
+            first_sentence_ms,
+            (time.monotonic() - started) * 1000,
+            risky,
+        )
+        return "".join(spoken), reply_pcm, not fallback
+
+    async def aclose(self) -> None:
+        """释放大模型 provider 的连接池（网关退出时调用）。"""
+        await self._llm_registry.aclose()
+
+    def start_ws_pools(self) -> None:
+        """在当前事件循环上开始预热讯飞连接池（服务启动时在事件循环线程里调用）。"""
+        self._speech.start_ws_pools()
+
+    async def prewarm_tts_cache(self) -> int:
+        """
+        把固定话术预合成进 TTS 缓存：兜底回复、没听清提示，以及 TTS_CACHE_PREWARM_TEXTS 配置的问候语等。
+        返回新合成的条数（已在磁盘缓存中的不再合成）。
+        """
+        texts = [
+            _SAFE_FALLBACK_REPLY,
+            getattr(settings, "VAD_NO_SPEECH_REPLY_TEXT", "") or "我没有听清楚哦，可以再说一遍吗？",
+        ]
+        texts.extend((getattr(settings, "TTS_CACHE_PREWARM_TEXTS", "") or "").split("|"))
+        started = time.monotonic()
+        synthesized = await self._speech.prewarm_tts(texts)
+        logger.info(
+            "TTS 缓存预热完成: synthesized=%s, elapsed_ms=%.0f, stats=%s",
+            synthesized,
+            (time.monotonic() - started) * 1000,
+            self._speech.tts_cache_stats(),
+        )
+        return synthesized
+
+    def tts_cache_stats(self) -> Dict[str, float]:
+        return self._speech.tts_cache_stats()
+
+    def reply_cache_stats(self) -> Dict[str, float]:
+        return self._reply_cache.stats() if self._reply_cache is not None else {}
+
+    async def synthesize_wav(self, text: str) -> bytes:
+        """
+        把一段固定文案合成为 WAV 字节（网关忙碌提示等预合成话术使用，不落库）。
+        """
+        buf = await self._speech.tts(text)
+        return bytes(buf.wav())
+
     def end_session(self, db: Session, session_id: int) -> models.ChatSession:
         """
         手动结束一个会话：自动生成 title
@@ -194,6 +532,40 @@ class VoiceChatService:
 
     # ---------- 内部辅助 ----------
 
+    @staticmethod
+    async def _run_db(db: Session, fn: Callable[..., Any], *args: Any) -> Any:
+        """
+        在线程里执行一段同步 DB 操作，和存档写入一样不占用事件循环。
+        每次新建一个绑定同一数据库的 Session（Session 不跨线程共享），用完即关；
+        返回的 ORM 对象已脱离 Session，只读取已加载的字段。
+        """
+        bind = db.get_bind()
+
+        def _call() -> Any:
+            with Session(bind=bind, autoflush=False, expire_on_commit=False) as thread_db:
+                return fn(thread_db, *args)
+
+        return await asyncio.to_thread(_call)
+
+    def _prepare_turn(
+        self,
+        db: Session,
+        device_sn: str,
+        session_id: Optional[int],
+        resume_session_id: Optional[int],
+    ) -> tuple[models.Device, models.Child, models.ChatSession, int]:
+        device, child = self._load_device_and_child(db, device_sn)
+        session = self._get_or_create_session(db, child, session_id, resume_session_id)
+        seq = self._next_turn_seq(db, session.id)
+        return device, child, session, seq
+
+    @staticmethod
+    def _save_turn(db: Session, turn: models.Turn) -> models.Turn:
+        db.add(turn)
+        db.commit()
+        db.refresh(turn)
+        return turn
+
     def _load_device_and_child(
         self,
         db: Session,
@@ -221,6 +593,7 @@ class VoiceChatService:
         db: Session,
         child: models.Child,
         session_id: Optional[int],
+        resume_session_id: Optional[int] = None,
     ) -> models.ChatSession:
         if session_id is not None:
             session = db.get(models.ChatSession, session_id)
@@ -228,6 +601,12 @@ class VoiceChatService:
                 raise ValueError("Invalid session_id for this child")
             return session
 
+        if resume_session_id is not None:
+            session = db.get(models.ChatSession, resume_session_id)
+            if session is not None and session.child_id == child.id and not session.ended_at:
+                return session
+            logger.info("会话不可续用，新建会话: resume_session_id=%s", resume_session_id)
+
         session = models.ChatSession()
         session.child_id = child.id
         db.add(session)
@@ -245,14 +624,28 @@ class VoiceChatService:
             return 1
         return int(last_seq) + 1
 
-    def _build_messages_for_llm(
-        self,
-        db: Session,
-        child: models.Child,
-        device: models.Device,
-        session: models.ChatSession,
-        current_user_text: str,
-    ) -> List[dict]:
+    def _system_prompt(self, child: models.Child, device: models.Device) -> str:
+        """
+        按 (child, device) 缓存编译好的 system prompt，版本戳是两边的 updated_at（ProfileService 修改档案时刷新）。
+        档案不变时每轮复用同一个字符串，上游大模型的前缀缓存也更容易命中。
+        """
+        key = (child.id, device.id)
+        stamp = (child.updated_at, device.updated_at)
+        cached = self._system_prompts.get(key)
+        if cached is not None and cached[0] == stamp:
+            self._system_prompts.move_to_end(key)
+            return cached[1]
+
+        system_prompt = self._compile_system_prompt(child, device)
+        self._system_prompts[key] = (stamp, system_prompt)
+        self._system_prompts.move_to_end(key)
+        while len(self._system_prompts) > _SYSTEM_PROMPT_CACHE_SIZE:
+            self._system_prompts.popitem(last=False)
+        logger.info("编译 system prompt: child_id=%s, device_id=%s, stamp=%s", child.id, device.id, stamp)
+        return system_prompt
+
+    @staticmethod
+    def _compile_system_prompt(child: models.Child, device: models.Device) -> str:
         interests = _split_str(child.interests)
         forbidden = _split_str(child.forbidden_topics)
 
@@ -262,7 +655,7 @@ class VoiceChatService:
             or f"一个叫{toy_name}的温柔可爱小伙伴，会认真听小朋友说话，轻声细语，喜欢鼓励和安慰小朋友。"
         )
 
-        system_prompt = (
+        return (
             f"你是一个儿童智能语音陪伴玩具，名字叫「{toy_name}」。"
             f"你的性格设定：{toy_persona}。"
             f"说话对象是一个大约 {child.age} 岁的孩子，性别：{child.gender or '未知'}。"
@@ -276,19 +669,30 @@ class VoiceChatService:
             "5）一定用中文回答。"
         )
 
-        messages: List[dict] = [
-            {"role": "system", "content": system_prompt},
-        ]
-
+    def _load_history(self, db: Session, session_id: int) -> List[models.Turn]:
         history_turns: List[models.Turn] = (
             db.query(models.Turn)
-            .filter(models.Turn.session_id == session.id)
+            .filter(models.Turn.session_id == session_id)
             .order_by(models.Turn.seq.asc())
             .all()
         )
 
         if len(history_turns) > self._max_history_turns:
             history_turns = history_turns[-self._max_history_turns :]
+        return history_turns
+
+    def _build_messages_for_llm(
+        self,
+        child: models.Child,
+        device: models.Device,
+        history_turns: List[models.Turn],
+        current_user_text: str,
+    ) -> List[dict]:
+        system_prompt = self._system_prompt(child, device)
+
+        messages: List[dict] = [
+            {"role": "system", "content": system_prompt},
+        ]
 
         for t in history_turns:
             if t.user_text:
@@ -302,7 +706,12 @@ class VoiceChatService:
 
     def _sanitize_reply(self, child: models.Child, reply_text: str) -> str:
         text = reply_text or ""
+        if not text or self._is_risky(child, text):
+            return _SAFE_FALLBACK_REPLY
 
+        return text
+
+    def _is_risky(self, child: models.Child, text: str) -> bool:
         forbidden = _split_str(child.forbidden_topics)
         risk_keywords = set(forbidden) | {
             "自杀",
@@ -315,24 +724,12 @@ class VoiceChatService:
 
         lowered = text.lower()
 
-        def _contains_risk() -> bool:
-            for kw in risk_keywords:
-                if not kw:
-                    continue
-                if kw.lower() in lowered:
-                    return True
-            return False
-
-        if not text or _contains_risk():
-            toy_name = "小悠"
-            return (
-                f"{toy_name}觉得这个话题有点不安全，"
-                "我们先不聊这个哦。"
-                "要不要跟小悠说说你今天遇到的开心事情，"
-                "或者聊聊你喜欢的玩具、动画片、游戏？"
-            )
-
-        return text
+        for kw in risk_keywords:
+            if not kw:
+                continue
+            if kw.lower() in lowered:
+                return True
+        return False
 
     def _generate_session_title(self, db: Session, session: models.ChatSession) -> str:
         first_turn: models.Turn | None = (
@@ -360,7 +757,7 @@ class VoiceChatService:
         child_id: int,
         session_id: int,
         seq: int,
-        wav_bytes: bytes,
+        wav_bytes: BytesLike,
     ) -> tuple[str, str]:
         """保存孩子原始语音到 S3。"""
         key = f"children/{child_id}/sessions/{session_id}/turn_{seq}_user.wav"
@@ -372,7 +769,7 @@ class VoiceChatService:
         child_id: int,
         session_id: int,
         seq: int,
-        reply_wav_bytes: bytes,
+        reply_wav_bytes: BytesLike,
     ) -> tuple[str, str]:
         key = f"children/{child_id}/sessions/{session_id}/turn_{seq}_reply.wav"
         storage_s3.upload_bytes(key, reply_wav_bytes, content_type="audio/wav")
@@ -384,7 +781,7 @@ class VoiceChatService:
         child_id: int,
         session_id: int,
         seq: int,
-        wav_bytes: bytes,
+        wav_bytes: BytesLike,
     ) -> tuple[str, str]:
         rel_dir = os.path.join("children", str(child_id), "sessions", str(session_id))
         rel_path = os.path.join(rel_dir, f"turn_{seq}_user.wav")
@@ -402,7 +799,7 @@ class VoiceChatService:
         child_id: int,
         session_id: int,
         seq: int,
-        reply_wav_bytes: bytes,
+        reply_wav_bytes: BytesLike,
     ) -> tuple[str, str]:
         rel_dir = os.path.join("children", str(child_id), "sessions", str(session_id))
         rel_path = os.path.join(rel_dir, f"turn_{seq}_reply.wav")
@@ -421,15 +818,3 @@ def _split_str(s: str | None) -> List[str]:
         return []
     return [x.strip() for x in s.split(",") if x.strip()]
 
-
-def _pcm_to_wav_bytes(pcm: bytes, *, sample_rate: int = 16000) -> bytes:
-    """
-    把 16bit 单声道 PCM 包装成标准 WAV 字节。
-    """
-    buf = io.BytesIO()
-    with wave.open(buf, "wb") as wf:
-        wf.setnchannels(1)
-        wf.setsampwidth(2)  # 16bit
-        wf.setframerate(sample_rate)
-        wf.writeframes(pcm)
-    return buf.getvalue()
@@ -5,25 +5,28 @@
 # @Description:
 from __future__ import annotations
 
+import asyncio
 import base64
 import hashlib
 import hmac
-import io
 import json
 import ssl
 import threading
 import time
-import wave
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
 from time import mktime
-from typing import Any, Dict, Optional
-from urllib.parse import urlencode
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, Iterator, Optional
+from urllib.parse import urlencode, urlsplit
 
 import websocket
+from websockets.asyncio.client import ClientConnection
+from websockets.exceptions import ConnectionClosed
 from wsgiref.handlers import format_date_time
 
 from app.infra.ylogger import ylogger
+from app.speech.audio_buffer import BytesLike, parse_wav
+from app.speech.ws_pool import AsyncXfyunWsPool, XfyunWsPool
 
 
 class AudioFormatError(Exception):
@@ -34,19 +37,52 @@ class SpeechError(Exception):
     """ASR/TTS 调用失败时抛出。"""
 
 
+# 上传节奏
+PACING_BURST = "burst"  # 已录好的音频：不限速，帧一组好就发
+PACING_REALTIME = "realtime"  # 按音频时长匀速发送（模拟实时录音）
+
+# 讯飞 WebSocket 服务地址；压测时可指向 benchmarks/xfyun_emulator.py
+DEFAULT_BASE_URL = "wss://ws-api.xfyun.cn"
+
+# 16k 单声道 16bit，每秒字节数
+_BYTES_PER_SECOND = 16000 * 2
+
+
+@dataclass(frozen=True)
+class AsrHypothesis:
+    """
+    流式识别的一次识别假设：
+    - final=False：中间结果，后续可能被动态修正（wpgs）改写
+    - final=True：本次识别的最终文本，一次识别只出现一次且在最后
+    """
+
+    text: str
+    final: bool
+
+
 @dataclass
 class _AsrResult:
     text: str = ""
+    # 按 sn 排列的识别片段；动态修正时按 rg 替换
+    segments: Dict[int, str] = field(default_factory=dict)
     error: Optional[str] = None
+    # 收到 status=2 的最终结果
+    final: bool = False
+    audio_bytes: int = 0
+    frames: int = 0
+    # time.monotonic()：最后一帧发出 / 最终结果到达
+    last_frame_at: Optional[float] = None
+    final_at: Optional[float] = None
 
 
-def _build_ws_url(app_id: str, api_key: str, api_secret: str) -> str:
+def _build_ws_url(app_id: str, api_key: str, api_secret: str, base_url: str = DEFAULT_BASE_URL) -> str:
     """
-    构造讯飞 ASR WebSocket URL。
+    构造讯飞 ASR WebSocket URL。base_url 可指向本地模拟服务（如 ws://127.0.0.1:8790）。
     """
-    host = "ws-api.xfyun.cn"
+    parts = urlsplit(base_url)
+    host = parts.netloc
     path = "/v2/iat"
-    url = f"wss://{host}{path}"
+    url = f"{parts.scheme}://{host}{path}"
 
     now = datetime.now()
     date = format_date_time(mktime(now.timetuple()))
@@ -76,31 +112,138 @@ def _build_ws_url(app_id: str, api_key: str, api_secret: str) -> str:
     return f"{url}?{urlencode(params)}"
 
 
-def _extract_pcm_from_wav(wav_bytes: bytes) -> bytes:
+def _extract_pcm_from_wav(wav_bytes: BytesLike) -> memoryview:
     """
-    从 WAV 字节中提取单声道、16k、16bit 的原始 PCM 数据。
+    从 WAV 字节中取出单声道、16k、16bit 的原始 PCM 数据（memoryview，不复制）。
     """
-    bio = io.BytesIO(wav_bytes)
     try:
-        with wave.open(bio, "rb") as wf:
-            nchannels = wf.getnchannels()
-            sampwidth = wf.getsampwidth()
-            framerate = wf.getframerate()
-            if nchannels != 1:
-                raise AudioFormatError(f"只支持单声道，当前 nchannels={nchannels}")
-            if sampwidth != 2:
-                raise AudioFormatError(f"只支持 16bit 采样，当前 sampwidth={sampwidth}")
-            if framerate != 16000:
-                raise AudioFormatError(f"需要采样率 16000Hz，当前 framerate={framerate}")
-            pcm = wf.readframes(wf.getnframes())
-    except wave.Error as e:
+        fmt, pcm = parse_wav(wav_bytes)
+    except ValueError as e:
         raise AudioFormatError(f"WAV 文件解析失败: {e}") from e
+    if fmt.channels != 1:
+        raise AudioFormatError(f"只支持单声道，当前 nchannels={fmt.channels}")
+    if fmt.sample_width != 2:
+        raise AudioFormatError(f"只支持 16bit 采样，当前 sampwidth={fmt.sample_width}")
+    if fmt.sample_rate != 16000:
+        raise AudioFormatError(f"需要采样率 16000Hz，当前 framerate={fmt.sample_rate}")
     return pcm
 
 
+def _audio_frame(status: int, buf: BytesLike) -> Dict[str, Any]:
+    return {
+        "status": status,
+        "format": "audio/L16;rate=16000",
+        "audio": base64.b64encode(buf).decode("utf-8"),
+        "encoding": "raw",
+    }
+
+
+def _first_frame(app_id: str, buf: BytesLike, wpgs: bool = False) -> Dict[str, Any]:
+    """首帧带上 app_id 和业务参数；wpgs=True 时开启动态修正（仅中文普通话）。"""
+    business: Dict[str, Any] = {
+        "domain": "iat",
+        "language": "zh_cn",
+        "accent": "mandarin",
+        "vinfo": 1,
+        "vad_eos": 10000,
+    }
+    if wpgs:
+        business["dwa"] = "wpgs"
+    return {
+        "common": {"app_id": app_id},
+        "business": business,
+        "data": _audio_frame(0, buf),
+    }
+
+
+def _handle_message(message: str, result: _AsrResult) -> bool:
+    """
+    解析一条服务端消息，累积到 result，返回识别文本是否有变化。
+
+    每条结果带序号 sn；开启动态修正后 pgs=rpl 的结果会替换 rg=[起, 止] 范围内
+    之前的片段，pgs=apd 则直接追加。未开启时没有 pgs，等同追加。
+    """
+    try:
+        data = json.loads(message)
+    except ValueError as e:
+        ylogger.error("ASR 响应解析失败: %s", e)
+        result.error = str(e)
+        return False
+
+    code = data.get("code", -1)
+    if code != 0:
+        err_msg = data.get("message", "unknown error")
+        sid = data.get("sid", "")
+        msg = f"ASR 失败: sid={sid}, code={code}, message={err_msg}"
+        ylogger.error(msg)
+        result.error = msg
+        return False
+
+    payload = data.get("data", {})
+    result_data = payload.get("result") or {}
+    changed = False
+    if result_data:
+        words = "".join(cw.get("w") or "" for seg in result_data.get("ws", []) for cw in seg.get("cw", []))
+        sn = int(result_data.get("sn") or (max(result.segments, default=0) + 1))
+        if result_data.get("pgs") == "rpl":
+            first, last = (result_data.get("rg") or [sn, sn])[:2]
+            for k in range(int(first), int(last) + 1):
+                result.segments.pop(k, None)
+        result.segments[sn] = words
+
+        text = "".join(result.segments[k] for k in sorted(result.segments))
+        changed = text != result.text
+        result.text = text
+
+    # status=2：最终结果，识别结束
+    if payload.get("status") == 2:
+        result.final = True
+        result.final_at = time.monotonic()
+    return changed
+
+
+def _finish(result: _AsrResult, realtime: bool, timeout: int, started_at: float, connected_at: float) -> str:
+    """记录本次识别的耗时，返回识别文本；出错或没有任何结果时抛 SpeechError。"""
+    if result.error:
+        raise SpeechError(result.error)
+
+    now = time.monotonic()
+    ylogger.info(
+        "ASR 完成: pacing=%s, final=%s, audio_ms=%.0f, frames=%s, connect_ms=%.0f, wall_ms=%.0f, "
+        "after_last_frame_ms=%s",
+        PACING_REALTIME if realtime else PACING_BURST,
+        result.final,
+        result.audio_bytes * 1000 / _BYTES_PER_SECOND,
+        result.frames,
+        (connected_at - started_at) * 1000,
+        ((result.final_at or now) - started_at) * 1000,
+        f"{((result.final_at or now) - result.last_frame_at) * 1000:.0f}" if result.last_frame_at else "-",
+    )
+
+    if not result.final:
+        if not result.text:
+            raise SpeechError(f"ASR 未在 {timeout}s 内返回最终结果")
+        ylogger.warning("ASR 未收到最终结果，使用已识别的部分文本")
+
+    return result.text.strip()
+
+
+def _split_frames(pcm_bytes: BytesLike, frame_size: int) -> Iterator[memoryview]:
+    # memoryview 切片不复制，base64 直接编码
+    view = memoryview(pcm_bytes)
+    for offset in range(0, len(view), frame_size):
+        yield view[offset:offset + frame_size]
+
+
 class XfyunAsrClient:
     """
     讯飞 ASR 客户端，只负责识别。
+
+    - 已录好的整段音频（recognize）：默认 burst，不做帧间 sleep；
+      pacing=realtime 时按音频时长匀速发送
+    - 边录边传（recognize_stream）：帧到达即发送，节奏由录音端决定
+    - 发完结束帧后不再固定等待，收到 status=2 的最终结果即返回
+    - pool_size > 0 时使用预热连接池，握手不在调用路径上
     """
 
     def __init__(
@@ -109,11 +252,32 @@ class XfyunAsrClient:
         api_key: str,
         api_secret: str,
         sslopt: Optional[Dict[str, Any]] = None,
+        pacing: str = PACING_BURST,
+        frame_bytes: int = 8000,
+        pool_size: int = 0,
+        pool_max_idle: float = 8.0,
+        base_url: str = DEFAULT_BASE_URL,
+        wpgs: bool = False,
     ) -> None:
+        if pacing not in (PACING_BURST, PACING_REALTIME):
+            raise ValueError(f"未知的 ASR 上传节奏: {pacing}")
+
         self._app_id = app_id
         self._api_key = api_key
         self._api_secret = api_secret
+        self._base_url = base_url
         self._sslopt = sslopt or {"cert_reqs": ssl.CERT_NONE}
+        self._pacing = pacing
+        self._frame_bytes = frame_bytes
+        self._wpgs = wpgs
+        # 每次连接都现签 URL；pool_size > 0 时由后台线程提前建好连接
+        self._pool = XfyunWsPool(
+            "asr",
+            lambda: _build_ws_url(self._app_id, self._api_key, self._api_secret, self._base_url),
+            self._sslopt,
+            size=pool_size,
+            max_idle=pool_max_idle,
+        )
 
     def recognize(self, wav_bytes: bytes, timeout: int = 30) -> str:
         """
@@ -122,132 +286,279 @@ class XfyunAsrClient:
         - 输出：中文文本
         """
         pcm_bytes = _extract_pcm_from_wav(wav_bytes)
-        ws_url = _build_ws_url(self._app_id, self._api_key, self._api_secret)
+        return self._recognize_frames(
+            _split_frames(pcm_bytes, self._frame_bytes),
+            realtime=self._pacing == PACING_REALTIME,
+            timeout=timeout,
+        )
 
+    def recognize_stream(self, frames: Iterable[bytes], timeout: int = 90) -> str:
+        """
+        边录边识别：
+        - 输入：16k 单声道 16bit PCM 帧的（阻塞）迭代器，帧到达即发送，不额外限速
+        - 输出：中文文本
+        """
+        return self._recognize_frames(frames, realtime=False, timeout=timeout)
+
+    def _recognize_frames(self, frames: Iterable[bytes], realtime: bool, timeout: int) -> str:
         result = _AsrResult()
-        done_event = threading.Event()
-
-        def on_message(ws: websocket.WebSocketApp, message: str) -> None:
-            try:
-                data = json.loads(message)
-                code = data.get("code", -1)
-                if code != 0:
-                    err_msg = data.get("message", "unknown error")
-                    sid = data.get("sid", "")
-                    msg = f"ASR 失败: sid={sid}, code={code}, message={err_msg}"
-                    ylogger.error(msg)
-                    result.error = msg
-                    done_event.set()
-                    ws.close()
+        started_at = time.monotonic()
+        deadline = started_at + timeout
+
+        try:
+            ws = self._pool.acquire()
+        except Exception as e:  # noqa: BLE001
+            raise SpeechError(f"ASR 连接失败: {e}") from e
+        connected_at = time.monotonic()
+
+        # 接收在当前线程，发送在单独线程（边录边传时 frames 会阻塞等待下一帧）
+        stop_sending = threading.Event()
+        sender = threading.Thread(
+            target=self._send_frames,
+            args=(ws, frames, realtime, result, stop_sending),
+            name="xfyun-asr-send",
+            daemon=True,
+        )
+        sender.start()
+
+        try:
+            while not result.final and result.error is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                ws.settimeout(remaining)
+                try:
+                    message = ws.recv()
+                except websocket.WebSocketTimeoutException:
+                    break
+                except (websocket.WebSocketConnectionClosedException, OSError) as e:
+                    # 发送线程出错时会 abort 连接；否则是服务端提前断开
+                    if result.error is None and not result.final:
+                        ylogger.error("ASR WebSocket 断开: %s", e)
+                        result.error = f"ASR 连接断开: {e}"
+                    break
+                if not message:
+                    # 服务端关闭连接
+                    break
+                _handle_message(message, result)
+        finally:
+            stop_sending.set()
+            ws.close(timeout=0)
+
+        return _finish(result, realtime, timeout, started_at, connected_at)
+
+    def _send_frames(
+        self,
+        ws: websocket.WebSocket,
+        frames: Iterable[bytes],
+        realtime: bool,
+        result: _AsrResult,
+        stop_sending: threading.Event,
+    ) -> None:
+        try:
+            status = 0  # 0: first, 1: middle, 2: last
+            send_started = time.monotonic()
+
+            for buf in frames:
+                if not buf:
+                    continue
+                if stop_sending.is_set():
+                    # 出错 / 已结束，不再继续发送
                     return
 
-                result_data = data.get("data", {}).get("result", {}).get("ws", [])
-                for seg in result_data:
-                    for cw in seg.get("cw", []):
-                        w = cw.get("w") or ""
-                        result.text += w
-            except Exception as e:  # noqa: BLE001
-                ylogger.exception("ASR on_message 异常: %s", e)
-                result.error = str(e)
-                done_event.set()
-                ws.close()
-
-        def on_error(ws: websocket.WebSocketApp, error: Exception) -> None:
-            ylogger.error("ASR WebSocket 错误: %s", error)
-            result.error = str(error)
-            done_event.set()
-
-        def on_close(ws: websocket.WebSocketApp, code: int, msg: str) -> None:
-            ylogger.info("ASR WebSocket 关闭: code=%s, msg=%s", code, msg)
-
-        def on_open(ws: websocket.WebSocketApp) -> None:
-            def run() -> None:
-                try:
-                    frame_size = 8000
-                    interval = 0.04
-                    status = 0  # 0: first, 1: middle, 2: last
-
-                    bio = io.BytesIO(pcm_bytes)
-
-                    while True:
-                        buf = bio.read(frame_size)
-                        if not buf:
-                            status = 2
-
-                        if status == 0:
-                            data = {
-                                "common": {"app_id": self._app_id},
-                                "business": {
-                                    "domain": "iat",
-                                    "language": "zh_cn",
-                                    "accent": "mandarin",
-                                    "vinfo": 1,
-                                    "vad_eos": 10000,
-                                },
-                                "data": {
-                                    "status": 0,
-                                    "format": "audio/L16;rate=16000",
-                                    "audio": base64.b64encode(buf).decode("utf-8"),
-                                    "encoding": "raw",
-                                },
-                            }
-                            ws.send(json.dumps(data))
-                            status = 1
-                        elif status == 1:
-                            data = {
-                                "data": {
-                                    "status": 1,
-                                    "format": "audio/L16;rate=16000",
-                                    "audio": base64.b64encode(buf).decode("utf-8"),
-                                    "encoding": "raw",
-                                }
-                            }
-                            ws.send(json.dumps(data))
-                        elif status == 2:
-                            data = {
-                                "data": {
-                                    "status": 2,
-                                    "format": "audio/L16;rate=16000",
-                                    "audio": base64.b64encode(buf or b"").decode("utf-8"),
-                                    "encoding": "raw",
-                                }
-                            }
-                            ws.send(json.dumps(data))
-                            time.sleep(0.5)
-                            break
-
-                        time.sleep(interval)
-
-                except Exception as e:  # noqa: BLE001
-                    ylogger.exception("ASR 发送线程异常: %s", e)
-                    result.error = str(e)
-                finally:
-                    done_event.set()
-                    ws.close()
-
-            threading.Thread(target=run, name="xfyun-asr-send", daemon=True).start()
-
-        ws = websocket.WebSocketApp(
-            ws_url,
-            on_message=on_message,
-            on_error=on_error,
-            on_close=on_close,
+                if status == 0:
+                    ws.send(json.dumps(_first_frame(self._app_id, buf, self._wpgs)))
+                    status = 1
+                else:
+                    ws.send(json.dumps({"data": _audio_frame(1, buf)}))
+                result.audio_bytes += len(buf)
+                result.frames += 1
+
+                if realtime:
+                    # 对齐到音频时间轴，不按固定间隔 sleep，避免累计漂移
+                    delay = send_started + result.audio_bytes / _BYTES_PER_SECOND - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+
+            if status == 0:
+                # 没有任何音频，也要先发首帧带上业务参数
+                ws.send(json.dumps(_first_frame(self._app_id, b"", self._wpgs)))
+
+            ws.send(json.dumps({"data": _audio_frame(2, b"")}))
+            result.last_frame_at = time.monotonic()
+            # 不再固定等待：接收端收到最终结果后结束
+
+        except Exception as e:  # noqa: BLE001
+            if stop_sending.is_set():
+                return
+            ylogger.exception("ASR 发送线程异常: %s", e)
+            result.error = str(e)
+            # 唤醒阻塞在 recv 的接收端
+            ws.abort()
+
+
+class AsyncXfyunAsrClient:
+    """
+    讯飞 ASR 客户端的 asyncio 版本（服务端使用）：
+
+    - 收发都在当前事件循环上完成，一次识别不再占用额外线程
+    - 上传节奏、最终结果判定、超时语义与 XfyunAsrClient 一致
+    - 同步版 XfyunAsrClient 保留给脚本 / 离线工具使用
+    """
+
+    def __init__(
+        self,
+        app_id: str,
+        api_key: str,
+        api_secret: str,
+        sslopt: Optional[Dict[str, Any]] = None,
+        pacing: str = PACING_BURST,
+        frame_bytes: int = 8000,
+        pool_size: int = 0,
+        pool_max_idle: float = 8.0,
+        base_url: str = DEFAULT_BASE_URL,
+        wpgs: bool = False,
+    ) -> None:
+        if pacing not in (PACING_BURST, PACING_REALTIME):
+            raise ValueError(f"未知的 ASR 上传节奏: {pacing}")
+
+        self._app_id = app_id
+        self._api_key = api_key
+        self._api_secret = api_secret
+        self._base_url = base_url
+        self._pacing = pacing
+        self._frame_bytes = frame_bytes
+        self._wpgs = wpgs
+        self._pool = AsyncXfyunWsPool(
+            "asr",
+            lambda: _build_ws_url(self._app_id, self._api_key, self._api_secret, self._base_url),
+            sslopt or {"cert_reqs": ssl.CERT_NONE},
+            size=pool_size,
+            max_idle=pool_max_idle,
         )
-        ws.on_open = on_open
 
-        ws_thread = threading.Thread(
-            target=ws.run_forever,
-            kwargs={"sslopt": self._sslopt},
-            name="xfyun-asr-ws",
-            daemon=True,
+    def start_pool(self) -> None:
+        """在当前事件循环上开始预热连接池（服务启动时调用）。"""
+        self._pool.start()
+
+    async def recognize(self, wav_bytes: bytes, timeout: int = 30) -> str:
+        """
+        识别整段 WAV（16k 单声道 16bit），返回中文文本。
+        """
+        return await self.recognize_pcm(_extract_pcm_from_wav(wav_bytes), timeout=timeout)
+
+    async def recognize_pcm(self, pcm_bytes: BytesLike, timeout: int = 30) -> str:
+        """
+        识别整段 PCM（16k 单声道 16bit，如 VAD 裁剪后的音频），返回中文文本。
+        """
+
+        async def frames() -> AsyncIterator[memoryview]:
+            for buf in _split_frames(pcm_bytes, self._frame_bytes):
+                yield buf
+
+        return await self._final_text(
+            self._hypotheses(frames(), realtime=self._pacing == PACING_REALTIME, timeout=timeout)
         )
-        ws_thread.start()
 
-        done_event.wait(timeout=timeout)
-        ws.close()
-        ws_thread.join(timeout=2)
+    async def recognize_stream(self, frames: AsyncIterable[bytes], timeout: int = 90) -> str:
+        """
+        边录边识别：frames 为 16k 单声道 16bit PCM 帧的异步迭代器，帧到达即发送。
+        """
+        return await self._final_text(self.stream(frames, timeout=timeout))
+
+    def stream(self, frames: AsyncIterable[bytes], timeout: int = 90) -> AsyncIterator[AsrHypothesis]:
+        """
+        边录边识别，识别文本每变化一次产出一个中间假设（final=False），
+        最后产出一次最终文本（final=True）。开启 wpgs 时中间假设可能改写前面的字。
+        """
+        return self._hypotheses(frames, realtime=False, timeout=timeout)
 
-        if result.error:
-            raise SpeechError(result.error)
+    @staticmethod
+    async def _final_text(hypotheses: AsyncIterator[AsrHypothesis]) -> str:
+        text = ""
+        async for hyp in hypotheses:
+            text = hyp.text
+        return text
 
-        return result.text.strip()
+    async def _hypotheses(
+        self,
+        frames: AsyncIterable[bytes],
+        realtime: bool,
+        timeout: int,
+    ) -> AsyncIterator[AsrHypothesis]:
+        result = _AsrResult()
+        started_at = time.monotonic()
+        deadline = started_at + timeout
+
+        try:
+            ws = await self._pool.acquire()
+        except Exception as e:  # noqa: BLE001
+            raise SpeechError(f"ASR 连接失败: {e}") from e
+        connected_at = time.monotonic()
+
+        sender = asyncio.create_task(self._send_frames(ws, frames, realtime, result))
+        try:
+            while not result.final and result.error is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    message = await asyncio.wait_for(ws.recv(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                except ConnectionClosed as e:
+                    # 发送任务出错时会关闭连接；否则是服务端提前断开
+                    if result.error is None and not result.final:
+                        ylogger.error("ASR WebSocket 断开: %s", e)
+                        result.error = f"ASR 连接断开: {e}"
+                    break
+                if _handle_message(message, result) and not result.final:
+                    yield AsrHypothesis(text=result.text.strip(), final=False)
+        finally:
+            sender.cancel()
+            await asyncio.gather(sender, return_exceptions=True)
+            self._pool.discard(ws)
+
+        yield AsrHypothesis(text=_finish(result, realtime, timeout, started_at, connected_at), final=True)
+
+    async def _send_frames(
+        self,
+        ws: ClientConnection,
+        frames: AsyncIterable[bytes],
+        realtime: bool,
+        result: _AsrResult,
+    ) -> None:
+        try:
+            status = 0  # 0: first, 1: middle, 2: last
+            send_started = time.monotonic()
+
+            async for buf in frames:
+                if not buf:
+                    continue
+
+                if status == 0:
+                    await ws.send(json.dumps(_first_frame(self._app_id, buf, self._wpgs)))
+                    status = 1
+                else:
+                    await ws.send(json.dumps({"data": _audio_frame(1, buf)}))
+                result.audio_bytes += len(buf)
+                result.frames += 1
+
+                if realtime:
+                    # 对齐到音频时间轴，不按固定间隔 sleep，避免累计漂移
+                    delay = send_started + result.audio_bytes / _BYTES_PER_SECOND - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+
+            if status == 0:
+                # 没有任何音频，也要先发首帧带上业务参数
+                await ws.send(json.dumps(_first_frame(self._app_id, b"", self._wpgs)))
+
+            await ws.send(json.dumps({"data": _audio_frame(2, b"")}))
+            result.last_frame_at = time.monotonic()
+
+        except Exception as e:  # noqa: BLE001
+            ylogger.exception("ASR 发送任务异常: %s", e)
+            result.error = str(e)
+            # 关闭连接，让阻塞在 recv 的接收端退出
+            await ws.close()
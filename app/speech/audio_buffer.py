@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+# @File: audio_buffer.py
+# @Author: yaccii
+# @Time: 2025-11-17 17:51
+# @Description:
+"""
+音频缓冲区与 WAV 头（16bit PCM），上下行音频尽量各只分配一次：
+
+- 上行：parse_wav 用 struct 解析 WAV 头，返回指向原始 payload 的 memoryview；
+  VAD 裁剪、切 ASR 帧都是 memoryview 切片，不复制
+- 下行：PcmBuffer 预留 44 字节 WAV 头，TTS 帧直接追加到同一个 bytearray（摊还线性），
+  结束时原地写头，得到的 bytearray 就是完整 WAV，直接发布 / 上传
+- 标准 44 字节头走快速路径；带 LIST 等附加 chunk 的 WAV 按 chunk 逐个查找
+"""
+from __future__ import annotations
+
+import struct
+from dataclasses import dataclass
+from typing import Tuple, Union
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+WAV_HEADER_SIZE = 44
+
+# RIFF 头 + fmt chunk（16 字节）+ data chunk 头
+_CANONICAL_HEADER = struct.Struct("<4sI4s4sIHHIIHH4sI")
+_RIFF_HEADER = struct.Struct("<4sI4s")
+_CHUNK_HEADER = struct.Struct("<4sI")
+_FMT_BODY = struct.Struct("<HHIIHH")
+
+_FORMAT_PCM = 1
+_FORMAT_EXTENSIBLE = 0xFFFE
+
+# 追加静音用的零字节，切片复用，不每次分配
+_ZEROS = memoryview(bytes(32000))
+
+
+@dataclass(frozen=True)
+class WavFormat:
+    channels: int
+    sample_rate: int
+    sample_width: int
+
+
+def _pack_header(
+    buf: Union[bytearray, memoryview],
+    pcm_bytes: int,
+    sample_rate: int,
+    channels: int,
+    sample_width: int,
+) -> None:
+    _CANONICAL_HEADER.pack_into(
+        buf,
+        0,
+        b"RIFF",
+        36 + pcm_bytes,
+        b"WAVE",
+        b"fmt ",
+        16,
+        _FORMAT_PCM,
+        channels,
+        sample_rate,
+        sample_rate * channels * sample_width,
+        channels * sample_width,
+        sample_width * 8,
+        b"data",
+        pcm_bytes,
+    )
+
+
+def wav_header(pcm_bytes: int, *, sample_rate: int = 16000, channels: int = 1, sample_width: int = 2) -> bytes:
+    """标准 44 字节 WAV 头。"""
+    header = bytearray(WAV_HEADER_SIZE)
+    _pack_header(header, pcm_bytes, sample_rate, channels, sample_width)
+    return bytes(header)
+
+
+def pcm_to_wav(pcm: BytesLike, *, sample_rate: int = 16000) -> bytes:
+    """把 16bit 单声道 PCM 包装成 WAV（头 + 数据一次拼接）。"""
+    return b"".join((wav_header(len(pcm), sample_rate=sample_rate), pcm))
+
+
+def parse_wav(data: BytesLike) -> Tuple[WavFormat, memoryview]:
+    """
+    解析 WAV，返回 (格式, PCM 数据的 memoryview)，不复制数据；格式不对时抛 ValueError。
+
+    data chunk 声明的长度超过实际数据时（边录边写的文件常见）按实际长度截断。
+    """
+    view = memoryview(data)
+    if view.ndim != 1 or view.itemsize != 1:
+        view = view.cast("B")
+
+    # 快速路径：标准 44 字节头
+    if len(view) >= WAV_HEADER_SIZE:
+        (riff, _, wave_id, fmt_id, fmt_size, audio_format, channels, sample_rate, _, _, bits, data_id, data_size) = (
+            _CANONICAL_HEADER.unpack_from(view)
+        )
+        if riff == b"RIFF" and wave_id == b"WAVE" and fmt_id == b"fmt " and fmt_size == 16 and data_id == b"data":
+            fmt = _check_format(audio_format, channels, sample_rate, bits)
+            return fmt, view[WAV_HEADER_SIZE:min(len(view), WAV_HEADER_SIZE + data_size)]
+
+    if len(view) < _RIFF_HEADER.size:
+        raise ValueError(f"WAV 数据过短: bytes={len(view)}")
+    riff, _, wave_id = _RIFF_HEADER.unpack_from(view)
+    if riff != b"RIFF" or wave_id != b"WAVE":
+        raise ValueError("不是 RIFF/WAVE 格式")
+
+    fmt = None
+    offset = _RIFF_HEADER.size
+    while offset + _CHUNK_HEADER.size <= len(view):
+        chunk_id, size = _CHUNK_HEADER.unpack_from(view, offset)
+        body = offset + _CHUNK_HEADER.size
+        if chunk_id == b"fmt ":
+            if size < _FMT_BODY.size or body + _FMT_BODY.size > len(view):
+                raise ValueError(f"fmt chunk 过短: size={size}")
+            audio_format, channels, sample_rate, _, _, bits = _FMT_BODY.unpack_from(view, body)
+            fmt = _check_format(audio_format, channels, sample_rate, bits)
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise ValueError("data chunk 之前缺少 fmt chunk")
+            return fmt, view[body:min(len(view), body + size)]
+        # chunk 按 2 字节对齐
+        offset = body + size + (size & 1)
+
+    raise ValueError("缺少 data chunk")
+
+
+def _check_format(audio_format: int, channels: int, sample_rate: int, bits: int) -> WavFormat:
+    if audio_format not in (_FORMAT_PCM, _FORMAT_EXTENSIBLE):
+        raise ValueError(f"只支持 PCM 编码，当前 format={audio_format}")
+    if channels == 0 or bits == 0 or bits % 8:
+        raise ValueError(f"WAV 格式非法: channels={channels}, bits={bits}")
+    return WavFormat(channels=channels, sample_rate=sample_rate, sample_width=bits // 8)
+
+
+class PcmBuffer:
+    """
+    可增长的 16bit 单声道 PCM 缓冲区，头部预留 44 字节给 WAV 头。
+
+    - append / append_silence：追加到同一个 bytearray，不会像 bytes += 那样每次复制全部已有数据
+    - pcm()：PCM 部分的 memoryview（不复制）
+    - wav()：原地写入 WAV 头，返回内部 bytearray 本身（不复制）
+
+    导出 pcm() 的 memoryview 之后 bytearray 不能再扩容，wav() / pcm() 都应在追加结束后调用。
+    """
+
+    __slots__ = ("sample_rate", "_buf")
+
+    def __init__(self, *, sample_rate: int = 16000) -> None:
+        self.sample_rate = sample_rate
+        self._buf = bytearray(WAV_HEADER_SIZE)
+
+    def __len__(self) -> int:
+        return len(self._buf) - WAV_HEADER_SIZE
+
+    def append(self, data: BytesLike) -> None:
+        self._buf += data
+
+    def append_silence(self, nbytes: int) -> None:
+        while nbytes > 0:
+            n = min(nbytes, len(_ZEROS))
+            self._buf += _ZEROS[:n]
+            nbytes -= n
+
+    def pcm(self) -> memoryview:
+        return memoryview(self._buf)[WAV_HEADER_SIZE:]
+
+    def wav(self) -> bytearray:
+        _pack_header(self._buf, len(self), self.sample_rate, 1, 2)
+        return self._buf
@@ -7,21 +7,37 @@
 from __future__ import annotations
 
 import asyncio
+import os
 import ssl
-from typing import Any, Dict
+import time
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
 
 import certifi
 
 from app.infra.config import settings
-from app.speech.asr_xfyun import XfyunAsrClient
-from app.speech.tts_xfyun import XfyunTtsClient
+from app.infra.ylogger import ylogger
+from app.speech.asr_xfyun import DEFAULT_BASE_URL, AsrHypothesis, AsyncXfyunAsrClient, _extract_pcm_from_wav
+from app.speech.audio_buffer import BytesLike, PcmBuffer
+from app.speech.pcm_stream import PcmStream
+from app.speech.sentences import iter_sentences, split_sentences
+from app.speech.tts_cache import TtsCache
+from app.speech.tts_xfyun import TAIL_SILENCE_BYTES, AsyncXfyunTtsClient
+from app.speech.vad import EnergyVad, TrimResult
+
+# 缓存命中时 on_chunk 按这个大小分片回调，和在线合成时讯飞下发的帧大小相当
+_CACHED_CHUNK_BYTES = 8192
 
 
 class SpeechClient:
     """
     语音服务统一入口：
-    - asr(wav_bytes) -> 文本
-    - tts(text) -> PCM 字节
+    - asr(wav_bytes) / asr_pcm(pcm) -> 文本
+    - trim_silence(wav_bytes / pcm) -> 裁掉前后静音的 PCM（VAD，本地计算，不调用讯飞）
+    - asr_stream(pcm_stream) -> 识别假设的异步迭代器（边录边识别，中间结果 + 最终结果）
+    - tts(text) -> PcmBuffer（pcm() / wav() 都不复制音频）；固定文案命中 TTS 缓存时不请求讯飞
+    - tts_stream(sentences) -> PcmBuffer（句子边生成边合成，配合大模型流式输出）
+
+    底层是 asyncio 版讯飞客户端，收发都在调用方的事件循环上，不再为每次调用开线程。
     """
 
     def __init__(self) -> None:
@@ -42,27 +58,289 @@ class SpeechClient:
                 "cert_reqs": ssl.CERT_NONE,
             }
 
-        self._asr = XfyunAsrClient(
+        pool_size = int(getattr(settings, "XFYUN_WS_POOL_SIZE", 2))
+        pool_max_idle = float(getattr(settings, "XFYUN_WS_POOL_MAX_IDLE_SECONDS", 8.0))
+        base_url = (getattr(settings, "XFYUN_WS_BASE_URL", "") or DEFAULT_BASE_URL).rstrip("/")
+
+        self._asr = AsyncXfyunAsrClient(
             app_id=app_id,
             api_key=api_key,
             api_secret=api_secret,
             sslopt=sslopt,
+            pacing=(getattr(settings, "ASR_PACING", "burst") or "burst").strip().lower(),
+            frame_bytes=int(getattr(settings, "ASR_FRAME_BYTES", 8000)),
+            pool_size=pool_size,
+            pool_max_idle=pool_max_idle,
+            base_url=base_url,
+            wpgs=bool(getattr(settings, "ASR_WPGS", True)),
         )
-        self._tts = XfyunTtsClient(
+        self._tts = AsyncXfyunTtsClient(
             app_id=app_id,
             api_key=api_key,
             api_secret=api_secret,
             sslopt=sslopt,
+            pool_size=pool_size,
+            pool_max_idle=pool_max_idle,
+            base_url=base_url,
+            vcn=getattr(settings, "TTS_VCN", "xiaoyan") or "xiaoyan",
+            speed=int(getattr(settings, "TTS_SPEED", 50)),
+            volume=int(getattr(settings, "TTS_VOLUME", 50)),
         )
 
+        self._pipeline_enabled = bool(getattr(settings, "TTS_PIPELINE_ENABLED", True))
+        self._pipeline_concurrency = max(1, int(getattr(settings, "TTS_PIPELINE_CONCURRENCY", 3)))
+        self._pipeline_max_chars = max(10, int(getattr(settings, "TTS_PIPELINE_MAX_SEGMENT_CHARS", 60)))
+
+        self._tts_cache: Optional[TtsCache] = None
+        if bool(getattr(settings, "TTS_CACHE_ENABLED", True)):
+            disk_dir = getattr(settings, "TTS_CACHE_DIR", None) or os.path.join(
+                getattr(settings, "FILE_BASE_PATH", "./data"), "tts_cache"
+            )
+            self._tts_cache = TtsCache(
+                memory_max_bytes=int(getattr(settings, "TTS_CACHE_MEMORY_MAX_BYTES", 32 * 1024 * 1024)),
+                disk_dir=disk_dir,
+                disk_max_bytes=int(getattr(settings, "TTS_CACHE_DISK_MAX_BYTES", 256 * 1024 * 1024)),
+            )
+
+        self._vad = EnergyVad()
+
+    def start_ws_pools(self) -> None:
+        """在当前事件循环上开始预热 ASR / TTS 连接池，第一轮对话也不用现场握手。"""
+        self._asr.start_pool()
+        self._tts.start_pool()
+
+    def trim_silence(self, audio: BytesLike, *, is_wav: bool = True) -> TrimResult:
+        """
+        VAD 裁掉前后静音；is_wav=True 时先从 WAV 中取出 PCM（格式不符抛 AudioFormatError）。
+        """
+        pcm = _extract_pcm_from_wav(audio) if is_wav else audio
+        return self._vad.trim(pcm)
+
     async def asr(self, wav_bytes: bytes) -> str:
         """
         语音识别。
         """
-        return await asyncio.to_thread(self._asr.recognize, wav_bytes)
+        return await self._asr.recognize(wav_bytes)
+
+    async def asr_pcm(self, pcm: BytesLike) -> str:
+        """
+        识别 16k 单声道 16bit PCM（VAD 裁剪后的音频直接送识别，不再包 WAV）。
+        """
+        return await self._asr.recognize_pcm(pcm)
 
-    async def tts(self, text: str) -> bytes:
+    def asr_stream(self, stream: PcmStream) -> AsyncIterator[AsrHypothesis]:
+        """
+        边录边识别：音频帧一到就发给讯飞。
+
+        识别文本每变化一次产出一个中间假设（final=False，开启动态修正时可能改写前文），
+        流结束后产出最终文本（final=True）。下游可以在孩子说完之前就开始准备 prompt 等工作。
+        """
+        return self._asr.stream(stream.aframes())
+
+    async def tts(
+        self,
+        text: str,
+        on_chunk: Optional[Callable[[bytes], None]] = None,
+    ) -> PcmBuffer:
         """
         文本转语音。
+
+        on_chunk 不为空时，每合成出一帧 PCM 就在当前事件循环中回调一次，
+        可以边合成边下发；返回值仍是完整音频（PcmBuffer，wav() 原地补 WAV 头）。
+
+        开启分句流水线时，多句回复按句切开并发合成（并发数有上限），按顺序下发：
+        第一句合成出来就开始回调，首帧耗时和回复总长度无关。
         """
-        return await asyncio.to_thread(self._tts.synthesize, text)
+        segments = self.tts_segments(text)
+        if len(segments) <= 1:
+            return await self._tts_one(text, on_chunk)
+        return await self._tts_pipelined(_aiter(segments), on_chunk)
+
+    def tts_segments(self, text: str) -> List[str]:
+        """tts() 内部的分句结果（关闭分句流水线时整段一句）；缓存按句生效，固定话术要按同样的规则切。"""
+        if not self._pipeline_enabled:
+            return [text]
+        return split_sentences(text, max_chars=self._pipeline_max_chars) or [text]
+
+    async def tts_stream(
+        self,
+        sentences: AsyncIterable[str],
+        on_chunk: Optional[Callable[[bytes], None]] = None,
+    ) -> PcmBuffer:
+        """
+        边生成边合成：sentences 每产出一句就开始合成（和分句流水线共用并发上限），按顺序回调 on_chunk。
+        大模型流式输出时，第一句生成完就能开始合成、下发，不用等整段回复。
+        """
+        return await self._tts_pipelined(sentences, on_chunk)
+
+    def split_stream(self, deltas: AsyncIterable[str]) -> AsyncIterator[str]:
+        """把流式文本片段按 TTS 分句规则切成完整句子（供调用方逐句检查后再交给 tts_stream）。"""
+        return iter_sentences(deltas, max_chars=self._pipeline_max_chars)
+
+    async def _tts_pipelined(
+        self,
+        segments: AsyncIterable[str],
+        on_chunk: Optional[Callable[[bytes], None]],
+    ) -> PcmBuffer:
+        """
+        分句并发合成：最多 pipeline_concurrency 句同时请求讯飞。
+        每句的音频帧先进各自的队列，按句子顺序取出回调，当前句边合成边下发，后面的句子合成完先排队。
+        句子来源（segments）的异常会在所有已合成的句子下发后抛给调用方。
+        """
+        started = time.monotonic()
+        first_ms: Optional[float] = None
+        sem = asyncio.Semaphore(self._pipeline_concurrency)
+        tasks: List[asyncio.Task] = []
+        # 按句子顺序排队的 (该句音频帧队列, 合成任务)，None 表示没有更多句子
+        order: "asyncio.Queue[Optional[Tuple[asyncio.Queue[Optional[bytes]], asyncio.Task]]]" = asyncio.Queue()
+
+        async def _run(segment: str, queue: "asyncio.Queue[Optional[bytes]]") -> PcmBuffer:
+            try:
+                async with sem:
+                    return await self._tts_one(segment, queue.put_nowait if on_chunk is not None else None)
+            finally:
+                # 结束标记：不管成功失败，消费方都能从这句的队列里出来
+                queue.put_nowait(None)
+
+        async def _produce() -> None:
+            try:
+                async for segment in segments:
+                    queue: "asyncio.Queue[Optional[bytes]]" = asyncio.Queue()
+                    task = asyncio.create_task(_run(segment, queue))
+                    tasks.append(task)
+                    order.put_nowait((queue, task))
+            finally:
+                order.put_nowait(None)
+
+        producer = asyncio.create_task(_produce())
+        out = PcmBuffer()
+        try:
+            while True:
+                item = await order.get()
+                if item is None:
+                    break
+                queue, task = item
+                while True:
+                    chunk = await queue.get()
+                    if chunk is None:
+                        break
+                    if first_ms is None:
+                        first_ms = (time.monotonic() - started) * 1000
+                    assert on_chunk is not None
+                    on_chunk(chunk)
+
+                segment_buf = await task
+                if first_ms is None:
+                    first_ms = (time.monotonic() - started) * 1000
+                # 句间不插入静音，只在整段末尾补一次
+                with segment_buf.pcm() as view:
+                    out.append(view[:len(segment_buf) - TAIL_SILENCE_BYTES])
+            await producer
+        finally:
+            producer.cancel()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(producer, *tasks, return_exceptions=True)
+
+        out.append_silence(TAIL_SILENCE_BYTES)
+        ylogger.info(
+            "TTS 分句合成完成: segments=%s, concurrency=%s, first_ms=%.0f, total_ms=%.0f, bytes=%s",
+            len(tasks),
+            self._pipeline_concurrency,
+            first_ms or 0.0,
+            (time.monotonic() - started) * 1000,
+            len(out),
+        )
+        return out
+
+    async def _tts_one(
+        self,
+        text: str,
+        on_chunk: Optional[Callable[[bytes], None]] = None,
+    ) -> PcmBuffer:
+        """
+        单次合成（一句或整段）。命中缓存时不请求讯飞，on_chunk 按固定大小分片一次性回调完。
+        """
+        cache = self._tts_cache
+        if cache is None:
+            return await self._tts.synthesize(text, on_chunk=on_chunk)
+
+        key = TtsCache.make_key(text, vcn=self._tts.vcn, speed=self._tts.speed, volume=self._tts.volume)
+        started = time.perf_counter()
+        pcm = cache.get(key)
+        tier = "memory"
+        if pcm is None:
+            pcm = await asyncio.to_thread(cache.load, key)
+            tier = "disk"
+
+        if pcm is not None:
+            if on_chunk is not None:
+                for offset in range(0, len(pcm), _CACHED_CHUNK_BYTES):
+                    on_chunk(pcm[offset:offset + _CACHED_CHUNK_BYTES])
+            buf = PcmBuffer()
+            buf.append(pcm)
+            buf.append_silence(TAIL_SILENCE_BYTES)
+            ylogger.info(
+                "TTS 缓存命中: tier=%s, bytes=%s, lookup_us=%.0f, hit_rate=%.2f",
+                tier,
+                len(pcm),
+                (time.perf_counter() - started) * 1e6,
+                cache.stats()["tts_cache_hit_rate"],
+            )
+            return buf
+
+        return await self._synthesize_and_cache(cache, key, text, on_chunk)
+
+    async def _synthesize_and_cache(
+        self,
+        cache: TtsCache,
+        key: str,
+        text: str,
+        on_chunk: Optional[Callable[[bytes], None]] = None,
+    ) -> PcmBuffer:
+        # 合成没有正常结束（超时 / 连接提前关闭）时 synthesize 抛 SpeechError，半截音频不会进缓存
+        buf = await self._tts.synthesize(text, on_chunk=on_chunk)
+        # 缓存不含末尾静音的纯语音部分；空结果不缓存
+        with buf.pcm() as view:
+            speech = bytes(view[:len(buf) - TAIL_SILENCE_BYTES])
+        if speech:
+            await asyncio.to_thread(cache.put, key, speech)
+        else:
+            ylogger.warning("TTS 合成结果为空，不写缓存: text=%s", text)
+        return buf
+
+    async def prewarm_tts(self, texts: Iterable[str]) -> int:
+        """
+        把固定话术预合成进 TTS 缓存（已缓存的跳过），返回本次新合成的条数（按句计）。
+        单条失败只记日志，不影响启动。
+        """
+        cache = self._tts_cache
+        if cache is None:
+            return 0
+
+        # 和在线合成一样先分句，缓存 key 才能对上
+        segments: List[str] = []
+        for text in texts:
+            if text and text.strip():
+                segments.extend(self.tts_segments(text.strip()))
+
+        synthesized = 0
+        for text in dict.fromkeys(segments):
+            key = TtsCache.make_key(text, vcn=self._tts.vcn, speed=self._tts.speed, volume=self._tts.volume)
+            if cache.contains(key):
+                continue
+            try:
+                await self._synthesize_and_cache(cache, key, text)
+            except Exception as e:  # noqa: BLE001
+                ylogger.warning("TTS 缓存预热失败: text=%s, error=%s", text, e)
+                continue
+            synthesized += 1
+        return synthesized
+
+    def tts_cache_stats(self) -> Dict[str, float]:
+        return self._tts_cache.stats() if self._tts_cache is not None else {}
+
+
+async def _aiter(items: Iterable[str]) -> AsyncIterator[str]:
+    for item in items:
+        yield item
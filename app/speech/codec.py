@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+# @File: codec.py
+# @Author: yaccii
+# @Time: 2025-11-17 17:51
+# @Description:
+"""
+玩具 ⇄ 网关线路上的音频压缩编码（16bit 单声道 PCM ⇄ 压缩字节）：
+
+- pcm:   不压缩
+- ulaw:  G.711 µ-law，2:1
+- adpcm: IMA-ADPCM，4:1；每块自带 4 字节状态头（predictor int16 + step index uint8 + 1 字节填充），
+         块之间互不依赖，丢一块不影响后续解码
+
+编解码整块交给 audioop（C 实现，一次处理整个缓冲区），不做逐样本的 Python 循环。
+Python 3.13 起 audioop 移出标准库，由 audioop-lts 提供同名模块。
+"""
+from __future__ import annotations
+
+import audioop
+import struct
+from typing import Dict, Optional, Tuple
+
+from app.speech.asr_xfyun import AudioFormatError
+
+CODEC_PCM = 0
+CODEC_ULAW = 1
+CODEC_ADPCM = 2
+
+CODEC_NAMES: Dict[int, str] = {
+    CODEC_PCM: "pcm",
+    CODEC_ULAW: "ulaw",
+    CODEC_ADPCM: "adpcm",
+}
+CODEC_IDS: Dict[str, int] = {v: k for k, v in CODEC_NAMES.items()}
+
+_ADPCM_BLOCK_HEADER = struct.Struct("<hBx")
+
+
+def codec_name(codec: int) -> str:
+    return CODEC_NAMES.get(codec, f"unknown({codec})")
+
+
+def encode_pcm(pcm: bytes, codec: int) -> bytes:
+    """把一段 PCM 编成自包含的一块。"""
+    if codec == CODEC_PCM:
+        return pcm
+    if codec == CODEC_ULAW:
+        return audioop.lin2ulaw(pcm, 2)
+    if codec == CODEC_ADPCM:
+        return AdpcmEncoder().encode(pcm, final=True)
+    raise AudioFormatError(f"不支持的音频编码: {codec}")
+
+
+def decode_to_pcm(data: bytes, codec: int) -> bytes:
+    """把一块压缩数据还原成 PCM。"""
+    if codec == CODEC_PCM:
+        return data
+    if codec == CODEC_ULAW:
+        return audioop.ulaw2lin(data, 2)
+    if codec == CODEC_ADPCM:
+        if len(data) < _ADPCM_BLOCK_HEADER.size:
+            raise AudioFormatError(f"ADPCM 数据块过短: bytes={len(data)}")
+        predictor, index = _ADPCM_BLOCK_HEADER.unpack_from(data)
+        if index > 88:
+            raise AudioFormatError(f"ADPCM step index 非法: {index}")
+        pcm, _ = audioop.adpcm2lin(data[_ADPCM_BLOCK_HEADER.size:], 2, (predictor, index))
+        return pcm
+    raise AudioFormatError(f"不支持的音频编码: {codec}")
+
+
+class AdpcmEncoder:
+    """
+    流式 IMA-ADPCM 编码器：跨块延续编码状态，每块写入编码前的状态头，
+    解码端可以逐块独立解码。ADPCM 一个字节两个样本，奇数个样本时最后一个留到下一块。
+    """
+
+    def __init__(self) -> None:
+        self._state: Optional[Tuple[int, int]] = None
+        self._carry = b""
+
+    def encode(self, pcm: bytes, *, final: bool = False) -> bytes:
+        data = self._carry + pcm if self._carry else pcm
+        usable = len(data) - (len(data) % 4)
+        if final and usable < len(data):
+            # 结尾补一个静音样本凑满一个字节
+            data = b"".join((data, b"\x00" * (4 - len(data) % 4)))
+            usable = len(data)
+
+        # 上游可能传 memoryview（不复制的切片），余下的几个字节转成 bytes 保存
+        self._carry = bytes(data[usable:])
+        if usable == 0:
+            return b""
+
+        predictor, index = self._state or (0, 0)
+        header = _ADPCM_BLOCK_HEADER.pack(predictor, index)
+        encoded, self._state = audioop.lin2adpcm(data[:usable], 2, self._state)
+        return header + encoded
+
+
+class ChunkEncoder:
+    """按编码方式逐块编码（回复流式下发使用）。"""
+
+    def __init__(self, codec: int) -> None:
+        if codec not in CODEC_NAMES:
+            raise AudioFormatError(f"不支持的音频编码: {codec}")
+        self.codec = codec
+        self._adpcm = AdpcmEncoder() if codec == CODEC_ADPCM else None
+        self._carry = b""
+
+    def encode(self, pcm: bytes, *, final: bool = False) -> bytes:
+        if self._adpcm is not None:
+            return self._adpcm.encode(pcm, final=final)
+        if self.codec == CODEC_PCM:
+            return pcm
+
+        # 上游分片不保证按样本对齐，半个样本留到下一块
+        data = self._carry + pcm if self._carry else pcm
+        if final and len(data) % 2:
+            data = b"".join((data, b"\x00"))
+        usable = len(data) - (len(data) % 2)
+        self._carry = bytes(data[usable:])
+        return encode_pcm(data[:usable], self.codec) if usable else b""
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# @File: pcm_stream.py
+# @Author: yaccii
+# @Time: 2025-11-17 17:51
+# @Description:
+from __future__ import annotations
+
+import asyncio
+import queue
+import threading
+import time
+from typing import AsyncIterator, Iterator, Optional
+
+from app.infra.ylogger import ylogger
+from app.speech.audio_buffer import PcmBuffer
+
+
+class PcmStream:
+    """
+    边录边传的 PCM 音频流（16k 单声道 16bit）：
+    - 生产方（MQTT 网络线程）push 音频帧，说完后 close
+    - 消费方通过 frames()（线程中阻塞迭代）或 aframes()（事件循环上异步迭代）收到一帧发一帧
+    - 同时保留完整音频（PcmBuffer），识别结束后 pcm() / wav() 直接拿来 VAD、存档，不复制
+
+    超过 idle_timeout 没有新帧，或累计超过 max_bytes，都视为结束，
+    避免终端掉线后 ASR 一直挂着。
+    """
+
+    def __init__(
+        self,
+        *,
+        sample_rate: int = 16000,
+        idle_timeout: float = 5.0,
+        max_bytes: int = 16000 * 2 * 60,
+    ) -> None:
+        self.sample_rate = sample_rate
+        self._idle_timeout = idle_timeout
+        self._max_bytes = max_bytes
+
+        self._queue: "queue.Queue[Optional[bytes]]" = queue.Queue()
+        self._buf = PcmBuffer(sample_rate=sample_rate)
+        self._lock = threading.Lock()
+        self._closed = False
+        # aframes() 等待新帧时挂起的 future（只有一个消费方）
+        self._waiter: Optional[asyncio.Future] = None
+        self.created_at = time.monotonic()
+        self.closed_at: Optional[float] = None
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    @property
+    def nbytes(self) -> int:
+        with self._lock:
+            return len(self._buf)
+
+    def push(self, pcm: bytes) -> bool:
+        """追加一帧；流已结束或超出上限时返回 False。"""
+        if not pcm:
+            return not self._closed
+
+        with self._lock:
+            if self._closed:
+                return False
+            if len(self._buf) + len(pcm) > self._max_bytes:
+                ylogger.warning("PCM stream over limit, close: max_bytes=%s", self._max_bytes)
+                self._close_locked()
+                return False
+            self._buf.append(pcm)
+            self._queue.put(pcm)
+            self._wake_locked()
+        return True
+
+    def close(self) -> None:
+        with self._lock:
+            self._close_locked()
+
+    def _close_locked(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self.closed_at = time.monotonic()
+        self._queue.put(None)
+        self._wake_locked()
+
+    def _wake_locked(self) -> None:
+        waiter, self._waiter = self._waiter, None
+        if waiter is not None:
+            # 生产方可能在其他线程（MQTT 网络线程），统一切回消费方的事件循环
+            waiter.get_loop().call_soon_threadsafe(_set_done, waiter)
+
+    def frames(self) -> Iterator[bytes]:
+        """阻塞迭代音频帧，直到流结束或空闲超时。"""
+        while True:
+            try:
+                pcm = self._queue.get(timeout=self._idle_timeout)
+            except queue.Empty:
+                ylogger.warning("PCM stream idle for %.1fs, treat as ended", self._idle_timeout)
+                self.close()
+                return
+            if pcm is None:
+                return
+            yield pcm
+
+    async def aframes(self) -> AsyncIterator[bytes]:
+        """在事件循环上异步迭代音频帧，直到流结束或空闲超时，不占用线程。"""
+        loop = asyncio.get_running_loop()
+        while True:
+            waiter: Optional[asyncio.Future] = None
+            with self._lock:
+                try:
+                    pcm = self._queue.get_nowait()
+                except queue.Empty:
+                    waiter = self._waiter = loop.create_future()
+
+            if waiter is not None:
+                try:
+                    await asyncio.wait_for(waiter, self._idle_timeout)
+                except asyncio.TimeoutError:
+                    ylogger.warning("PCM stream idle for %.1fs, treat as ended", self._idle_timeout)
+                    self.close()
+                    return
+                continue
+
+            if pcm is None:
+                return
+            yield pcm
+
+    def getvalue(self) -> bytes:
+        """目前收到的完整 PCM（复制一份，流未结束时也可以调用）。"""
+        with self._lock, self._buf.pcm() as view:
+            return bytes(view)
+
+    def pcm(self) -> memoryview:
+        """完整 PCM 的 memoryview（不复制），只能在流结束后调用。"""
+        self._require_closed()
+        return self._buf.pcm()
+
+    def wav(self) -> bytearray:
+        """完整音频的 WAV（原地写头，不复制），只能在流结束后调用。"""
+        self._require_closed()
+        return self._buf.wav()
+
+    def _require_closed(self) -> None:
+        if not self._closed:
+            # 导出 memoryview 后缓冲区不能再扩容，生产方 push 会报 BufferError
+            raise RuntimeError("PCM stream is still open")
+
+
+def _set_done(fut: asyncio.Future) -> None:
+    if not fut.done():
+        fut.set_result(None)
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# @File: sentences.py
+# @Author: yaccii
+# @Time: 2025-11-17 17:51
+# @Description:
+"""
+按中文句末标点切分回复文本，供 TTS 分句流水线合成使用。
+
+- 在 。！？；… 和换行（以及对应的半角标点）之后切开，紧跟的后引号 / 右括号留在前一句
+- 太短的句子（"好呀！"）并到下一句，避免一句一个 TTS 请求
+- 太长的句子在最后一个逗号处再切，保证首句合成耗时和回复总长度无关
+- SentenceSplitter 支持增量输入（大模型流式输出），一句完整了就切出来
+"""
+from __future__ import annotations
+
+from typing import AsyncIterable, AsyncIterator, List, Optional
+
+_SENTENCE_END = frozenset("。！？!?；;…\n")
+_CLOSING = frozenset("”’\"'」』）)】》")
+_CLAUSE_BREAK = "，,、：:"
+
+
+class SentenceSplitter:
+    """
+    增量分句：feed() 喂入新文本，返回已经完整的句子；输入结束后 flush() 取出剩余部分。
+
+    句末标点后面要再看到一个字符才切（后引号可能还没到）。
+    """
+
+    def __init__(self, *, min_chars: int = 6, max_chars: int = 60) -> None:
+        self._min_chars = min_chars
+        self._max_chars = max_chars
+        self._buf = ""
+
+    def feed(self, text: str) -> List[str]:
+        self._buf += text
+        out: List[str] = []
+        while True:
+            cut = self._find_cut()
+            if cut is None:
+                break
+            out.append(self._buf[:cut])
+            self._buf = self._buf[cut:]
+        return [s.strip() for s in out if s.strip()]
+
+    def flush(self) -> List[str]:
+        rest, self._buf = self._buf, ""
+        return [s.strip() for s in _cut_long(rest, self._max_chars) if s.strip()]
+
+    def _find_cut(self) -> Optional[int]:
+        buf = self._buf
+        n = len(buf)
+        i = 0
+        while i < n:
+            if buf[i] in _SENTENCE_END:
+                while i + 1 < n and (buf[i + 1] in _SENTENCE_END or buf[i + 1] in _CLOSING):
+                    i += 1
+                if i + 1 > self._max_chars:
+                    # 最近的句末已经超过 max_chars，在 max_chars 以内找逗号切
+                    break
+                if i + 1 >= n:
+                    # 标点在末尾，后面可能还有后引号，等下一段
+                    break
+                if len(buf[:i + 1].strip()) >= self._min_chars:
+                    return i + 1
+                # 太短，和下一句合并
+            i += 1
+
+        if n > self._max_chars:
+            return _long_cut(buf, self._max_chars)
+        return None
+
+
+def split_sentences(text: str, *, min_chars: int = 6, max_chars: int = 60) -> List[str]:
+    """切分完整的回复文本；各段按顺序拼起来就是原文（只去掉了段首尾的空白）。"""
+    splitter = SentenceSplitter(min_chars=min_chars, max_chars=max_chars)
+    segments = splitter.feed(text)
+    rest = splitter.flush()
+    # 最后一句太短就并到前一句
+    if segments and len(rest) == 1 and len(rest[0]) < min_chars:
+        segments[-1] += rest[0]
+    else:
+        segments.extend(rest)
+    return segments
+
+
+async def iter_sentences(
+    deltas: AsyncIterable[str],
+    *,
+    min_chars: int = 6,
+    max_chars: int = 60,
+) -> AsyncIterator[str]:
+    """把流式文本片段转换成完整句子的异步迭代器。"""
+    splitter = SentenceSplitter(min_chars=min_chars, max_chars=max_chars)
+    async for delta in deltas:
+        for sentence in splitter.feed(delta):
+            yield sentence
+    for sentence in splitter.flush():
+        yield sentence
+
+
+def _long_cut(piece: str, max_chars: int) -> int:
+    # 前面被合并的短句的句末标点也可以切
+    cut = max(piece.rfind(c, 0, max_chars) for c in _CLAUSE_BREAK + "".join(_SENTENCE_END))
+    # 前面没有逗号就硬切
+    return cut + 1 if cut > 0 else max_chars
+
+
+def _cut_long(piece: str, max_chars: int) -> List[str]:
+    out: List[str] = []
+    while len(piece) > max_chars:
+        cut = _long_cut(piece, max_chars)
+        out.append(piece[:cut])
+        piece = piece[cut:]
+    out.append(piece)
+    return out
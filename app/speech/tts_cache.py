@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+# @File: tts_cache.py
+# @Author: yaccii
+# @Time: 2025-11-17 17:51
+# @Description:
+"""
+TTS 合成结果缓存：兜底回复、"没听清"、忙碌提示、问候语这类固定文案不再每次请求讯飞。
+
+- key 按内容寻址：(文本, 发音人, 语速, 音量, 采样率) 的哈希，任一参数变化都是新条目
+- 内存层：LRU，按 PCM 字节总量淘汰，命中只是一次字典查找
+- 磁盘层：{dir}/{key 前两位}/{key}.pcm，进程重启后仍然有效；按字节总量淘汰最久未访问的文件
+- 缓存的是不含末尾静音的纯语音 PCM（16bit 单声道）
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from app.infra.ylogger import ylogger
+
+_SUFFIX = ".pcm"
+
+
+class TtsCache:
+    """
+    两级 TTS 缓存（内存 LRU + 磁盘），内部加锁。
+
+    get() 只查内存，可以在事件循环上直接调用；load() / put() 会读写磁盘，
+    服务端应放到线程里执行。disk_dir 为空或 disk_max_bytes=0 时只用内存层。
+    """
+
+    def __init__(
+        self,
+        *,
+        memory_max_bytes: int = 32 * 1024 * 1024,
+        disk_dir: Optional[str] = None,
+        disk_max_bytes: int = 256 * 1024 * 1024,
+    ) -> None:
+        self._memory_max_bytes = memory_max_bytes
+        self._disk_dir = disk_dir if disk_dir and disk_max_bytes > 0 else None
+        self._disk_max_bytes = disk_max_bytes
+        self._lock = threading.Lock()
+
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        # key -> 文件字节数，按最近访问排序（最旧的在前）
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+
+        self._memory_hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+
+        if self._disk_dir is not None:
+            self._scan_disk()
+
+    @staticmethod
+    def make_key(text: str, *, vcn: str, speed: int, volume: int, sample_rate: int = 16000) -> str:
+        raw = f"{vcn}\x00{speed}\x00{volume}\x00{sample_rate}\x00{text}"
+        return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+    # ---------- 读 ----------
+
+    def contains(self, key: str) -> bool:
+        """是否已缓存（只看索引，不读磁盘、不计入命中率），预热时用。"""
+        with self._lock:
+            return key in self._memory or key in self._disk
+
+    def get(self, key: str) -> Optional[bytes]:
+        """只查内存层；未命中不计数（调用方接着 load 查磁盘）。"""
+        with self._lock:
+            pcm = self._memory.get(key)
+            if pcm is None:
+                return None
+            self._memory.move_to_end(key)
+            self._memory_hits += 1
+            return pcm
+
+    def load(self, key: str) -> Optional[bytes]:
+        """查磁盘层（阻塞 IO），命中后提升到内存层；未命中计为 miss。"""
+        if self._disk_dir is None:
+            with self._lock:
+                self._misses += 1
+            return None
+
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                pcm = f.read()
+            # 用 mtime 记录最近访问时间，重启后按它恢复淘汰顺序
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self._misses += 1
+                self._forget_disk_locked(key)
+            return None
+
+        with self._lock:
+            self._disk_hits += 1
+            if key in self._disk:
+                self._disk.move_to_end(key)
+            self._put_memory_locked(key, pcm)
+        return pcm
+
+    # ---------- 写 ----------
+
+    def put(self, key: str, pcm: bytes) -> None:
+        """写入内存层和磁盘层（磁盘写临时文件再改名，不会读到半个文件）。"""
+        with self._lock:
+            self._put_memory_locked(key, pcm)
+
+        if self._disk_dir is None or len(pcm) > self._disk_max_bytes:
+            return
+
+        path = self._path(key)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp, "wb") as f:
+                f.write(pcm)
+            os.replace(tmp, path)
+        except OSError as e:
+            ylogger.warning("TTS cache write failed: path=%s, error=%s", path, e)
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            self._forget_disk_locked(key)
+            self._disk[key] = len(pcm)
+            self._disk_bytes += len(pcm)
+            evicted = []
+            while self._disk_bytes > self._disk_max_bytes and len(self._disk) > 1:
+                old_key, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+                evicted.append(old_key)
+
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+
+    # ---------- 统计 ----------
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self._memory_hits + self._disk_hits + self._misses
+            return {
+                "tts_cache_memory_hits": self._memory_hits,
+                "tts_cache_disk_hits": self._disk_hits,
+                "tts_cache_misses": self._misses,
+                "tts_cache_hit_rate": (self._memory_hits + self._disk_hits) / lookups if lookups else 0.0,
+                "tts_cache_memory_entries": len(self._memory),
+                "tts_cache_memory_bytes": self._memory_bytes,
+                "tts_cache_disk_entries": len(self._disk),
+                "tts_cache_disk_bytes": self._disk_bytes,
+            }
+
+    # ---------- 内部 ----------
+
+    def _path(self, key: str) -> str:
+        assert self._disk_dir is not None
+        return os.path.join(self._disk_dir, key[:2], key + _SUFFIX)
+
+    def _put_memory_locked(self, key: str, pcm: bytes) -> None:
+        if len(pcm) > self._memory_max_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        self._memory[key] = pcm
+        self._memory_bytes += len(pcm)
+        while self._memory_bytes > self._memory_max_bytes and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _forget_disk_locked(self, key: str) -> None:
+        size = self._disk.pop(key, None)
+        if size is not None:
+            self._disk_bytes -= size
+
+    def _scan_disk(self) -> None:
+        """启动时按 mtime 重建磁盘层索引，顺带清理上次没写完的临时文件。"""
+        assert self._disk_dir is not None
+        entries = []
+        for root, _, files in os.walk(self._disk_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if name.endswith(".tmp"):
+                        os.remove(path)
+                        continue
+                    if not name.endswith(_SUFFIX):
+                        continue
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, name[: -len(_SUFFIX)], st.st_size))
+
+        entries.sort()
+        for _, key, size in entries:
+            self._disk[key] = size
+            self._disk_bytes += size
+        ylogger.info(
+            "TTS cache loaded: dir=%s, entries=%s, bytes=%s",
+            self._disk_dir,
+            len(self._disk),
+            self._disk_bytes,
+        )
@@ -5,38 +5,58 @@
 # @Description:
 from __future__ import annotations
 
+import asyncio
 import base64
 import hashlib
 import hmac
 import json
 import ssl
-import threading
-from dataclasses import dataclass
+import time
+from dataclasses import dataclass, field
 from datetime import datetime
 from time import mktime
-from typing import Any, Dict, Optional
-from urllib.parse import urlencode
+from typing import Any, Callable, Dict, Optional
+from urllib.parse import urlencode, urlsplit
 
 import websocket
+from websockets.asyncio.client import ClientConnection
+from websockets.exceptions import ConnectionClosed
 from wsgiref.handlers import format_date_time
 
 from app.infra.ylogger import ylogger
-from app.speech.asr_xfyun import SpeechError
+from app.speech.asr_xfyun import DEFAULT_BASE_URL, SpeechError
+from app.speech.audio_buffer import PcmBuffer
+from app.speech.ws_pool import AsyncXfyunWsPool, XfyunWsPool
+
+
+# 合成结果末尾附加的静音：16k * 2 字节 ≈ 32000 字节 ≈ 1 秒
+TAIL_SILENCE_BYTES = 32000
 
 
 @dataclass
 class _TtsResult:
-    pcm_bytes: bytes = b""
+    # 帧直接追加到预留了 WAV 头的缓冲区，整段合成只有摊还线性的复制
+    pcm: PcmBuffer = field(default_factory=PcmBuffer)
     error: Optional[str] = None
+    # 收到 status == 2 的最后一帧才算合成完成；超时 / 连接提前关闭时为 False
+    completed: bool = False
+    # 连接在合成结束前被关闭（池里的连接可能已被服务端空闲断开）
+    closed_early: bool = False
+
 
+def _should_retry(result: _TtsResult) -> bool:
+    """连接在收到任何音频前就被关闭：还没有回调过 on_chunk，可以换一条新连接重试。"""
+    return result.closed_early and len(result.pcm) == 0
 
-def _build_ws_url(app_id: str, api_key: str, api_secret: str) -> str:
+
+def _build_ws_url(app_id: str, api_key: str, api_secret: str, base_url: str = DEFAULT_BASE_URL) -> str:
     """
-    构造讯飞 TTS WebSocket URL。
+    构造讯飞 TTS WebSocket URL。base_url 可指向本地模拟服务（如 ws://127.0.0.1:8790）。
     """
-    host = "ws-api.xfyun.cn"
+    parts = urlsplit(base_url)
+    host = parts.netloc
     path = "/v2/tts"
-    url = f"wss://{host}{path}"
+    url = f"{parts.scheme}://{host}{path}"
 
     now = datetime.now()
     date = format_date_time(mktime(now.timetuple()))
@@ -66,6 +86,67 @@ def _build_ws_url(app_id: str, api_key: str, api_secret: str) -> str:
     return f"{url}?{urlencode(params)}"
 
 
+def _build_request(app_id: str, text: str, vcn: str, speed: int, volume: int) -> Dict[str, Any]:
+    return {
+        "common": {"app_id": app_id},
+        "business": {
+            "aue": "raw",
+            "auf": "audio/L16;rate=16000",
+            "vcn": vcn,
+            "tte": "utf8",
+            "speed": speed,
+            "volume": volume,
+        },
+        "data": {
+            "status": 2,
+            "text": base64.b64encode(text.encode("utf-8")).decode("utf-8"),
+        },
+    }
+
+
+def _handle_message(
+    message: str,
+    result: _TtsResult,
+    on_chunk: Optional[Callable[[bytes], None]],
+) -> bool:
+    """处理一条服务端消息，返回本次合成是否结束。"""
+    data = json.loads(message)
+    code = data.get("code", -1)
+    if code != 0:
+        err_msg = data.get("message", "unknown error")
+        sid = data.get("sid", "")
+        msg = f"TTS 失败: sid={sid}, code={code}, message={err_msg}"
+        ylogger.error(msg)
+        result.error = msg
+        return True
+
+    audio_data = data.get("data", {}).get("audio")
+    status = data.get("data", {}).get("status")
+    if audio_data:
+        chunk = base64.b64decode(audio_data)
+        result.pcm.append(chunk)
+        if on_chunk is not None:
+            on_chunk(chunk)
+
+    if status == 2:
+        result.completed = True
+        return True
+    return False
+
+
+def _finish(result: _TtsResult) -> PcmBuffer:
+    if result.error:
+        raise SpeechError(result.error)
+    if not result.completed:
+        # 半截音频不能当成功返回（调用方会写进 TTS 缓存）
+        raise SpeechError(f"TTS 未收到结束帧: received_bytes={len(result.pcm)}")
+
+    # 末尾加一点静音，避免声音收得太硬
+    result.pcm.append_silence(TAIL_SILENCE_BYTES)
+
+    return result.pcm
+
+
 class XfyunTtsClient:
     """
     讯飞 TTS 客户端，只负责合成。
@@ -77,115 +158,204 @@ class XfyunTtsClient:
         api_key: str,
         api_secret: str,
         sslopt: Optional[Dict[str, Any]] = None,
+        pool_size: int = 0,
+        pool_max_idle: float = 8.0,
+        base_url: str = DEFAULT_BASE_URL,
+        vcn: str = "xiaoyan",
+        speed: int = 50,
+        volume: int = 50,
     ) -> None:
         self._app_id = app_id
         self._api_key = api_key
         self._api_secret = api_secret
+        self._base_url = base_url
+        self.vcn = vcn
+        self.speed = speed
+        self.volume = volume
         self._sslopt = sslopt or {"cert_reqs": ssl.CERT_NONE}
+        # pool_size > 0 时由后台线程提前建好连接，握手不在调用路径上
+        self._pool = XfyunWsPool(
+            "tts",
+            lambda: _build_ws_url(self._app_id, self._api_key, self._api_secret, self._base_url),
+            self._sslopt,
+            size=pool_size,
+            max_idle=pool_max_idle,
+        )
 
-    def synthesize(self, text: str, timeout: int = 30) -> bytes:
+    def synthesize(
+        self,
+        text: str,
+        timeout: int = 30,
+        on_chunk: Optional[Callable[[bytes], None]] = None,
+    ) -> PcmBuffer:
         """
         同步合成：
         - 输入：文本
-        - 输出：PCM 字节（16k,16bit,mono），末尾附加一点静音
+        - 输出：PcmBuffer（16k,16bit,mono），末尾附加一点静音；pcm() 取 PCM，wav() 取 WAV，都不复制
+        - on_chunk：每收到一帧音频就回调一次（在调用线程中调用，不含末尾静音）
         """
-        ws_url = _build_ws_url(self._app_id, self._api_key, self._api_secret)
+        deadline = time.monotonic() + timeout
 
-        result = _TtsResult()
-        done_event = threading.Event()
+        try:
+            ws = self._pool.acquire()
+        except Exception as e:  # noqa: BLE001
+            raise SpeechError(f"TTS 连接失败: {e}") from e
+        result = self._synthesize_on(ws, text, deadline, on_chunk)
 
-        def on_message(ws: websocket.WebSocketApp, message: str) -> None:
+        if _should_retry(result):
+            ylogger.warning("TTS 连接在收到音频前被关闭，换新连接重试一次: error=%s", result.error)
             try:
-                data = json.loads(message)
-                code = data.get("code", -1)
-                if code != 0:
-                    err_msg = data.get("message", "unknown error")
-                    sid = data.get("sid", "")
-                    msg = f"TTS 失败: sid={sid}, code={code}, message={err_msg}"
-                    ylogger.error(msg)
-                    result.error = msg
-                    done_event.set()
-                    ws.close()
-                    return
-
-                audio_data = data.get("data", {}).get("audio")
-                status = data.get("data", {}).get("status")
-                if audio_data:
-                    chunk = base64.b64decode(audio_data)
-                    result.pcm_bytes += chunk
-
-                if status == 2:
-                    done_event.set()
-                    ws.close()
-
+                ws = self._pool.connect()
             except Exception as e:  # noqa: BLE001
-                ylogger.exception("TTS on_message 异常: %s", e)
-                result.error = str(e)
-                done_event.set()
-                ws.close()
+                raise SpeechError(f"TTS 连接失败: {e}") from e
+            result = self._synthesize_on(ws, text, deadline, on_chunk)
 
-        def on_error(ws: websocket.WebSocketApp, error: Exception) -> None:
-            ylogger.error("TTS WebSocket 错误: %s", error)
-            result.error = str(error)
-            done_event.set()
+        return _finish(result)
 
-        def on_close(ws: websocket.WebSocketApp, code: int, msg: str) -> None:
-            ylogger.info("TTS WebSocket 关闭: code=%s, msg=%s", code, msg)
-
-        def on_open(ws: websocket.WebSocketApp) -> None:
-            def run() -> None:
+    def _synthesize_on(
+        self,
+        ws: websocket.WebSocket,
+        text: str,
+        deadline: float,
+        on_chunk: Optional[Callable[[bytes], None]],
+    ) -> _TtsResult:
+        result = _TtsResult()
+        try:
+            ws.send(json.dumps(_build_request(self._app_id, text, self.vcn, self.speed, self.volume)))
+
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    result.error = "TTS 超时"
+                    break
+                ws.settimeout(remaining)
                 try:
-                    req = {
-                        "common": {"app_id": self._app_id},
-                        "business": {
-                            "aue": "raw",
-                            "auf": "audio/L16;rate=16000",
-                            "vcn": "xiaoyan",
-                            "tte": "utf8",
-                            "speed": 50,
-                            "volume": 50,
-                        },
-                        "data": {
-                            "status": 2,
-                            "text": base64.b64encode(text.encode("utf-8")).decode("utf-8"),
-                        },
-                    }
-                    ws.send(json.dumps(req))
-                except Exception as e:  # noqa: BLE001
-                    ylogger.exception("TTS 发送线程异常: %s", e)
-                    result.error = str(e)
-                    done_event.set()
-                    ws.close()
-
-            threading.Thread(target=run, name="xfyun-tts-send", daemon=True).start()
-
-        ws = websocket.WebSocketApp(
-            ws_url,
-            on_message=on_message,
-            on_error=on_error,
-            on_close=on_close,
-        )
-        ws.on_open = on_open
+                    message = ws.recv()
+                except websocket.WebSocketTimeoutException:
+                    result.error = "TTS 超时"
+                    break
+                if not message:
+                    # 服务端提前关闭连接（池里的旧连接已被关闭也会走到这里）
+                    result.error = "TTS 连接在合成结束前被关闭"
+                    result.closed_early = True
+                    break
+                if _handle_message(message, result, on_chunk):
+                    break
+
+        except (websocket.WebSocketConnectionClosedException, ConnectionError) as e:
+            result.error = f"TTS 连接在合成结束前被关闭: {e}"
+            result.closed_early = True
+        except Exception as e:  # noqa: BLE001
+            ylogger.error("TTS WebSocket 错误: %s", e)
+            result.error = str(e)
+        finally:
+            ws.close(timeout=0)
+
+        return result
+
+
+class AsyncXfyunTtsClient:
+    """
+    讯飞 TTS 客户端的 asyncio 版本（服务端使用）：收发都在当前事件循环上，不占线程。
+    同步版 XfyunTtsClient 保留给脚本 / 离线工具使用。
+    """
 
-        ws_thread = threading.Thread(
-            target=ws.run_forever,
-            kwargs={"sslopt": self._sslopt},
-            name="xfyun-tts-ws",
-            daemon=True,
+    def __init__(
+        self,
+        app_id: str,
+        api_key: str,
+        api_secret: str,
+        sslopt: Optional[Dict[str, Any]] = None,
+        pool_size: int = 0,
+        pool_max_idle: float = 8.0,
+        base_url: str = DEFAULT_BASE_URL,
+        vcn: str = "xiaoyan",
+        speed: int = 50,
+        volume: int = 50,
+    ) -> None:
+        self._app_id = app_id
+        self._api_key = api_key
+        self._api_secret = api_secret
+        self._base_url = base_url
+        self.vcn = vcn
+        self.speed = speed
+        self.volume = volume
+        self._pool = AsyncXfyunWsPool(
+            "tts",
+            lambda: _build_ws_url(self._app_id, self._api_key, self._api_secret, self._base_url),
+            sslopt or {"cert_reqs": ssl.CERT_NONE},
+            size=pool_size,
+            max_idle=pool_max_idle,
         )
-        ws_thread.start()
 
-        done_event.wait(timeout=timeout)
-        ws.close()
-        ws_thread.join(timeout=2)
+    def start_pool(self) -> None:
+        """在当前事件循环上开始预热连接池（服务启动时调用）。"""
+        self._pool.start()
 
-        if result.error:
-            raise SpeechError(result.error)
+    async def synthesize(
+        self,
+        text: str,
+        timeout: int = 30,
+        on_chunk: Optional[Callable[[bytes], None]] = None,
+    ) -> PcmBuffer:
+        """
+        合成 PCM（16k,16bit,mono）到 PcmBuffer，末尾附加一点静音；
+        on_chunk 在事件循环上、每收到一帧音频回调一次（不含末尾静音）。
+        """
+        deadline = time.monotonic() + timeout
 
-        pcm = result.pcm_bytes
+        try:
+            ws = await self._pool.acquire()
+        except Exception as e:  # noqa: BLE001
+            raise SpeechError(f"TTS 连接失败: {e}") from e
+        result = await self._synthesize_on(ws, text, deadline, on_chunk)
 
-        # 末尾加一点静音，避免声音收得太硬
-        # 16k * 2 字节 ≈ 32000 字节 ≈ 1 秒
-        pcm += b"\x00" * 32000
+        if _should_retry(result):
+            ylogger.warning("TTS 连接在收到音频前被关闭，换新连接重试一次: error=%s", result.error)
+            try:
+                ws = await self._pool.connect()
+            except Exception as e:  # noqa: BLE001
+                raise SpeechError(f"TTS 连接失败: {e}") from e
+            result = await self._synthesize_on(ws, text, deadline, on_chunk)
 
-        return pcm
+        return _finish(result)
+
+    async def _synthesize_on(
+        self,
+        ws: ClientConnection,
+        text: str,
+        deadline: float,
+        on_chunk: Optional[Callable[[bytes], None]],
+    ) -> _TtsResult:
+        result = _TtsResult()
+        try:
+            await ws.send(json.dumps(_build_request(self._app_id, text, self.vcn, self.speed, self.volume)))
+
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    result.error = "TTS 超时"
+                    break
+                try:
+                    message = await asyncio.wait_for(ws.recv(), remaining)
+                except asyncio.TimeoutError:
+                    result.error = "TTS 超时"
+                    break
+                except ConnectionClosed:
+                    # 服务端提前关闭连接（池里的旧连接已被关闭也会走到这里）
+                    result.error = "TTS 连接在合成结束前被关闭"
+                    result.closed_early = True
+                    break
+                if _handle_message(message, result, on_chunk):
+                    break
+
+        except (ConnectionClosed, ConnectionError) as e:
+            result.error = f"TTS 连接在合成结束前被关闭: {e}"
+            result.closed_early = True
+        except Exception as e:  # noqa: BLE001
+            ylogger.error("TTS WebSocket 错误: %s", e)
+            result.error = str(e)
+        finally:
+            self._pool.discard(ws)
+
+        return result
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+# @File: vad.py
+# @Author: yaccii
+# @Time: 2025-11-17 17:51
+# @Description:
+"""
+服务端语音活动检测（VAD）：切掉按键前后的静音，整段没有人声时直接判定为无语音。
+
+按 20ms 一帧计算能量（RMS）和过零次数，两者都交给 audioop 整帧计算（C 实现），
+不做逐样本的 Python 循环：
+
+- 能量门限随录音自适应：取较安静帧的能量作为底噪，门限 = max(底噪 × 倍数, 最低能量)；
+  底噪有上限，整段从头说到尾（没有静音帧）时不会把人声当成底噪
+- 能量超过门限的帧算人声；能量略低但过零率高的帧（"s / x / sh" 这类清辅音）也算人声
+- 连续若干帧人声才算开口，避免按键声、碰撞声这种单帧噪声把静音段撑开
+- 人声段前后各保留一小段余量，避免切掉起音 / 尾音
+"""
+from __future__ import annotations
+
+import audioop
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from app.speech.audio_buffer import BytesLike
+
+_SAMPLE_WIDTH = 2
+
+
+@dataclass(frozen=True)
+class TrimResult:
+    """静音裁剪结果。"""
+
+    pcm: memoryview  # 裁剪后的 PCM（原始音频的切片，不复制）；没有人声时为空
+    has_speech: bool
+    original_bytes: int
+    sample_rate: int = 16000
+
+    @property
+    def trimmed_bytes(self) -> int:
+        return self.original_bytes - len(self.pcm)
+
+    @property
+    def trimmed_seconds(self) -> float:
+        return self.trimmed_bytes / (self.sample_rate * _SAMPLE_WIDTH)
+
+    @property
+    def speech_seconds(self) -> float:
+        return len(self.pcm) / (self.sample_rate * _SAMPLE_WIDTH)
+
+
+class EnergyVad:
+    """
+    基于能量 + 过零率的 VAD（16bit 单声道 PCM）。
+
+    参数都有适合玩具麦克风的默认值，一般不需要调整。
+    """
+
+    def __init__(
+        self,
+        sample_rate: int = 16000,
+        *,
+        frame_ms: int = 20,
+        min_rms: int = 300,
+        noise_factor: float = 3.0,
+        max_noise_rms: int = 600,
+        unvoiced_zcr: float = 0.25,
+        min_speech_ms: int = 100,
+        pad_ms: int = 200,
+    ) -> None:
+        self.sample_rate = sample_rate
+        self._frame_bytes = sample_rate * _SAMPLE_WIDTH * frame_ms // 1000
+        self._frame_samples = self._frame_bytes // _SAMPLE_WIDTH
+        self._min_rms = min_rms
+        self._noise_factor = noise_factor
+        self._max_noise_rms = max_noise_rms
+        # 过零率门限：每帧过零次数 / 采样数
+        self._unvoiced_crossings = int(unvoiced_zcr * self._frame_samples)
+        self._min_run = max(1, min_speech_ms // frame_ms)
+        self._pad_frames = pad_ms // frame_ms
+
+    def speech_range(self, pcm: BytesLike) -> Optional[Tuple[int, int]]:
+        """返回人声段的字节范围 [start, end)（含前后余量）；没有人声时返回 None。"""
+        nframes = len(pcm) // self._frame_bytes
+        if nframes == 0:
+            return None
+
+        view = memoryview(pcm)
+        fb = self._frame_bytes
+        rms: List[int] = []
+        crossings: List[int] = []
+        for i in range(nframes):
+            frame = view[i * fb:(i + 1) * fb]
+            rms.append(audioop.rms(frame, _SAMPLE_WIDTH))
+            crossings.append(audioop.cross(frame, _SAMPLE_WIDTH))
+
+        # 底噪：能量第 10 百分位的帧（按键前后的静音通常占多数）
+        noise_floor = min(sorted(rms)[nframes // 10], self._max_noise_rms)
+        threshold = max(self._min_rms, int(noise_floor * self._noise_factor))
+        soft_threshold = threshold // 2
+
+        voiced = [
+            r >= threshold or (r >= soft_threshold and c >= self._unvoiced_crossings)
+            for r, c in zip(rms, crossings)
+        ]
+
+        first: Optional[int] = None
+        last: Optional[int] = None
+        run = 0
+        for i, v in enumerate(voiced):
+            run = run + 1 if v else 0
+            if run >= self._min_run:
+                if first is None:
+                    first = i - run + 1
+                last = i
+
+        if first is None or last is None:
+            return None
+
+        start_frame = max(0, first - self._pad_frames)
+        end_frame = min(nframes, last + 1 + self._pad_frames)
+        end = len(pcm) if end_frame == nframes else end_frame * fb
+        return start_frame * fb, end
+
+    def trim(self, pcm: BytesLike) -> TrimResult:
+        """切掉前后静音；没有人声时 pcm 为空、has_speech=False。"""
+        view = memoryview(pcm)
+        span = self.speech_range(view)
+        if span is None:
+            return TrimResult(pcm=view[:0], has_speech=False, original_bytes=len(view), sample_rate=self.sample_rate)
+
+        start, end = span
+        return TrimResult(pcm=view[start:end], has_speech=True, original_bytes=len(view), sample_rate=self.sample_rate)
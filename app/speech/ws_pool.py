@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+# @File: ws_pool.py
+# @Author: yaccii
+# @Time: 2025-11-17 17:51
+# @Description:
+from __future__ import annotations
+
+import asyncio
+import ssl
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+import websocket
+from websockets.asyncio.client import ClientConnection, connect as ws_connect
+from websockets.protocol import State
+
+from app.infra.ylogger import ylogger
+
+# 讯飞鉴权：签名里的 date 与服务端时间相差超过 300 秒就拒绝握手；预热连接的复用时间不超过这个窗口
+SIGNATURE_TTL_SECONDS = 300.0
+
+
+def _refresh_ahead(max_idle: float) -> float:
+    """离过期还有这么久时就在后台建好替换连接（握手耗时远小于这个余量），旧连接在新连接入池后再关。"""
+    return min(2.0, max_idle / 4)
+
+
+class XfyunWsPool:
+    """
+    预先建好的讯飞 WebSocket 连接池（ASR / TTS 各一个）：
+
+    - 后台线程提前完成 签名 URL + DNS + TCP + TLS + WebSocket 升级，调用时直接拿一条已升级的连接
+    - 讯飞一条连接只跑一次会话，用完由服务端关闭，所以连接只出借、不归还，借出后后台立即补一条
+    - 始终保持 size 条热连接：每条在空闲满 max_idle 之前由后台先建好替换连接再关掉旧的，
+      闲了很久之后的第一次请求也不用现场握手；后台握手串行进行，每条连接每个 max_idle 周期最多换一次
+    - max_idle 可配置，上限是签名有效期 SIGNATURE_TTL_SECONDS；
+      服务端还会断开长时间不发数据的连接，空闲上限要小于这个时间
+    - 池空（突发并发 / 后台建连失败）时在调用线程里直接建连，行为和不使用连接池一样
+    """
+
+    def __init__(
+        self,
+        name: str,
+        url_factory: Callable[[], str],
+        sslopt: Optional[Dict[str, Any]] = None,
+        *,
+        size: int = 2,
+        max_idle: float = 8.0,
+        connect_timeout: float = 10.0,
+    ) -> None:
+        self._name = name
+        self._url_factory = url_factory
+        self._sslopt = sslopt or {}
+        self._size = max(0, size)
+        self._max_idle = min(max_idle, SIGNATURE_TTL_SECONDS)
+        self._connect_timeout = connect_timeout
+
+        self._refresh_ahead = _refresh_ahead(self._max_idle)
+
+        # (建立时间 time.monotonic(), 连接)，按建立时间先后排列
+        self._idle: Deque[Tuple[float, websocket.WebSocket]] = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+        self._hits = 0
+        self._misses = 0
+
+        self._thread: Optional[threading.Thread] = None
+        if self._size > 0:
+            self._thread = threading.Thread(target=self._run, name=f"xfyun-ws-pool-{name}", daemon=True)
+            self._thread.start()
+
+    def acquire(self) -> websocket.WebSocket:
+        """取一条已连好的连接；没有可用的就现连一条。"""
+        stale: List[websocket.WebSocket] = []
+        ws: Optional[websocket.WebSocket] = None
+        now = time.monotonic()
+        with self._cond:
+            while self._idle:
+                opened_at, candidate = self._idle.popleft()
+                if now - opened_at < self._max_idle and candidate.connected:
+                    ws = candidate
+                    break
+                stale.append(candidate)
+            if ws is not None:
+                self._hits += 1
+            else:
+                self._misses += 1
+            # 唤醒后台线程补连接
+            self._cond.notify()
+
+        for candidate in stale:
+            self._close_quietly(candidate)
+
+        if ws is not None:
+            return ws
+        return self.connect()
+
+    def connect(self) -> websocket.WebSocket:
+        return websocket.create_connection(
+            self._url_factory(),
+            timeout=self._connect_timeout,
+            sslopt=self._sslopt,
+        )
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            idle = [ws for _, ws in self._idle]
+            self._idle.clear()
+            self._cond.notify_all()
+        for ws in idle:
+            self._close_quietly(ws)
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {"idle": len(self._idle), "hits": self._hits, "misses": self._misses}
+
+    def _run(self) -> None:
+        backoff = 1.0
+        while True:
+            expired: List[websocket.WebSocket] = []
+            with self._cond:
+                if self._closed:
+                    return
+
+                now = time.monotonic()
+                while self._idle and now - self._idle[0][0] >= self._max_idle:
+                    # 正常情况下过期前就已经换掉；后台建连失败时才会走到这里
+                    expired.append(self._idle.popleft()[1])
+
+                if not expired and len(self._idle) >= self._size:
+                    refresh_at = self._idle[0][0] + self._max_idle - self._refresh_ahead
+                    if now < refresh_at:
+                        # 池已满：睡到最老的一条需要替换，或有连接被借走
+                        self._cond.wait(timeout=refresh_at - now)
+                        continue
+
+            for ws in expired:
+                self._close_quietly(ws)
+            if expired:
+                # 重新检查池内数量（期间可能有借出）
+                continue
+
+            try:
+                ws = self.connect()
+            except Exception as e:  # noqa: BLE001
+                ylogger.warning("Xfyun ws pool connect failed: pool=%s, retry in %.0fs, error=%s", self._name, backoff, e)
+                with self._cond:
+                    self._cond.wait(timeout=backoff)
+                backoff = min(backoff * 2, 30.0)
+                continue
+            backoff = 1.0
+
+            replaced: Optional[websocket.WebSocket] = None
+            with self._cond:
+                closed = self._closed
+                if not closed:
+                    self._idle.append((time.monotonic(), ws))
+                    if len(self._idle) > self._size:
+                        # 新连接替换快过期的最老一条
+                        replaced = self._idle.popleft()[1]
+            if replaced is not None:
+                self._close_quietly(replaced)
+            if closed:
+                self._close_quietly(ws)
+                return
+
+    @staticmethod
+    def _close_quietly(ws: websocket.WebSocket) -> None:
+        try:
+            ws.close(timeout=0)
+        except Exception:  # noqa: BLE001
+            pass
+
+
+def _ssl_context(sslopt: Dict[str, Any]) -> ssl.SSLContext:
+    """把 websocket-client 风格的 sslopt 转成 SSLContext。"""
+    if sslopt.get("cert_reqs", ssl.CERT_REQUIRED) == ssl.CERT_NONE:
+        ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        ctx.check_hostname = False
+        ctx.verify_mode = ssl.CERT_NONE
+        return ctx
+    return ssl.create_default_context(cafile=sslopt.get("ca_certs"))
+
+
+class AsyncXfyunWsPool:
+    """
+    XfyunWsPool 的 asyncio 版本，供事件循环上的异步 ASR / TTS 客户端使用：
+
+    - 补连、过期前替换由事件循环上的一个后台任务完成，不占线程
+    - 服务启动时调用 start() 在事件循环上开始预热；没调用时第一次 acquire 才开始（这一次现连）
+    - 后台任务在第一次 acquire 时绑定到当前事件循环；其他事件循环来取连接时直接现连
+    - 用完的连接交给 discard 在后台关闭，不在调用路径上等待关闭握手
+    """
+
+    def __init__(
+        self,
+        name: str,
+        url_factory: Callable[[], str],
+        sslopt: Optional[Dict[str, Any]] = None,
+        *,
+        size: int = 2,
+        max_idle: float = 8.0,
+        connect_timeout: float = 10.0,
+    ) -> None:
+        self._name = name
+        self._url_factory = url_factory
+        self._ssl = _ssl_context(sslopt or {})
+        self._size = max(0, size)
+        self._max_idle = min(max_idle, SIGNATURE_TTL_SECONDS)
+        self._connect_timeout = connect_timeout
+
+        self._refresh_ahead = _refresh_ahead(self._max_idle)
+
+        # (建立时间 loop.time(), 连接)，按建立时间先后排列
+        self._idle: Deque[Tuple[float, ClientConnection]] = deque()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._closing: Set[asyncio.Task] = set()
+        self._closed = False
+
+        self._hits = 0
+        self._misses = 0
+
+    def start(self) -> None:
+        """在当前事件循环上开始预热 / 补连（只需调用一次，重复调用无效果）。"""
+        if self._size > 0 and self._loop is None and not self._closed:
+            self._loop = asyncio.get_running_loop()
+            self._wakeup = asyncio.Event()
+            self._task = self._loop.create_task(self._run(), name=f"xfyun-ws-pool-{self._name}")
+
+    async def acquire(self) -> ClientConnection:
+        """取一条已连好的连接；没有可用的就现连一条。"""
+        loop = asyncio.get_running_loop()
+        self.start()
+
+        if loop is not self._loop:
+            return await self.connect()
+
+        ws: Optional[ClientConnection] = None
+        now = loop.time()
+        while self._idle:
+            opened_at, candidate = self._idle.popleft()
+            if now - opened_at < self._max_idle and candidate.state is State.OPEN:
+                ws = candidate
+                break
+            self.discard(candidate)
+
+        if self._wakeup is not None:
+            # 唤醒后台任务补连接
+            self._wakeup.set()
+
+        if ws is not None:
+            self._hits += 1
+            return ws
+        self._misses += 1
+        return await self.connect()
+
+    async def connect(self) -> ClientConnection:
+        url = self._url_factory()
+        return await ws_connect(
+            url,
+            ssl=self._ssl if url.startswith("wss://") else None,
+            open_timeout=self._connect_timeout,
+            close_timeout=1.0,
+            ping_interval=None,
+            max_size=None,
+        )
+
+    def discard(self, ws: ClientConnection) -> None:
+        """在后台关闭一条用过 / 过期的连接。"""
+        task = asyncio.get_running_loop().create_task(self._close_quietly(ws))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def close(self) -> None:
+        self._closed = True
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        while self._idle:
+            await self._close_quietly(self._idle.popleft()[1])
+
+    def stats(self) -> Dict[str, int]:
+        return {"idle": len(self._idle), "hits": self._hits, "misses": self._misses}
+
+    async def _run(self) -> None:
+        assert self._loop is not None and self._wakeup is not None
+        backoff = 1.0
+        while not self._closed:
+            now = self._loop.time()
+            while self._idle and now - self._idle[0][0] >= self._max_idle:
+                # 正常情况下过期前就已经换掉；后台建连失败时才会走到这里
+                self.discard(self._idle.popleft()[1])
+
+            if len(self._idle) >= self._size:
+                refresh_at = self._idle[0][0] + self._max_idle - self._refresh_ahead
+                if now < refresh_at:
+                    # 池已满：睡到最老的一条需要替换，或有连接被借走
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), refresh_at - now)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+            try:
+                ws = await self.connect()
+            except Exception as e:  # noqa: BLE001
+                ylogger.warning("Xfyun ws pool connect failed: pool=%s, retry in %.0fs, error=%s", self._name, backoff, e)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+                continue
+            backoff = 1.0
+            self._idle.append((self._loop.time(), ws))
+            if len(self._idle) > self._size:
+                # 新连接替换快过期的最老一条
+                self.discard(self._idle.popleft()[1])
+
+    @staticmethod
+    async def _close_quietly(ws: ClientConnection) -> None:
+        try:
+            await ws.close()
+        except Exception:  # noqa: BLE001
+            pass
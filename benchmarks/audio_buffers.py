@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+# @File: audio_buffers.py
+# @Author: yaccii
+# @Time: 2025-11-17 19:24
+# @Description:
+"""
+音频缓冲区的微基准：旧写法（bytes += / wave + BytesIO / 切片复制）对比 app.speech.audio_buffer。
+
+- tts：把 N 字节的 TTS 音频按小帧逐帧累积，再补静音、包成 WAV（bytes += 是平方级复制）
+- wav_in：上行 WAV 解析出 PCM，VAD 裁掉前后各一段，再切成 ASR 帧（只看复制开销，不算 VAD）
+- 每种场景报告单次耗时和峰值内存（tracemalloc）
+
+用法（项目根目录）：
+    python -m benchmarks.audio_buffers --seconds 20 --frame-bytes 1280
+"""
+from __future__ import annotations
+
+import argparse
+import io
+import time
+import tracemalloc
+import wave
+from typing import Callable, Dict, List, Tuple
+
+from app.speech.audio_buffer import PcmBuffer, parse_wav, pcm_to_wav
+
+_BYTES_PER_SECOND = 16000 * 2
+
+
+def _legacy_wav(pcm: bytes) -> bytes:
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(16000)
+        wf.writeframes(pcm)
+    return buf.getvalue()
+
+
+def _tts_legacy(frames: List[bytes]) -> int:
+    pcm = b""
+    for frame in frames:
+        pcm += frame
+    pcm += b"\x00" * 32000
+    return len(_legacy_wav(pcm))
+
+
+def _tts_buffer(frames: List[bytes]) -> int:
+    buf = PcmBuffer()
+    for frame in frames:
+        buf.append(frame)
+    buf.append_silence(32000)
+    return len(buf.wav())
+
+
+def _wav_in_legacy(wav_bytes: bytes, frame_bytes: int) -> int:
+    with wave.open(io.BytesIO(wav_bytes), "rb") as wf:
+        pcm = wf.readframes(wf.getnframes())
+    trimmed = pcm[_BYTES_PER_SECOND // 2:len(pcm) - _BYTES_PER_SECOND // 2]
+    return sum(len(trimmed[i:i + frame_bytes]) for i in range(0, len(trimmed), frame_bytes))
+
+
+def _wav_in_buffer(wav_bytes: bytes, frame_bytes: int) -> int:
+    _, pcm = parse_wav(wav_bytes)
+    trimmed = pcm[_BYTES_PER_SECOND // 2:len(pcm) - _BYTES_PER_SECOND // 2]
+    return sum(len(trimmed[i:i + frame_bytes]) for i in range(0, len(trimmed), frame_bytes))
+
+
+def _measure(fn: Callable[[], int], repeat: int) -> Tuple[float, int]:
+    """返回 (单次耗时 ms 的最小值, 峰值内存字节)。"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best * 1000, peak
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="音频缓冲区微基准（bytes += / wave 对比 PcmBuffer / parse_wav）")
+    parser.add_argument("--seconds", type=float, default=20.0, help="音频时长")
+    parser.add_argument("--frame-bytes", type=int, default=1280, help="TTS 每帧 PCM 字节数（默认 40ms）")
+    parser.add_argument("--asr-frame-bytes", type=int, default=8000, help="ASR 每帧 PCM 字节数")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    nbytes = int(args.seconds * _BYTES_PER_SECOND) // 2 * 2
+    pcm = bytes(range(256)) * (nbytes // 256) + bytes(nbytes % 256)
+    frames = [pcm[i:i + args.frame_bytes] for i in range(0, len(pcm), args.frame_bytes)]
+    wav_bytes = pcm_to_wav(pcm)
+    assert wav_bytes == _legacy_wav(pcm)
+
+    cases: Dict[str, Tuple[Callable[[], int], Callable[[], int]]] = {
+        "tts": (lambda: _tts_legacy(frames), lambda: _tts_buffer(frames)),
+        "wav_in": (
+            lambda: _wav_in_legacy(wav_bytes, args.asr_frame_bytes),
+            lambda: _wav_in_buffer(wav_bytes, args.asr_frame_bytes),
+        ),
+    }
+
+    print(f"audio={args.seconds:.0f}s ({nbytes}B), tts_frames={len(frames)}x{args.frame_bytes}B")
+    print(f"{'case':<8}{'legacy ms':>12}{'buffer ms':>12}{'speedup':>10}{'legacy peak':>14}{'buffer peak':>14}")
+    for name, (legacy, buffered) in cases.items():
+        legacy_ms, legacy_peak = _measure(legacy, args.repeat)
+        buffer_ms, buffer_peak = _measure(buffered, args.repeat)
+        print(
+            f"{name:<8}{legacy_ms:>12.2f}{buffer_ms:>12.2f}{legacy_ms / max(buffer_ms, 1e-6):>9.1f}x"
+            f"{legacy_peak / 1024:>12.0f}KB{buffer_peak / 1024:>12.0f}KB"
+        )
+
+
+if __name__ == "__main__":
+    main()
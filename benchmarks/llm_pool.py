@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+# @File: llm_pool.py
+# @Author: yaccii
+# @Time: 2025-11-17 19:24
+# @Description:
+"""
+对比大模型调用的两种写法在并发轮次下的吞吐：
+
+- legacy：同步 OpenAI 客户端 + asyncio.to_thread（旧 DeepSeekProvider），每个在途请求占一个默认线程池线程，
+  线程池只有 min(32, CPU 核数 + 4) 个线程
+- pooled：现在的 DeepSeekProvider（AsyncOpenAI + DEEPSEEK_MAX_CONNECTIONS 大小的 keep-alive 连接池）
+
+假的 OpenAI 兼容服务跑在子进程里，每个请求固定延迟 --latency-ms 后返回，模拟大模型生成耗时。
+N 个并发"轮次"各自连续发 M 个请求，报告总吞吐和 p50 / p95 延迟。
+
+用法（项目根目录）：
+    python -m benchmarks.llm_pool --concurrency 50 --requests 4 --latency-ms 500
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import Awaitable, Callable, List
+
+_REPLY = "小悠听到了，我们一起想想办法吧。"
+
+
+def _serve(port: int, latency_ms: float) -> None:
+    """子进程：最小的 /chat/completions 接口，固定延迟后返回一条回复。"""
+    import uvicorn
+    from starlette.applications import Starlette
+    from starlette.requests import Request
+    from starlette.responses import JSONResponse
+    from starlette.routing import Route
+
+    async def completions(request: Request) -> JSONResponse:
+        body = await request.json()
+        await asyncio.sleep(latency_ms / 1000)
+        return JSONResponse(
+            {
+                "id": "bench",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "bench"),
+                "choices": [
+                    {"index": 0, "message": {"role": "assistant", "content": _REPLY}, "finish_reason": "stop"}
+                ],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+            }
+        )
+
+    app = Starlette(routes=[Route("/chat/completions", completions, methods=["POST"])])
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning", backlog=4096)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_port(port: int, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"bench server not ready on port {port}")
+
+
+def _legacy_chat(base_url: str) -> Callable[[], Awaitable[str]]:
+    from openai import OpenAI
+
+    client = OpenAI(api_key="bench", base_url=base_url)
+
+    def _chat_sync() -> str:
+        resp = client.chat.completions.create(
+            model="bench", messages=[{"role": "user", "content": "你好"}], max_tokens=256, temperature=0.8
+        )
+        return resp.choices[0].message.content or ""
+
+    async def chat() -> str:
+        return await asyncio.to_thread(_chat_sync)
+
+    return chat
+
+
+def _pooled_chat() -> Callable[[], Awaitable[str]]:
+    from app.llm.deepseek_provider import DeepSeekProvider
+
+    provider = DeepSeekProvider()
+
+    async def chat() -> str:
+        return await provider.chat([{"role": "user", "content": "你好"}], "bench")
+
+    return chat
+
+
+async def _run(chat: Callable[[], Awaitable[str]], concurrency: int, requests: int) -> None:
+    latencies: List[float] = []
+
+    async def _turns() -> None:
+        for _ in range(requests):
+            started = time.perf_counter()
+            assert await chat() == _REPLY
+            latencies.append(time.perf_counter() - started)
+
+    # 先热身一次，建立连接
+    await chat()
+    started = time.perf_counter()
+    await asyncio.gather(*(_turns() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    total = len(latencies)
+    print(
+        f"requests={total} elapsed={elapsed:.2f}s throughput={total / elapsed:.1f} req/s "
+        f"p50={latencies[total // 2] * 1000:.0f}ms p95={latencies[int(total * 0.95) - 1] * 1000:.0f}ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="DeepSeekProvider 并发吞吐：同步客户端 + 线程 对比 异步连接池")
+    parser.add_argument("--concurrency", type=int, default=50, help="同时进行的轮次数")
+    parser.add_argument("--requests", type=int, default=4, help="每个轮次连续发几次请求")
+    parser.add_argument("--latency-ms", type=float, default=500.0, help="假服务每个请求的延迟")
+    parser.add_argument("--max-connections", type=int, default=64, help="pooled 的 DEEPSEEK_MAX_CONNECTIONS")
+    parser.add_argument("--mode", choices=("legacy", "pooled", "both"), default="both")
+    parser.add_argument("--serve", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        _serve(args.serve, args.latency_ms)
+        return
+
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.llm_pool", "--serve", str(port), "--latency-ms", str(args.latency_ms)]
+    )
+    try:
+        _wait_port(port)
+        os.environ["DEEPSEEK_API_KEY"] = "bench"
+        os.environ["DEEPSEEK_BASE_URL"] = base_url
+        os.environ["DEEPSEEK_MAX_CONNECTIONS"] = str(args.max_connections)
+
+        print(
+            f"concurrency={args.concurrency} requests={args.requests} latency={args.latency_ms:.0f}ms "
+            f"default_executor_threads={min(32, (os.cpu_count() or 1) + 4)}"
+        )
+        if args.mode in ("legacy", "both"):
+            print("legacy (OpenAI + to_thread): ", end="", flush=True)
+            asyncio.run(_run(_legacy_chat(base_url), args.concurrency, args.requests))
+        if args.mode in ("pooled", "both"):
+            print(f"pooled (AsyncOpenAI, max_connections={args.max_connections}): ", end="", flush=True)
+            asyncio.run(_run(_pooled_chat(), args.concurrency, args.requests))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
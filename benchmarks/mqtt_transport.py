@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+# @File: mqtt_transport.py
+# @Author: yaccii
+# @Time: 2025-11-17 19:24
+# @Description:
+"""
+对比网关两种 MQTT 收发方式（MQTT_TRANSPORT=asyncio / paho）的吞吐和每轮 CPU 开销。
+
+- 网关跑在子进程里，VoiceChatService 换成立即返回固定回复的桩，只测网关自身的收包 / 调度 / 发布
+- 压测端用 paho 线程客户端，N 个设备各发 M 条请求，收齐所有回复后结束
+- 子进程自己统计从就绪到结束的 CPU 时间，除以轮数得到每轮 CPU
+
+用法（项目根目录，先启动一个 MQTT broker）：
+    python -m benchmarks.mqtt_transport --host 127.0.0.1 --port 1883 --devices 50 --turns 20
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import types
+from typing import Dict, List
+
+import paho.mqtt.client as mqtt
+
+
+def _serve(transport: str, reply_bytes: int) -> None:
+    """子进程：启动网关，stdin 收到任意一行后退出并打印 CPU 统计。"""
+    os.environ["MQTT_TRANSPORT"] = transport
+    os.environ["MQTT_REPLY_MODE"] = "wav"
+    os.environ["MQTT_DEDUP_TTL_SECONDS"] = "0"
+    os.environ["MQTT_SESSION_IDLE_SECONDS"] = "0"
+    # 压测不希望触发过载保护
+    os.environ["MQTT_INTAKE_QUEUE_SIZE"] = "1000000"
+    os.environ["MQTT_MAX_PENDING_TURNS"] = "1000000"
+    os.environ["MQTT_MAX_PENDING_AUDIO_BYTES"] = str(1 << 40)
+
+    from app.mqtt import gateway as gw_module
+
+    reply_wav = gw_module._silence_wav_bytes(reply_bytes / 32000)
+
+    class _EchoVoiceService:
+        async def handle_turn(self, db, device_sn, wav_bytes, session_id=None, on_reply_audio=None, **kwargs):
+            return types.SimpleNamespace(
+                reply_wav_bytes=reply_wav, child_id=0, session_id=0, turn_id=0, asr_ms=0.0, trimmed_bytes=0
+            )
+
+        async def synthesize_wav(self, text: str) -> bytes:
+            return reply_wav
+
+        async def prewarm_tts_cache(self) -> int:
+            return 0
+
+        def tts_cache_stats(self) -> Dict[str, float]:
+            return {}
+
+        def reply_cache_stats(self) -> Dict[str, float]:
+            return {}
+
+        async def aclose(self) -> None:
+            return None
+
+    gateway = gw_module.MqttVoiceGateway()
+    gateway._voice_service = _EchoVoiceService()  # type: ignore[assignment]
+    threading.Thread(target=gateway.start, daemon=True).start()
+
+    while not gateway._client.is_connected():
+        time.sleep(0.05)
+    time.sleep(0.5)  # 等订阅生效
+
+    cpu_start = time.process_time()
+    print("READY", flush=True)
+    sys.stdin.readline()
+    cpu = time.process_time() - cpu_start
+    print(json.dumps({"cpu_seconds": cpu, **gateway.stats()}), flush=True)
+    os._exit(0)
+
+
+def _run_load(host: str, port: int, devices: int, turns: int, payload: bytes, timeout: float) -> Dict[str, float]:
+    total = devices * turns
+    received = 0
+    done = threading.Event()
+    lock = threading.Lock()
+    latencies: List[float] = []
+    sent_at: Dict[str, List[float]] = {f"bench-{i}": [] for i in range(devices)}
+
+    def on_message(client, userdata, msg) -> None:  # type: ignore[no-untyped-def]
+        nonlocal received
+        device_sn = msg.topic.split("/")[1]
+        now = time.perf_counter()
+        with lock:
+            queue = sent_at.get(device_sn)
+            if queue:
+                latencies.append(now - queue.pop(0))
+            received += 1
+            if received >= total:
+                done.set()
+
+    client = mqtt.Client(
+        mqtt.CallbackAPIVersion.VERSION2, client_id=f"bench-load-{os.getpid()}", clean_session=True
+    )
+    client.on_message = on_message
+    client.connect(host, port, keepalive=60)
+    client.subscribe("toy/+/voice/reply", qos=0)
+    client.loop_start()
+    time.sleep(0.5)
+
+    started = time.perf_counter()
+    for _ in range(turns):
+        for device_sn in sent_at:
+            with lock:
+                sent_at[device_sn].append(time.perf_counter())
+            client.publish(f"toy/{device_sn}/voice/request", payload)
+    finished = done.wait(timeout)
+    elapsed = time.perf_counter() - started
+
+    client.loop_stop()
+    client.disconnect()
+
+    latencies.sort()
+    return {
+        "sent": total,
+        "received": received,
+        "completed": float(finished),
+        "elapsed_s": elapsed,
+        "turns_per_s": received / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": latencies[len(latencies) // 2] * 1000 if latencies else 0.0,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else 0.0,
+    }
+
+
+def _bench(transport: str, args: argparse.Namespace) -> Dict[str, float]:
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.mqtt_transport", "--serve", transport, "--reply-bytes", str(args.reply_bytes)],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        text=True,
+        env={**os.environ, "MQTT_BROKER_HOST": args.host, "MQTT_BROKER_PORT": str(args.port)},
+    )
+    assert proc.stdin is not None and proc.stdout is not None
+    try:
+        for line in proc.stdout:
+            if line.strip() == "READY":
+                break
+        else:
+            raise RuntimeError(f"网关子进程启动失败: transport={transport}")
+
+        result = _run_load(args.host, args.port, args.devices, args.turns, b"\x00" * args.payload_bytes, args.timeout)
+
+        proc.stdin.write("stop\n")
+        proc.stdin.flush()
+        gateway_stats = json.loads(proc.stdout.readline())
+    finally:
+        proc.kill()
+        proc.wait()
+
+    result["gateway_cpu_s"] = gateway_stats["cpu_seconds"]
+    result["shed"] = gateway_stats.get("shed_total", 0)
+    result["cpu_ms_per_turn"] = gateway_stats["cpu_seconds"] * 1000 / max(1, result["received"])
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="MQTT 网关收发方式压测（asyncio vs paho 线程）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--devices", type=int, default=50, help="模拟设备数")
+    parser.add_argument("--turns", type=int, default=20, help="每个设备发送的请求数")
+    parser.add_argument("--payload-bytes", type=int, default=32000, help="每条请求大小（默认 1 秒 16k 音频）")
+    parser.add_argument("--reply-bytes", type=int, default=32000, help="每条回复的 PCM 大小")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--transport", choices=["asyncio", "paho", "both"], default="both")
+    parser.add_argument("--serve", choices=["asyncio", "paho"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        _serve(args.serve, args.reply_bytes)
+        return
+
+    transports = ["asyncio", "paho"] if args.transport == "both" else [args.transport]
+    print(f"devices={args.devices}, turns/device={args.turns}, payload={args.payload_bytes}B, reply={args.reply_bytes}B")
+    print(f"{'transport':<10}{'turns/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'cpu ms/turn':>14}{'received':>14}{'shed':>8}")
+    for transport in transports:
+        r = _bench(transport, args)
+        print(
+            f"{transport:<10}{r['turns_per_s']:>10.1f}{r['p50_ms']:>10.1f}{r['p99_ms']:>10.1f}"
+            f"{r['cpu_ms_per_turn']:>14.3f}{int(r['received']):>8}/{int(r['sent']):<5}{int(r['shed']):>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+# @File: xfyun_emulator.py
+# @Author: yaccii
+# @Time: 2025-11-17 19:24
+# @Description:
+"""
+讯飞 ASR（/v2/iat）/ TTS（/v2/tts）WebSocket 协议的本地模拟服务，离线压测整条语音链路，不消耗讯飞额度。
+
+- 握手：只检查 authorization / date / host 参数是否齐全（不校验签名），可模拟握手耗时（TLS + 鉴权）
+- ASR：按讯飞的帧格式收音频，每收到 --partial-every-ms 的音频下发一段中间结果（带 sn，dwa=wpgs 时带 pgs），
+       收到结束帧后等 --asr-final-ms 下发最终结果；识别文本从预置话术（或 --transcripts 文件）中随机选
+- TTS：按文本长度生成提示音（或回放 --tts-wav），首帧等 --tts-first-ms，之后按 --tts-rtf 倍实时速度分帧下发
+- --error-rate 比例的会话返回讯飞格式的错误码，用来压测失败路径
+
+用法（项目根目录）：
+    python -m benchmarks.xfyun_emulator --port 8790
+    XFYUN_WS_BASE_URL=ws://127.0.0.1:8790 python mqtt_service.py
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import json
+import math
+import random
+import uuid
+import wave
+from collections import Counter
+from http import HTTPStatus
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from websockets.asyncio.server import ServerConnection, serve
+from websockets.exceptions import ConnectionClosed
+from websockets.http11 import Request, Response
+
+_BYTES_PER_SECOND = 16000 * 2
+
+_DEFAULT_TRANSCRIPTS = [
+    "今天天气怎么样",
+    "给我讲一个恐龙的故事吧",
+    "为什么天空是蓝色的",
+    "我今天在幼儿园画了一只小猫",
+    "你喜欢吃什么水果呀",
+    "我们来玩猜谜语好不好",
+]
+
+# 讯飞错误码里常见的两个：引擎繁忙 / 会话超时
+_ERRORS = [
+    (10800, "over max connect limit"),
+    (10114, "session timeout"),
+]
+
+
+class _Emulator:
+    def __init__(self, args: argparse.Namespace) -> None:
+        self._args = args
+        self._transcripts = _load_transcripts(args.transcripts)
+        self._tts_pcm = _load_wav(args.tts_wav) if args.tts_wav else None
+        # 1 秒提示音，按需平铺，避免每次逐样本生成
+        self._tone = b"".join(
+            int(3000 * math.sin(2 * math.pi * 330 * i / 16000)).to_bytes(2, "little", signed=True)
+            for i in range(16000)
+        )
+        self.stats: Counter = Counter()
+
+    async def process_request(self, connection: ServerConnection, request: Request) -> Optional[Response]:
+        parts = urlsplit(request.path)
+        if parts.path not in ("/v2/iat", "/v2/tts"):
+            return connection.respond(HTTPStatus.NOT_FOUND, "not found\n")
+        query = parse_qs(parts.query)
+        if not all(query.get(k) for k in ("authorization", "date", "host")):
+            self.stats["unauthorized"] += 1
+            return connection.respond(HTTPStatus.UNAUTHORIZED, "missing authorization / date / host\n")
+
+        # 模拟 TLS + 鉴权的握手耗时
+        await asyncio.sleep(self._args.connect_ms / 1000)
+        return None
+
+    async def handle(self, ws: ServerConnection) -> None:
+        path = urlsplit(ws.request.path).path if ws.request else ""
+        try:
+            if path == "/v2/iat":
+                await self._asr(ws)
+            else:
+                await self._tts(ws)
+        except ConnectionClosed:
+            self.stats["client_closed"] += 1
+
+    async def _asr(self, ws: ServerConnection) -> None:
+        sid = f"iat{uuid.uuid4().hex[:16]}"
+        self.stats["asr_sessions"] += 1
+        transcript = random.choice(self._transcripts)
+        pieces = [transcript[i:i + 2] for i in range(0, len(transcript), 2)]
+        partial_every = max(1, int(self._args.partial_every_ms * _BYTES_PER_SECOND / 1000))
+        fail = random.random() < self._args.error_rate
+
+        wpgs = False
+        audio_bytes = 0
+        sent = 0
+        sn = 0
+        async for message in ws:
+            data = json.loads(message)
+            if "business" in data:
+                wpgs = data["business"].get("dwa") == "wpgs"
+            if fail:
+                await self._send_error(ws, sid, "asr")
+                return
+
+            frame = data.get("data") or {}
+            audio_bytes += len(base64.b64decode(frame.get("audio") or ""))
+
+            # 中间结果：每 partial_every 字节音频出一段，最后一段留给最终结果
+            while sent < len(pieces) - 1 and audio_bytes >= (sent + 1) * partial_every:
+                sn += 1
+                await ws.send(_asr_result(sid, sn, pieces[sent], status=1, wpgs=wpgs))
+                sent += 1
+
+            if frame.get("status") == 2:
+                await asyncio.sleep(self._args.asr_final_ms / 1000)
+                sn += 1
+                await ws.send(_asr_result(sid, sn, "".join(pieces[sent:]), status=2, wpgs=wpgs))
+                self.stats["asr_audio_seconds"] += audio_bytes // _BYTES_PER_SECOND
+                return
+
+    async def _tts(self, ws: ServerConnection) -> None:
+        sid = f"tts{uuid.uuid4().hex[:16]}"
+        self.stats["tts_sessions"] += 1
+        data = json.loads(await ws.recv())
+        text = base64.b64decode((data.get("data") or {}).get("text") or "").decode("utf-8", errors="replace")
+        if random.random() < self._args.error_rate:
+            await self._send_error(ws, sid, "tts")
+            return
+
+        if self._tts_pcm is not None:
+            pcm = self._tts_pcm
+        else:
+            nbytes = int(len(text) * self._args.tts_ms_per_char * _BYTES_PER_SECOND / 1000) // 2 * 2
+            pcm = (self._tone * (nbytes // len(self._tone) + 1))[:nbytes]
+
+        chunk = self._args.tts_chunk_bytes
+        interval = chunk / _BYTES_PER_SECOND / self._args.tts_rtf
+        await asyncio.sleep(self._args.tts_first_ms / 1000)
+        for offset in range(0, max(len(pcm), 1), chunk):
+            last = offset + chunk >= len(pcm)
+            await ws.send(
+                json.dumps(
+                    {
+                        "code": 0,
+                        "message": "success",
+                        "sid": sid,
+                        "data": {
+                            "audio": base64.b64encode(pcm[offset:offset + chunk]).decode("ascii"),
+                            "status": 2 if last else 1,
+                        },
+                    }
+                )
+            )
+            if not last:
+                await asyncio.sleep(interval)
+
+    async def _send_error(self, ws: ServerConnection, sid: str, kind: str) -> None:
+        code, message = random.choice(_ERRORS)
+        self.stats[f"{kind}_errors"] += 1
+        await ws.send(json.dumps({"code": code, "message": message, "sid": sid}))
+
+
+def _asr_result(sid: str, sn: int, text: str, *, status: int, wpgs: bool) -> str:
+    result: Dict[str, Any] = {
+        "sn": sn,
+        "ls": status == 2,
+        "bg": 0,
+        "ed": 0,
+        "ws": [{"bg": 0, "cw": [{"sc": 0, "w": text}]}],
+    }
+    if wpgs:
+        result["pgs"] = "apd"
+    return json.dumps(
+        {"code": 0, "message": "success", "sid": sid, "data": {"status": status, "result": result}},
+        ensure_ascii=False,
+    )
+
+
+def _load_transcripts(path: Optional[str]) -> List[str]:
+    if not path:
+        return list(_DEFAULT_TRANSCRIPTS)
+    with open(path, "r", encoding="utf-8") as f:
+        lines = [line.strip() for line in f if line.strip()]
+    return lines or list(_DEFAULT_TRANSCRIPTS)
+
+
+def _load_wav(path: str) -> bytes:
+    with wave.open(path, "rb") as wf:
+        if (wf.getnchannels(), wf.getsampwidth(), wf.getframerate()) != (1, 2, 16000):
+            raise SystemExit(f"--tts-wav 需要 16k 单声道 16bit WAV: {path}")
+        return wf.readframes(wf.getnframes())
+
+
+async def _serve(args: argparse.Namespace) -> None:
+    emulator = _Emulator(args)
+    async with serve(
+        emulator.handle,
+        args.host,
+        args.port,
+        process_request=emulator.process_request,
+        max_size=None,
+        ping_interval=None,
+    ):
+        print(f"Xfyun emulator listening on ws://{args.host}:{args.port} (/v2/iat, /v2/tts)", flush=True)
+        try:
+            await asyncio.Future()
+        finally:
+            print(f"stats: {dict(emulator.stats)}", flush=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="讯飞 ASR / TTS WebSocket 协议本地模拟服务（压测用）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--connect-ms", type=float, default=60, help="握手耗时（模拟 TLS + 鉴权）")
+    parser.add_argument("--partial-every-ms", type=float, default=400, help="ASR 每收到多少毫秒音频下发一次中间结果")
+    parser.add_argument("--asr-final-ms", type=float, default=200, help="ASR 收到结束帧到下发最终结果的耗时")
+    parser.add_argument("--tts-first-ms", type=float, default=150, help="TTS 首帧耗时")
+    parser.add_argument("--tts-rtf", type=float, default=5.0, help="TTS 合成速度（实时的倍数）")
+    parser.add_argument("--tts-ms-per-char", type=float, default=250, help="生成音频时每个字的时长")
+    parser.add_argument("--tts-chunk-bytes", type=int, default=8192, help="TTS 每帧 PCM 字节数")
+    parser.add_argument("--tts-wav", help="TTS 固定回放的 WAV（16k 单声道 16bit），不填则按文本长度生成提示音")
+    parser.add_argument("--transcripts", help="ASR 识别话术文件，一行一条")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回错误码的会话比例（0~1）")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
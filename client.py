@@ -17,14 +17,45 @@
 from __future__ import annotations
 
 import argparse
+import io
 import os
+import random
 import threading
 import time
 import wave
-from typing import Optional
+from typing import Callable, Dict, Optional
 
 import paho.mqtt.client as mqtt
 
+from app.mqtt.protocol import (
+    FLAG_END,
+    FLAG_START,
+    REQUEST_CHUNK_MAGIC,
+    decode_chunk,
+    encode_chunk,
+    is_wav_payload,
+    pack_audio,
+    unpack_audio,
+)
+from app.speech.codec import CODEC_IDS, CODEC_PCM, ChunkEncoder, codec_name, decode_to_pcm, encode_pcm
+
+
+def pcm_to_wav_bytes(pcm: bytes, sample_rate: int = 16000) -> bytes:
+    """把 16bit 单声道 PCM 包装成 WAV 字节。"""
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes(pcm)
+    return buf.getvalue()
+
+
+def wav_to_pcm(wav_bytes: bytes) -> bytes:
+    """从 WAV 字节中取出裸 PCM。"""
+    with wave.open(io.BytesIO(wav_bytes), "rb") as wf:
+        return wf.readframes(wf.getnframes())
+
 
 def load_and_check_wav(path: str) -> bytes:
     """读取 WAV 文件并校验为 16k / 单声道 / 16bit。"""
@@ -57,13 +88,18 @@ class MqttVoiceClient:
         broker_port: int,
         device_sn: str,
         timeout: int = 30,
+        stream_reply: bool = False,
+        codec: int = CODEC_PCM,
     ) -> None:
         self._broker_host = broker_host
         self._broker_port = broker_port
         self._device_sn = device_sn
         self._timeout = timeout
+        self._stream_reply = stream_reply
+        self._codec = codec
 
         self._client = mqtt.Client(
+            mqtt.CallbackAPIVersion.VERSION2,
             client_id=f"test-client-{int(time.time())}",
             clean_session=True,
         )
@@ -71,34 +107,161 @@ class MqttVoiceClient:
         self._reply_event = threading.Event()
         self._reply_bytes: Optional[bytes] = None
 
+        # 流式回复重组状态
+        self._sent_at: float = 0.0
+        self._stream_id: Optional[int] = None
+        self._stream_chunks: Dict[int, bytes] = {}
+        self._stream_sample_rate: int = 16000
+        self._first_chunk_at: Optional[float] = None
+
         self._client.on_connect = self._on_connect
         self._client.on_message = self._on_message
 
 
-    def _on_connect(self, client: mqtt.Client, userdata, flags, rc) -> None:  # type: ignore[override]
-        if rc == 0:
+    def _on_connect(  # type: ignore[override]
+        self, client: mqtt.Client, userdata, flags, reason_code, properties=None
+    ) -> None:
+        if not reason_code.is_failure:
             print(f"[MQTT] 连接成功 {self._broker_host}:{self._broker_port}")
         else:
-            print(f"[MQTT] 连接失败 rc={rc}")
+            print(f"[MQTT] 连接失败 reason_code={reason_code}")
 
     def _on_message(self, client: mqtt.Client, userdata, msg: mqtt.MQTTMessage) -> None:  # type: ignore[override]
         topic = msg.topic
         payload = msg.payload
         print(f"[MQTT] 收到消息: topic={topic}, bytes={len(payload)}")
 
+        if self._stream_reply:
+            self._on_reply_chunk(topic, payload)
+            return
+
         expected_topic = f"toy/{self._device_sn}/voice/reply"
         if topic != expected_topic:
             print(f"[MQTT] 非预期 topic, 忽略: {topic}")
             return
 
-        self._reply_bytes = payload
+        print(f"[MQTT] 收到整段回复: 耗时={(time.time() - self._sent_at) * 1000:.0f} ms")
+        if is_wav_payload(payload):
+            self._reply_bytes = payload
+        else:
+            codec, sample_rate, data = unpack_audio(payload)
+            print(f"[MQTT] 压缩回复: codec={codec_name(codec)}, 线上字节={len(payload)}")
+            self._reply_bytes = pcm_to_wav_bytes(decode_to_pcm(data, codec), sample_rate)
         self._reply_event.set()
 
 
+    def _on_reply_chunk(self, topic: str, payload: bytes) -> None:
+        """重组 toy/{sn}/voice/reply/chunk 分片，收到结束分片后拼成完整 WAV。"""
+        expected_topic = f"toy/{self._device_sn}/voice/reply/chunk"
+        if topic != expected_topic:
+            print(f"[MQTT] 非预期 topic, 忽略: {topic}")
+            return
+
+        try:
+            chunk = decode_chunk(payload)
+        except ValueError as e:
+            print(f"[MQTT] 分片解析失败, 忽略: {e}")
+            return
+
+        if self._stream_id is None:
+            self._stream_id = chunk.stream_id
+            self._stream_sample_rate = chunk.sample_rate
+        elif chunk.stream_id != self._stream_id:
+            print(f"[MQTT] 其他回复流的分片, 忽略: stream_id={chunk.stream_id}")
+            return
+
+        if self._first_chunk_at is None and chunk.audio:
+            self._first_chunk_at = time.time()
+            print(f"[MQTT] 首个音频分片到达: {(self._first_chunk_at - self._sent_at) * 1000:.0f} ms")
+
+        self._stream_chunks[chunk.seq] = decode_to_pcm(chunk.audio, chunk.codec) if chunk.audio else b""
+
+        if not chunk.is_end:
+            return
+
+        if chunk.is_error:
+            print("[MQTT] 服务端异常结束回复流，保存已收到的部分")
+
+        missing = [i for i in range(chunk.seq + 1) if i not in self._stream_chunks]
+        if missing:
+            print(f"[MQTT] 回复流缺少分片: {missing}")
+
+        pcm = b"".join(self._stream_chunks[i] for i in sorted(self._stream_chunks))
+        print(
+            f"[MQTT] 回复流结束: 分片数={len(self._stream_chunks)}, "
+            f"总耗时={(time.time() - self._sent_at) * 1000:.0f} ms"
+        )
+        self._reply_bytes = pcm_to_wav_bytes(pcm, self._stream_sample_rate)
+        self._reply_event.set()
+
     def send_and_wait_reply(self, wav_bytes: bytes) -> bytes:
         """发送语音请求并阻塞等待回复 WAV 字节。"""
         request_topic = f"toy/{self._device_sn}/voice/request"
-        reply_topic = f"toy/{self._device_sn}/voice/reply"
+        if self._codec == CODEC_PCM:
+            payload = wav_bytes
+        else:
+            payload = pack_audio(self._codec, encode_pcm(wav_to_pcm(wav_bytes), self._codec))
+
+        def publish() -> None:
+            print(
+                f"[MQTT] 发布语音请求: topic={request_topic}, bytes={len(payload)}, "
+                f"codec={codec_name(self._codec)}"
+            )
+            self._sent_at = time.time()
+            self._client.publish(request_topic, payload)
+
+        return self._request(publish)
+
+    def stream_and_wait_reply(self, pcm: bytes, frame_ms: int = 40) -> bytes:
+        """
+        模拟边录边传：按实时速度把 PCM 分片发到 request/chunk，
+        耗时从发出结束分片（孩子松开按键）开始计算。
+        """
+        request_topic = f"toy/{self._device_sn}/voice/request/chunk"
+        frame_size = 16000 * 2 * frame_ms // 1000
+        stream_id = random.getrandbits(32)
+        encoder = ChunkEncoder(self._codec)
+
+        def publish() -> None:
+            print(
+                f"[MQTT] 开始流式上传: topic={request_topic}, bytes={len(pcm)}, "
+                f"帧长={frame_ms}ms"
+            )
+            seq = 0
+            self._client.publish(
+                request_topic,
+                encode_chunk(stream_id, seq, b"", flags=FLAG_START, codec=self._codec, magic=REQUEST_CHUNK_MAGIC),
+            )
+            seq += 1
+
+            started = time.time()
+            for offset in range(0, len(pcm), frame_size):
+                is_last_frame = offset + frame_size >= len(pcm)
+                data = encoder.encode(pcm[offset:offset + frame_size], final=is_last_frame)
+                self._client.publish(
+                    request_topic,
+                    encode_chunk(stream_id, seq, data, codec=self._codec, magic=REQUEST_CHUNK_MAGIC),
+                )
+                seq += 1
+                # 按实时节奏发送（对齐到录音时间轴，避免累计漂移）
+                delay = started + (offset + frame_size) / (16000 * 2) - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+
+            self._sent_at = time.time()
+            self._client.publish(
+                request_topic,
+                encode_chunk(stream_id, seq, b"", flags=FLAG_END, codec=self._codec, magic=REQUEST_CHUNK_MAGIC),
+            )
+            print(f"[MQTT] 流式上传结束: 分片数={seq + 1}")
+
+        return self._request(publish)
+
+    def _request(self, publish: Callable[[], None]) -> bytes:
+        if self._stream_reply:
+            reply_topic = f"toy/{self._device_sn}/voice/reply/chunk"
+        else:
+            reply_topic = f"toy/{self._device_sn}/voice/reply"
         # 连接 broker
         self._client.connect(self._broker_host, self._broker_port, keepalive=60)
 
@@ -111,8 +274,7 @@ class MqttVoiceClient:
 
         try:
             # 发送请求
-            print(f"[MQTT] 发布语音请求: topic={request_topic}, bytes={len(wav_bytes)}")
-            self._client.publish(request_topic, wav_bytes)
+            publish()
 
             # 等待回复
             if not self._reply_event.wait(self._timeout):
@@ -182,6 +344,26 @@ def main() -> None:
         help="等待回复超时时间（秒，默认 30）",
     )
 
+    parser.add_argument(
+        "--stream-reply",
+        action="store_true",
+        help="订阅 reply/chunk 流式回复并重组（默认接收整段 WAV）",
+    )
+
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="按实时速度分片上传到 request/chunk（模拟边录边传），默认整段发送",
+    )
+
+    parser.add_argument(
+        "--codec",
+        type=str,
+        choices=sorted(CODEC_IDS),
+        default="pcm",
+        help="线上音频编码：pcm（默认，整段 WAV）/ ulaw（2:1）/ adpcm（4:1），回复按同样编码返回",
+    )
+
     args = parser.parse_args()
 
     wav_bytes = load_and_check_wav(args.input_wav)
@@ -190,9 +372,14 @@ def main() -> None:
         broker_port=args.port,
         device_sn=args.device_sn,
         timeout=args.timeout,
+        stream_reply=args.stream_reply,
+        codec=CODEC_IDS[args.codec],
     )
 
-    reply_bytes = client.send_and_wait_reply(wav_bytes)
+    if args.stream:
+        reply_bytes = client.stream_and_wait_reply(wav_to_pcm(wav_bytes))
+    else:
+        reply_bytes = client.send_and_wait_reply(wav_bytes)
     save_reply_wav(reply_bytes, args.output_dir, args.device_sn)
 
 